@@ -1,9 +1,20 @@
 import inspect
-from typing import List, Dict, Union, Tuple
+from typing import Any, List, Dict, Optional, Union, Tuple
 from .base import BaseNode
-from .nodes import Node, Program
+from .codegen import emit_python
+from .events import get_event_registry
+from .instrument import INSTRUMENT_PREFIX
+from .nodes import Func, Node, Program
+from .routes import get_route_table
+from .optimizer import (
+    INLINE_THRESHOLD,
+    UNROLL_LIMIT,
+    report_assertions,
+    run_ast_passes,
+    run_passes,
+)
 from .utils import TealishMap
-from .types import _structs
+from .types import BitsType, StateSchema, _structs
 
 
 class TealWriter:
@@ -73,7 +84,16 @@ class OneLineTealWriter:
 
 
 class TealishCompiler:
-    def __init__(self, source_lines: List[str]) -> None:
+    def __init__(
+        self,
+        source_lines: List[str],
+        profile: Optional[Dict[int, int]] = None,
+        instrument: bool = False,
+        optimize: Optional[List[str]] = None,
+        inline_threshold: int = INLINE_THRESHOLD,
+        unroll_limit: int = UNROLL_LIMIT,
+        report_assertions: bool = False,
+    ) -> None:
         self.source_lines = source_lines
         self.output: List[str] = []
         self.source_map: Dict[int, int] = {}
@@ -88,6 +108,30 @@ class TealishCompiler:
         self.processed = False
         self.line_nodes = {}
         self.use_inner_txns_macro = None
+        # Keys of global & local state and the keys pooled in the bytecblock
+        self.state_schemas: Dict[str, StateSchema] = {
+            "global": StateSchema("global"),
+            "local": StateSchema("local"),
+        }
+        self.state_keys: List[str] = []
+        # Signatures of the ARC-28 events logged by ARC28Event (in order of use)
+        self.event_signatures: Dict[str, None] = {}
+        # Routes of the router by name (see get_route_table)
+        self.routes: Dict[str, Node] = {}
+        # Profiled hits per tealish line (used for profile guided layout & inlining)
+        self.profile: Dict[int, int] = profile or {}
+        self.reports: Dict[str, List[str]] = {}
+        # Profiled calls per func name
+        self.call_counts: Dict[str, int] = {}
+        # Log OpcodeBudget at entry & exit of each func and route
+        self.instrument = instrument
+        self.instrumented_names: Dict[int, str] = {}
+        # Names of the optimizer passes to run on the output
+        self.optimize: List[str] = optimize or []
+        self.inline_threshold = inline_threshold
+        self.unroll_limit = unroll_limit
+        # Report the runtime type assertions kept in the output & why
+        self.report_assertions = report_assertions
 
     def consume_line(self) -> str:
         if self.line_no == len(self.source_lines):
@@ -118,6 +162,9 @@ class TealishCompiler:
             self.source_map[self.current_output_line] = line_no
             self.current_output_line += 1
 
+    def report(self, name: str, message: str) -> None:
+        self.reports.setdefault(name, []).append(message)
+
     def parse(self) -> None:
         node = Program.consume(self, None)
         self.nodes.append(node)
@@ -137,11 +184,32 @@ class TealishCompiler:
             self.parse()
         if not self.processed:
             self.process()
+        if self.optimize:
+            run_ast_passes(self)
+        if self.report_assertions:
+            report_assertions(self)
         for node in self.nodes:
             node.write_teal(self.writer)
+        if self.profile:
+            self.report_call_counts()
         self.source_map = self.writer.source_map
         self.output = self.writer.output
-        return self.writer.output
+        if self.optimize:
+            lines = [
+                (teal, self.source_map[i + 1]) for i, teal in enumerate(self.output)
+            ]
+            lines = run_passes(self, lines)
+            self.output = [teal for teal, _ in lines]
+            self.source_map = {i + 1: line_no for i, (_, line_no) in enumerate(lines)}
+        return self.output
+
+    def report_call_counts(self) -> None:
+        """Reports profiled call counts of functions (used to select funcs to inline)."""
+        funcs = self.nodes[0].find_child_nodes(Func)
+        self.call_counts = {f.name: f.get_body_hits() for f in funcs}
+        for name, count in sorted(self.call_counts.items(), key=lambda x: -x[1]):
+            if count:
+                self.report("pgo", f"func {name}: {count} calls")
 
     def reformat(self) -> str:
         if not self.nodes:
@@ -156,13 +224,30 @@ class TealishCompiler:
         map.errors = dict(self.error_messages)
         return map
 
+    def get_instrumentation(self) -> Dict[str, Any]:
+        return {
+            "prefix": INSTRUMENT_PREFIX.hex(),
+            "names": dict(self.instrumented_names),
+        }
+
+    def get_routes(self) -> List[Dict[str, Any]]:
+        """Returns the dispatch table of the router (see tealish.routes)."""
+        return get_route_table(self.routes.values())
+
     def get_structs(self):
         return dict(_structs)
 
 
-def compile_program(source: str) -> Tuple[List[str], TealishMap]:
+def compile_program(
+    source: str,
+    profile: Optional[Dict[int, int]] = None,
+    instrument: bool = False,
+    optimize: Optional[List[str]] = None,
+) -> Tuple[List[str], TealishMap]:
     source_lines = source.split("\n")
-    compiler = TealishCompiler(source_lines)
+    compiler = TealishCompiler(
+        source_lines, profile=profile, instrument=instrument, optimize=optimize
+    )
     teal = compiler.compile()
     return teal, compiler.get_map()
 
@@ -182,15 +267,43 @@ def inspect_program(source: str):
     structs = compiler.get_structs()
     structs_output = {}
     for s in structs:
-        fields = [(name, structs[s].fields[name]) for name in structs[s].fields]
+        fields = {}
+        for name, f in structs[s].fields.items():
+            fields[name] = {
+                "type": str(f.tealish_type),
+                "size": f.size,
+                "offset": f.offset,
+            }
+            # bit fields are in the byte at offset, from the most significant bit
+            if isinstance(f.tealish_type, BitsType):
+                fields[name]["bit_offset"] = f.tealish_type.bit_offset
+                fields[name]["bits"] = f.tealish_type.bits
         structs_output[s] = {
             "size": structs[s].size,
-            "fields": {
-                name: {"type": str(f.tealish_type), "size": f.size, "offset": f.offset}
-                for name, f in fields
-            },
+            "fields": fields,
+        }
+    state_output = {}
+    for scope, schema in compiler.state_schemas.items():
+        keys = {}
+        for name, f in schema.fields.items():
+            keys[name] = {"key": f.key, "type": str(f.tealish_type)}
+        state_output[scope] = {
+            "num_uints": schema.num_uints,
+            "num_byte_slices": schema.num_byte_slices,
+            "keys": keys,
         }
     output = {
         "structs": structs_output,
+        "state": state_output,
+        "events": get_event_registry(compiler.event_signatures),
+        "routes": compiler.get_routes(),
     }
     return output
+
+
+def emit_python_codecs(source: str) -> str:
+    """Returns a Python module with a codec class for each struct of a program."""
+    source_lines = source.split("\n")
+    compiler = TealishCompiler(source_lines)
+    compiler.compile()
+    return emit_python(compiler.get_structs())
@@ -3,11 +3,11 @@ from tealish.errors import CompileError
 from .tealish_builtins import ConstValue, Var
 from .langspec import get_active_langspec, Op
 from .scope import Scope
-from .types import TealishType, get_type_instance
+from .types import BitsType, BoxType, StructType, TealishType, get_type_instance
 
 
 if TYPE_CHECKING:
-    from . import TealWriter
+    from . import TealishCompiler, TealWriter
     from .nodes import Block, Node, Func
 
 lang_spec = get_active_langspec()
@@ -90,6 +90,8 @@ class BaseNode:
             type = get_type_instance(type_name)
         except KeyError:
             raise CompileError(f'Unknown type "{type_name}"', node=self)
+        if isinstance(type, BitsType):
+            raise CompileError(f"{type} is only a type of struct fields", node=self)
 
         var = scope.declare_scratch_var(name, type, max_slot=max_slot)
 
@@ -130,6 +132,21 @@ class BaseNode:
                 return True
         return False
 
+    def find_child_nodes(self, node_class: type) -> List["Node"]:
+        found = []
+        for node in getattr(self, "nodes", []):
+            if isinstance(node, node_class):
+                found.append(node)
+            found += node.find_child_nodes(node_class)
+        return found
+
+    def get_compiler(self) -> "TealishCompiler":
+        """Returns the compiler of the nearest node (expressions have none of their own)."""
+        node = self
+        while getattr(node, "compiler", None) is None:
+            node = node.parent  # type: ignore
+        return node.compiler  # type: ignore
+
     def get_current_scope(self) -> Scope:
         # TODO: Only available on Node and other subclasses
         return self.parent.get_current_scope()  # type: ignore
@@ -152,6 +169,22 @@ class BaseNode:
     def lookup_var(self, name: str) -> Var:
         return self.get_scope().lookup_var(name)
 
+    def resolve_fields(
+        self, path: str, struct: TealishType, fields: List[str]
+    ) -> Tuple[int, TealishType]:
+        """Returns the offset & type of a (nested) field of a struct, e.g. `order.item.name`."""
+        offset = 0
+        for field in fields:
+            if not isinstance(struct, (StructType, BoxType)):
+                raise CompileError(f"{path} is not a struct", node=self)
+            if field not in struct.fields:
+                raise CompileError(f'{path} has no field "{field}"', node=self)
+            struct_field = struct.fields[field]
+            offset += struct_field.offset
+            struct = struct_field.tealish_type
+            path += f".{field}"
+        return offset, struct
+
     def lookup_const(self, name: str) -> Tuple["TealishType", ConstValue]:
         return self.get_scope().lookup_const(name)
 
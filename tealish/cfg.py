@@ -0,0 +1,555 @@
+"""
+Control flow graph & dataflow analysis of compiled Teal.
+
+The compiler output is split into basic blocks (straight line code entered only
+at the top & left only at the bottom) connected by branch & fall through edges.
+`callsub` doesn't end a block; the called label is recorded as a call of the block
+and treated as an entry point of its own. Analyses of scratch slots are
+intra-procedural and conservative at calls because funcs share the scratch space.
+
+Example:
+    cfg = CFG(lines)
+    live_in, live_out = solve(cfg, Liveness(cfg))
+"""
+import heapq
+from typing import (
+    Dict,
+    FrozenSet,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+# A line of Teal output & the Tealish line it maps to
+Line = Tuple[str, int]
+
+# Ops whose immediate args are labels
+BRANCH_OPS = {"b", "bz", "bnz", "callsub", "match", "switch"}
+# Ops after which execution doesn't continue with the next op
+TERMINATOR_OPS = {"b", "return", "err", "retsub"}
+# Number of scratch slots
+NUM_SLOTS = 256
+ALL_SLOTS = frozenset(range(NUM_SLOTS))
+
+
+def iter_code_indexes(teal: str) -> Iterator[int]:
+    """Yields the indexes of the characters of Teal outside string literals."""
+    in_string = False
+    i = 0
+    while i < len(teal):
+        c = teal[i]
+        if in_string and c == "\\":
+            i += 1
+        elif c == '"':
+            in_string = not in_string
+        elif not in_string:
+            yield i
+        i += 1
+
+
+def split_comment(teal: str) -> Tuple[str, str]:
+    """Splits a line of Teal into (code, comment) without leading indentation."""
+    teal = teal.strip()
+    for i in iter_code_indexes(teal):
+        if teal.startswith("//", i):
+            return teal[:i].strip(), teal[i:]
+    return teal, ""
+
+
+def split_ops(code: str) -> List[str]:
+    """Splits code into its `; ` separated ops (not splitting string literals)."""
+    ops = []
+    start = 0
+    for i in iter_code_indexes(code):
+        if code.startswith("; ", i):
+            ops.append(code[start:i])
+            start = i + 2
+    ops.append(code[start:])
+    return [op.strip() for op in ops if op.strip()]
+
+
+def split_label(code: str) -> Tuple[Optional[str], str]:
+    """Splits code into (label, ops). Labels can be followed by ops on the same line."""
+    first, _, rest = code.partition(" ")
+    if first.endswith(":") and '"' not in first:
+        return first[:-1], rest.strip()
+    return None, code
+
+
+def get_ops(teal: str) -> List[str]:
+    """Returns the ops of a line of Teal (lines may contain many `; ` separated ops)."""
+    code, _ = split_comment(teal)
+    _, code = split_label(code)
+    return split_ops(code)
+
+
+def get_label(teal: str) -> Optional[str]:
+    """Returns the label defined by a line of Teal or None."""
+    code, _ = split_comment(teal)
+    label, _ = split_label(code)
+    return label
+
+
+def get_branch_targets(teal: str) -> List[str]:
+    targets = []
+    for op in get_ops(teal):
+        opcode, *args = op.split()
+        if opcode in BRANCH_OPS:
+            targets += args
+    return targets
+
+
+def is_code(teal: str) -> bool:
+    code, _ = split_comment(teal)
+    return bool(code)
+
+
+# Ops that end a basic block
+BLOCK_END_OPS = BRANCH_OPS - {"callsub"} | TERMINATOR_OPS
+
+
+def rename_labels(teal: str, renames: Dict[str, str]) -> str:
+    """Renames label definitions & branch targets of a line of Teal."""
+    label = get_label(teal)
+    if label not in renames and not any(
+        target in renames for target in get_branch_targets(teal)
+    ):
+        return teal
+    indent = teal[: len(teal) - len(teal.lstrip())]
+    code, comment = split_comment(teal)
+    label, code = split_label(code)
+    ops = []
+    for op in split_ops(code):
+        opcode, *args = op.split()
+        if opcode in BRANCH_OPS:
+            op = " ".join([opcode] + [renames.get(a, a) for a in args])
+        ops.append(op)
+    teal = "; ".join(ops)
+    if label is not None:
+        teal = f"{renames.get(label, label)}: {teal}".strip()
+    teal = indent + teal
+    if comment:
+        teal += " " + comment
+    return teal
+
+
+class BasicBlock:
+    def __init__(self, index: int, start: int) -> None:
+        self.index = index
+        # lines [start, end) of the output. Comments preceding a label belong to its block.
+        self.start = start
+        self.end = start
+        self.labels: List[str] = []
+        # (line index, op)
+        self.ops: List[Tuple[int, str]] = []
+        self.successors: List["BasicBlock"] = []
+        self.predecessors: List["BasicBlock"] = []
+        # labels called with callsub
+        self.calls: List[str] = []
+
+    @property
+    def last_opcode(self) -> Optional[str]:
+        if self.ops:
+            return self.ops[-1][1].split()[0]
+        return None
+
+    @property
+    def falls_through(self) -> bool:
+        return self.last_opcode not in TERMINATOR_OPS
+
+    def __repr__(self) -> str:
+        return f"<BasicBlock {self.index} {self.labels} lines {self.start}:{self.end}>"
+
+
+class CFG:
+    """The control flow graph of a list of Teal lines."""
+
+    def __init__(self, lines: List[Line]) -> None:
+        self.lines = lines
+        self.blocks: List[BasicBlock] = []
+        self.labels: Dict[str, BasicBlock] = {}
+        self.build()
+
+    def build(self) -> None:
+        block = self.new_block(0)
+        for i, (teal, _) in enumerate(self.lines):
+            label = get_label(teal)
+            if label is not None:
+                if block.ops:
+                    block = self.new_block(i)
+                block.labels.append(label)
+                self.labels[label] = block
+            for op in get_ops(teal):
+                if block.ops and block.ops[-1][1].split()[0] in BLOCK_END_OPS:
+                    block = self.new_block(i)
+                block.ops.append((i, op))
+                if op.startswith("callsub "):
+                    block.calls.append(op.split()[1])
+            block.end = i + 1
+            if block.ops and block.last_opcode in BLOCK_END_OPS:
+                block = self.new_block(i + 1)
+        if not block.ops and not block.labels and block.end == block.start:
+            self.blocks.pop()
+
+        for block in self.blocks:
+            targets = []
+            if block.ops:
+                opcode, *args = block.ops[-1][1].split()
+                if opcode in BLOCK_END_OPS:
+                    targets = [self.labels[a] for a in args if a in self.labels]
+            if block.falls_through and block.index + 1 < len(self.blocks):
+                targets.insert(0, self.blocks[block.index + 1])
+            for target in targets:
+                if target not in block.successors:
+                    block.successors.append(target)
+                    target.predecessors.append(block)
+
+    def new_block(self, start: int) -> BasicBlock:
+        block = BasicBlock(len(self.blocks), start)
+        self.blocks.append(block)
+        return block
+
+    @property
+    def entry(self) -> BasicBlock:
+        return self.blocks[0]
+
+    def get_entries(self) -> List[BasicBlock]:
+        """Returns the program entry & the entries of called subroutines."""
+        entries = [self.entry]
+        for block in self.blocks:
+            for label in block.calls:
+                if label in self.labels and self.labels[label] not in entries:
+                    entries.append(self.labels[label])
+        return entries
+
+    def reachable(self) -> Set[int]:
+        """Returns the indexes of blocks reachable from the program entry (following calls)."""
+        seen: Set[int] = set()
+        stack = [self.entry]
+        while stack:
+            block = stack.pop()
+            if block.index in seen:
+                continue
+            seen.add(block.index)
+            stack += block.successors
+            stack += [
+                self.labels[label] for label in block.calls if label in self.labels
+            ]
+        return seen
+
+    def postorder(self) -> List[BasicBlock]:
+        """Returns all blocks in postorder of a depth first traversal from the entries."""
+        seen: Set[int] = set()
+        order: List[BasicBlock] = []
+        roots = self.get_entries() + self.blocks
+        for root in roots:
+            if root.index in seen:
+                continue
+            seen.add(root.index)
+            stack = [(root, iter(root.successors))]
+            while stack:
+                block, successors = stack[-1]
+                for successor in successors:
+                    if successor.index not in seen:
+                        seen.add(successor.index)
+                        stack.append((successor, iter(successor.successors)))
+                        break
+                else:
+                    stack.pop()
+                    order.append(block)
+        return order
+
+
+T = TypeVar("T")
+
+
+class DataflowAnalysis(Generic[T]):
+    """
+    A dataflow problem solved by `solve`.
+
+    Forward analyses compute the value at the end of each block from the meet of
+    the values at the end of its predecessors. Backward analyses the value at the
+    start of each block from the meet of the values at the start of its successors.
+    """
+
+    forward = True
+
+    def boundary(self, block: BasicBlock) -> T:
+        """The value flowing into blocks without predecessors (or successors if backward)."""
+        raise NotImplementedError()
+
+    def initial(self) -> T:
+        """The value of blocks not yet visited (the identity of `meet`)."""
+        raise NotImplementedError()
+
+    def meet(self, values: List[T]) -> T:
+        raise NotImplementedError()
+
+    def transfer(self, block: BasicBlock, value: T) -> T:
+        raise NotImplementedError()
+
+
+def solve(cfg: CFG, analysis: DataflowAnalysis[T]) -> Tuple[Dict[int, T], Dict[int, T]]:
+    """
+    Solves a dataflow analysis with a worklist in (reverse) postorder.
+
+    Returns the values at the start & end of each block, by block index.
+    Acyclic graphs are solved with one visit per block & each loop adds a visit.
+    """
+    order = cfg.postorder()
+    if analysis.forward:
+        order.reverse()
+    values_in: Dict[int, T] = {b.index: analysis.initial() for b in cfg.blocks}
+    values_out: Dict[int, T] = {b.index: analysis.initial() for b in cfg.blocks}
+    if analysis.forward:
+        before, after = values_in, values_out
+    else:
+        before, after = values_out, values_in
+    position = {block.index: i for i, block in enumerate(order)}
+    worklist = list(range(len(order)))
+    pending = set(worklist)
+    while worklist:
+        i = heapq.heappop(worklist)
+        pending.remove(i)
+        block = order[i]
+        if analysis.forward:
+            sources, targets = block.predecessors, block.successors
+        else:
+            sources, targets = block.successors, block.predecessors
+        if sources:
+            before[block.index] = analysis.meet([after[s.index] for s in sources])
+        else:
+            before[block.index] = analysis.boundary(block)
+        value = analysis.transfer(block, before[block.index])
+        if value != after[block.index]:
+            after[block.index] = value
+            for target in targets:
+                j = position[target.index]
+                if j not in pending:
+                    pending.add(j)
+                    heapq.heappush(worklist, j)
+    return values_in, values_out
+
+
+def get_slot_op(op: str) -> Tuple[Optional[str], Optional[int]]:
+    """Returns ("load" | "store", slot) for scratch ops with a constant slot."""
+    opcode, *args = op.split()
+    if opcode in ("load", "store") and args and args[0].isdigit():
+        return opcode, int(args[0])
+    return None, None
+
+
+def clobbers_scratch(op: str) -> bool:
+    """Whether an op may read or write any scratch slot (calls & dynamic scratch ops)."""
+    return op.split()[0] in ("callsub", "loads", "stores")
+
+
+# A definition of a scratch slot: (line index, slot). A slot of None means any slot.
+Definition = Tuple[int, Optional[int]]
+
+
+class ReachingDefinitions(DataflowAnalysis[FrozenSet[Definition]]):
+    """The `store`s of each slot that may reach a block."""
+
+    def boundary(self, block: BasicBlock) -> FrozenSet[Definition]:
+        return frozenset()
+
+    def initial(self) -> FrozenSet[Definition]:
+        return frozenset()
+
+    def meet(self, values: List[FrozenSet[Definition]]) -> FrozenSet[Definition]:
+        return frozenset().union(*values)
+
+    def transfer(
+        self, block: BasicBlock, value: FrozenSet[Definition]
+    ) -> FrozenSet[Definition]:
+        defs = set(value)
+        for i, op in block.ops:
+            kind, slot = get_slot_op(op)
+            if kind == "store":
+                defs = {d for d in defs if d[1] != slot}
+                defs.add((i, slot))
+            elif clobbers_scratch(op):
+                defs.add((i, None))
+        return frozenset(defs)
+
+
+def get_routines(cfg: CFG) -> Dict[int, Set[int]]:
+    """Returns the entries (program or subroutine) whose code includes each block, by block index."""
+    routines: Dict[int, Set[int]] = {block.index: set() for block in cfg.blocks}
+    for entry in cfg.get_entries():
+        stack = [entry]
+        while stack:
+            block = stack.pop()
+            if entry.index in routines[block.index]:
+                continue
+            routines[block.index].add(entry.index)
+            stack += block.successors
+    return routines
+
+
+def get_callees(cfg: CFG, routines: Dict[int, Set[int]]) -> Dict[int, Set[int]]:
+    """Returns the entries each routine may call, directly or indirectly, by entry index."""
+    calls: Dict[int, Set[int]] = {entry.index: set() for entry in cfg.get_entries()}
+    for block in cfg.blocks:
+        for label in block.calls:
+            if label not in cfg.labels:
+                continue
+            for entry in routines[block.index]:
+                calls[entry].add(cfg.labels[label].index)
+    callees: Dict[int, Set[int]] = {}
+    for entry in calls:
+        seen: Set[int] = set()
+        stack = list(calls[entry])
+        while stack:
+            callee = stack.pop()
+            if callee not in seen:
+                seen.add(callee)
+                stack += calls.get(callee, set())
+        callees[entry] = seen
+    return callees
+
+
+class Liveness(DataflowAnalysis[FrozenSet[int]]):
+    """
+    The slots that may be loaded before being stored again after a point.
+
+    Without a CFG all slots are live at calls & returns. With the CFG of the analysed
+    code, slots only used by one non recursive routine (the program or a subroutine)
+    are private to it: they are dead when it returns & not touched by the subroutines
+    it calls.
+    """
+
+    forward = False
+
+    def __init__(self, cfg: Optional[CFG] = None) -> None:
+        self.cfg = cfg
+        # slot => entry index of the routine using it
+        self.private: Dict[int, int] = {}
+        if cfg is not None:
+            self.routines = get_routines(cfg)
+            self.callees = get_callees(cfg, self.routines)
+            self.private = self.get_private_slots(cfg)
+
+    def get_private_slots(self, cfg: CFG) -> Dict[int, int]:
+        owners: Dict[int, Set[int]] = {}
+        for block in cfg.blocks:
+            for _, op in block.ops:
+                kind, slot = get_slot_op(op)
+                if slot is not None:
+                    owners.setdefault(slot, set()).update(self.routines[block.index])
+                    if len(self.routines[block.index]) != 1:
+                        # shared or unreachable code
+                        owners[slot].add(-1)
+                elif op.split()[0] in ("loads", "stores"):
+                    return {}
+        return {
+            slot: entry
+            for slot, (entry, *others) in owners.items()
+            if not others and entry >= 0 and entry not in self.callees[entry]
+        }
+
+    def boundary(self, block: BasicBlock) -> FrozenSet[int]:
+        # the caller of a subroutine can read any slot, except those private to
+        # routines that can't be the caller
+        if block.last_opcode == "retsub":
+            if self.cfg is None:
+                return ALL_SLOTS
+            routines = self.routines[block.index]
+            return ALL_SLOTS - {
+                slot
+                for slot, entry in self.private.items()
+                if not self.callees[entry] & routines
+            }
+        return frozenset()
+
+    def initial(self) -> FrozenSet[int]:
+        return frozenset()
+
+    def meet(self, values: List[FrozenSet[int]]) -> FrozenSet[int]:
+        return frozenset().union(*values)
+
+    def transfer(self, block: BasicBlock, value: FrozenSet[int]) -> FrozenSet[int]:
+        live = set(value)
+        for _, op in reversed(block.ops):
+            live = self.transfer_op(op, live)
+        return frozenset(live)
+
+    def transfer_op(self, op: str, live: Set[int]) -> Set[int]:
+        """Returns the slots live before an op from those live after it."""
+        kind, slot = get_slot_op(op)
+        if kind == "store":
+            live.discard(slot)
+        elif kind == "load":
+            live.add(slot)
+        elif clobbers_scratch(op):
+            opcode, *args = op.split()
+            if (
+                self.cfg is None
+                or opcode != "callsub"
+                or args[0] not in self.cfg.labels
+            ):
+                return set(ALL_SLOTS)
+            # the called subroutine (& its callees) can read any slot not private to others
+            callee = self.cfg.labels[args[0]].index
+            called = self.callees[callee] | {callee}
+            live |= {
+                slot
+                for slot in ALL_SLOTS
+                if slot not in self.private or self.private[slot] in called
+            }
+        return live
+
+
+class ConstantPropagation(DataflowAnalysis[Optional[Dict[int, int]]]):
+    """
+    The slots holding a known int constant at a point.
+
+    A slot is constant after `store` directly following `pushint`/`int` or a `load`
+    of a constant slot. `None` is the value of unvisited blocks.
+    """
+
+    def boundary(self, block: BasicBlock) -> Optional[Dict[int, int]]:
+        return {}
+
+    def initial(self) -> Optional[Dict[int, int]]:
+        return None
+
+    def meet(self, values: List[Optional[Dict[int, int]]]) -> Optional[Dict[int, int]]:
+        visited = [v for v in values if v is not None]
+        if not visited:
+            return None
+        result = dict(visited[0])
+        for value in visited[1:]:
+            result = {k: v for k, v in result.items() if value.get(k) == v}
+        return result
+
+    def transfer(
+        self, block: BasicBlock, value: Optional[Dict[int, int]]
+    ) -> Optional[Dict[int, int]]:
+        if value is None:
+            return None
+        constants = dict(value)
+        # the constant pushed by the previous op, if any
+        top: Optional[int] = None
+        for _, op in block.ops:
+            opcode, *args = op.split()
+            kind, slot = get_slot_op(op)
+            if kind == "store":
+                if top is not None:
+                    constants[slot] = top  # type: ignore
+                else:
+                    constants.pop(slot, None)  # type: ignore
+            elif clobbers_scratch(op):
+                constants.clear()
+            if opcode in ("pushint", "int") and args and args[0].isdigit():
+                top = int(args[0])
+            elif kind == "load":
+                top = constants.get(slot)  # type: ignore
+            else:
+                top = None
+        return constants
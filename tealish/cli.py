@@ -1,8 +1,13 @@
 import json
 import pathlib
 import click
-from typing import List, Optional, Tuple, IO
-from tealish import compile_program, inspect_program, reformat_program
+from typing import Dict, List, Optional, Tuple, IO
+from tealish import (
+    TealishCompiler,
+    emit_python_codecs,
+    inspect_program,
+    reformat_program,
+)
 from tealish.errors import CompileError, ParseError
 from tealish.langspec import (
     fetch_langspec,
@@ -11,6 +16,9 @@ from tealish.langspec import (
     local_lang_spec,
 )
 from tealish.build import assemble_with_goal, assemble_with_algod
+from tealish.instrument import CostHistogram, read_transactions_file
+from tealish.optimizer import AST_PASSES, INLINE_THRESHOLD, PASSES, UNROLL_LIMIT
+from tealish.profile import Profile, get_line_functions, load_line_hits
 from tealish.utils import TealishMap
 
 
@@ -19,6 +27,12 @@ def _build(
     assembler: Optional[str] = None,
     algod_url: Optional[str] = None,
     quiet: bool = False,
+    profile_data: Optional[pathlib.Path] = None,
+    instrument: bool = False,
+    optimize: Optional[List[str]] = None,
+    inline_threshold: int = INLINE_THRESHOLD,
+    unroll_limit: int = UNROLL_LIMIT,
+    report_assertions: bool = False,
 ) -> None:
     paths: List[pathlib.Path]
     if path.is_dir():
@@ -36,11 +50,42 @@ def _build(
         teal_filename = output_path / f"{base_filename}.teal"
         if not quiet:
             click.echo(f"Compiling {path} to {teal_filename}")
-        teal, tealish_map = _compile_program(open(path).read())
+        source = open(path).read()
+        profile = None
+        if profile_data:
+            try:
+                profile = load_line_hits(json.load(open(profile_data)), source)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        teal, compiler = _compile_program(
+            source,
+            profile=profile,
+            instrument=instrument,
+            optimize=optimize,
+            inline_threshold=inline_threshold,
+            unroll_limit=unroll_limit,
+            report_assertions=report_assertions,
+            quiet=quiet,
+        )
+        tealish_map = compiler.get_map()
         teal_string = "\n".join(teal + [""])
         with open(teal_filename, "w") as f:
             f.write("\n".join(teal + [""]))
 
+        if instrument:
+            instrument_filename = output_path / f"{base_filename}.instrument.json"
+            if not quiet:
+                click.echo(f"Writing instrumentation ids to {instrument_filename}")
+            with open(instrument_filename, "w") as f:
+                json.dump(compiler.get_instrumentation(), f, indent=2)
+
+        if compiler.routes:
+            routes_filename = output_path / f"{base_filename}.routes.json"
+            if not quiet:
+                click.echo(f"Writing dispatch table to {routes_filename}")
+            with open(routes_filename, "w") as f:
+                json.dump(compiler.get_routes(), f, indent=2)
+
         if assembler:
             tok_filename = output_path / f"{base_filename}.teal.tok"
             if assembler == "goal":
@@ -81,14 +126,36 @@ def _build(
                 f.write(json.dumps(tealish_map.as_dict()).replace("],", "],\n"))
 
 
-def _compile_program(source: str) -> Tuple[List[str], TealishMap]:
+def _compile_program(
+    source: str,
+    profile: Optional[Dict[int, int]] = None,
+    instrument: bool = False,
+    optimize: Optional[List[str]] = None,
+    inline_threshold: int = INLINE_THRESHOLD,
+    unroll_limit: int = UNROLL_LIMIT,
+    report_assertions: bool = False,
+    quiet: bool = False,
+) -> Tuple[List[str], TealishCompiler]:
+    compiler = TealishCompiler(
+        source.split("\n"),
+        profile=profile,
+        instrument=instrument,
+        optimize=optimize,
+        inline_threshold=inline_threshold,
+        unroll_limit=unroll_limit,
+        report_assertions=report_assertions,
+    )
     try:
-        teal, map = compile_program(source)
+        teal = compiler.compile()
     except ParseError as e:
         raise click.ClickException(str(e))
     except CompileError as e:
         raise click.ClickException(str(e))
-    return teal, map
+    if not quiet:
+        for name, messages in compiler.reports.items():
+            for message in messages:
+                click.echo(f"[{name}] {message}")
+    return teal, compiler
 
 
 @click.group(context_settings=dict(help_option_names=["-h", "--help"]))
@@ -100,12 +167,84 @@ def cli(ctx: click.Context, quiet: bool) -> None:
     ctx.obj["quiet"] = quiet
 
 
+profile_data_option = click.option(
+    "--profile-data",
+    type=click.Path(exists=True, path_type=pathlib.Path),
+    help="Profile (from `tealish profile --pgo`) used to optimise code layout",
+)
+
+instrument_option = click.option(
+    "--instrument",
+    is_flag=True,
+    help="Log the opcode budget used by each func & route (see `tealish costs`)",
+)
+
+
+def optimize_options(f):
+    f = click.option(
+        "--report-assertions",
+        is_flag=True,
+        help="List the runtime type assertions kept in the output & why",
+    )(f)
+    f = click.option(
+        "--unroll-limit",
+        type=int,
+        default=UNROLL_LIMIT,
+        show_default=True,
+        help="Max ops of loops unrolled by the unroll optimization",
+    )(f)
+    f = click.option(
+        "--inline-threshold",
+        type=int,
+        default=INLINE_THRESHOLD,
+        show_default=True,
+        help="Max ops of funcs inlined by the inline optimization",
+    )(f)
+    f = click.option(
+        "--optimize",
+        "-O",
+        "optimize",
+        multiple=True,
+        type=click.Choice(["all"] + list(AST_PASSES) + list(PASSES)),
+        help="Optimization pass to run (repeatable)",
+    )(f)
+    return f
+
+
+def get_passes(optimize: Tuple[str, ...]) -> List[str]:
+    if "all" in optimize:
+        return list(AST_PASSES) + list(PASSES)
+    return list(optimize)
+
+
 @click.command()
 @click.argument("path", type=click.Path(exists=True, path_type=pathlib.Path))
+@profile_data_option
+@instrument_option
+@optimize_options
 @click.pass_context
-def compile(ctx: click.Context, path: pathlib.Path) -> None:
+def compile(
+    ctx: click.Context,
+    path: pathlib.Path,
+    profile_data: Optional[pathlib.Path],
+    instrument: bool,
+    optimize: Tuple[str, ...],
+    inline_threshold: int,
+    unroll_limit: int,
+    report_assertions: bool,
+) -> None:
     """Compile .tl to .teal"""
-    _build(path, assembler=None, quiet=ctx.obj["quiet"])
+    _build(
+        path,
+        assembler=None,
+        quiet=ctx.obj["quiet"],
+        profile_data=profile_data,
+        instrument=instrument,
+        optimize=get_passes(optimize),
+        inline_threshold=inline_threshold,
+        unroll_limit=unroll_limit,
+        report_assertions=report_assertions,
+    )
 
 
 @click.command()
@@ -128,12 +267,35 @@ def compile(ctx: click.Context, path: pathlib.Path) -> None:
     show_default=True,
     help="Algod URL to use for compiling TEAL",
 )
+@profile_data_option
+@instrument_option
+@optimize_options
 @click.pass_context
 def build(
-    ctx: click.Context, path: pathlib.Path, assembler: str, algod_url: str
+    ctx: click.Context,
+    path: pathlib.Path,
+    assembler: str,
+    algod_url: str,
+    profile_data: Optional[pathlib.Path],
+    instrument: bool,
+    optimize: Tuple[str, ...],
+    inline_threshold: int,
+    unroll_limit: int,
+    report_assertions: bool,
 ) -> None:
     """Compile .tl to .teal & assemble .teal to .tok (bytecode) & output sourcemap"""
-    _build(path, assembler=assembler, algod_url=algod_url, quiet=ctx.obj["quiet"])
+    _build(
+        path,
+        assembler=assembler,
+        algod_url=algod_url,
+        quiet=ctx.obj["quiet"],
+        profile_data=profile_data,
+        instrument=instrument,
+        optimize=get_passes(optimize),
+        inline_threshold=inline_threshold,
+        unroll_limit=unroll_limit,
+        report_assertions=report_assertions,
+    )
 
 
 @click.command()
@@ -153,17 +315,109 @@ def format(ctx: click.Context, tealish_file: IO) -> None:
 
 @click.command()
 @click.argument("tealish_file", type=click.File("r"))
+@click.option(
+    "--emit-python",
+    is_flag=True,
+    help="Output a Python module of codecs of the structs instead of JSON",
+)
 @click.pass_context
-def inspect(ctx: click.Context, tealish_file: IO) -> None:
+def inspect(ctx: click.Context, tealish_file: IO, emit_python: bool) -> None:
     """Inspect a tealish program"""
     input = tealish_file.read()
     try:
+        if emit_python:
+            print(emit_python_codecs(input), end="")
+            return
         output = inspect_program(input)
     except ParseError as e:
         raise click.ClickException(str(e))
     print(json.dumps(output, indent=2))
 
 
+@click.command()
+@click.argument("tealish_file", type=click.Path(exists=True, path_type=pathlib.Path))
+@click.argument(
+    "trace_files", nargs=-1, required=True, type=click.File("r"), metavar="TRACE..."
+)
+@click.option(
+    "--map",
+    "map_path",
+    type=click.Path(exists=True, path_type=pathlib.Path),
+    help="Source map produced by `tealish build` [default: build/{name}.map.json]",
+)
+@click.option(
+    "--json",
+    "json_path",
+    type=click.Path(path_type=pathlib.Path),
+    help="Write a JSON report of per line & per function totals to this path",
+)
+@click.option(
+    "--pgo",
+    "pgo_path",
+    type=click.Path(path_type=pathlib.Path),
+    help="Write a profile for `tealish build --profile-data` to this path",
+)
+@click.pass_context
+def profile(
+    ctx: click.Context,
+    tealish_file: pathlib.Path,
+    trace_files: Tuple[IO, ...],
+    map_path: Optional[pathlib.Path],
+    json_path: Optional[pathlib.Path],
+    pgo_path: Optional[pathlib.Path],
+) -> None:
+    """Profile a tealish program using execution traces (JSON or NDJSON pcs)"""
+    if map_path is None:
+        base_filename = tealish_file.name.replace(".tl", "")
+        map_path = tealish_file.parent / "build" / f"{base_filename}.map.json"
+        if not map_path.exists():
+            raise click.ClickException(
+                f"Source map {map_path} not found. Run `tealish build` first."
+            )
+    source = open(tealish_file).read()
+    tealish_map = TealishMap(json.load(open(map_path)))
+    try:
+        line_functions = get_line_functions(source)
+    except ParseError as e:
+        raise click.ClickException(str(e))
+
+    result = Profile(tealish_map, line_functions)
+    for trace_file in trace_files:
+        result.add_trace_file(trace_file)
+
+    click.echo("\n".join(result.annotate(source.split("\n"))))
+    if not ctx.obj["quiet"]:
+        click.echo("")
+        click.echo(f"{result.steps} steps")
+        for name, cost in result.function_totals().items():
+            click.echo(f"{cost:>10}  {name}")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(result.as_dict(), f, indent=2)
+    if pgo_path:
+        with open(pgo_path, "w") as f:
+            json.dump(result.pgo_dict(source), f, indent=2)
+
+
+@click.command()
+@click.argument("instrument_file", type=click.File("r"))
+@click.argument(
+    "txn_files", nargs=-1, required=True, type=click.File("r"), metavar="TXNS..."
+)
+@click.pass_context
+def costs(ctx: click.Context, instrument_file: IO, txn_files: Tuple[IO, ...]) -> None:
+    """
+    Per func & route cost histograms from the transactions of an instrumented build.
+    Transactions are algod/indexer JSON (a list, {"transactions": [...]} or NDJSON)
+    """
+    instrumentation = json.load(instrument_file)
+    names = {int(k): v for k, v in instrumentation["names"].items()}
+    histogram = CostHistogram(names)
+    for txn_file in txn_files:
+        histogram.add_transactions(read_transactions_file(txn_file))
+    click.echo(json.dumps(histogram.as_dict(), indent=2))
+
+
 @click.group()
 def langspec() -> None:
     """Tools to support new Teal versions by updating the langspec file"""
@@ -269,3 +523,5 @@ cli.add_command(format)
 cli.add_command(langspec)
 cli.add_command(stats)
 cli.add_command(inspect)
+cli.add_command(profile)
+cli.add_command(costs)
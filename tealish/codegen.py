@@ -0,0 +1,213 @@
+"""
+Generates Python codecs of structs, e.g. to decode box values off chain.
+
+Each struct becomes a class with `__slots__` and a precompiled `struct.Struct` of its
+layout: big-endian uints, fixed size bytes & the fields of nested structs flattened.
+Decoding a record is a single `unpack_from` (and `iter_unpack` for buffers of records).
+
+Example:
+    module = emit_python(compiler.get_structs())
+"""
+import keyword
+from typing import Dict, List, Tuple
+
+from .types import BitsType, BytesType, IntType, StructType
+
+# struct formats of big-endian uints of each size
+UINT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+# names of the generated methods
+RESERVED_NAMES = {"decode", "encode", "iter_unpack", "from_values", "to_values"}
+
+HEADER = '''"""
+Codecs of Tealish structs, generated by `tealish inspect --emit-python`.
+"""
+import struct
+from typing import Iterator, Tuple
+'''
+
+
+def get_attribute_name(field_name: str) -> str:
+    if keyword.iskeyword(field_name) or field_name in RESERVED_NAMES:
+        return field_name + "_"
+    return field_name
+
+
+def get_annotation(tealish_type: BytesType) -> str:
+    if isinstance(tealish_type, BitsType) and tealish_type.name == "bool":
+        return "bool"
+    elif isinstance(tealish_type, IntType):
+        return "int"
+    elif isinstance(tealish_type, StructType):
+        return f'"{tealish_type.name}"'
+    return "bytes"
+
+
+def get_format(struct: StructType) -> str:
+    """Returns the struct format of the fields of a struct, nested structs flattened."""
+    format = ""
+    bits_offset = None
+    for field in struct.fields.values():
+        t = field.tealish_type
+        if isinstance(t, BitsType):
+            # bit fields sharing a byte are unpacked once
+            if field.offset != bits_offset:
+                format += "B"
+            bits_offset = field.offset
+            continue
+        bits_offset = None
+        if isinstance(t, StructType):
+            format += get_format(t)
+        elif isinstance(t, IntType):
+            format += UINT_FORMATS[t.size]
+        else:
+            format += f"{t.size}s"
+    return format
+
+
+def get_value_count(struct: StructType) -> int:
+    """Returns the number of values of a struct unpacked with its format."""
+    return len([c for c in get_format(struct) if not c.isdigit()])
+
+
+class StructCodec:
+    """Writes the class of a struct."""
+
+    def __init__(self, struct: StructType) -> None:
+        self.struct = struct
+        self.names = {f: get_attribute_name(f) for f in struct.fields}
+
+    def get_values(self) -> Tuple[List[str], List[str]]:
+        """
+        Returns the expressions of each field from `values` (the unpacked tuple)
+        & of each value from `self`.
+        """
+        fields = []
+        values = []
+        i = 0
+        bits_offset = None
+        for name, field in self.struct.fields.items():
+            t = field.tealish_type
+            attribute = f"self.{self.names[name]}"
+            if isinstance(t, BitsType):
+                if field.offset != bits_offset:
+                    values.append(f"(int({attribute}) << {t.shift})")
+                    i += 1
+                else:
+                    values[-1] += f" | (int({attribute}) << {t.shift})"
+                bits_offset = field.offset
+                value = f"values[{i - 1}]"
+                if t.shift:
+                    value = f"{value} >> {t.shift}"
+                if t.bit_offset:
+                    value = (
+                        f"({value}) & {t.max_value}"
+                        if t.shift
+                        else f"{value} & {t.max_value}"
+                    )
+                if t.name == "bool":
+                    value = f"bool({value})"
+                fields.append(value)
+                continue
+            bits_offset = None
+            if isinstance(t, StructType):
+                n = get_value_count(t)
+                fields.append(f"{t.name}.from_values(values[{i}:{i + n}])")
+                values.append(f"*{attribute}.to_values()")
+                i += n
+            else:
+                fields.append(f"values[{i}]")
+                values.append(attribute)
+                i += 1
+        return fields, values
+
+    def get_checks(self) -> List[str]:
+        """
+        Returns the range checks of the bit fields (asserted on chain too), an out of
+        range value would corrupt the bit fields sharing its byte.
+        """
+        lines = []
+        for name, field in self.struct.fields.items():
+            t = field.tealish_type
+            if not isinstance(t, BitsType):
+                continue
+            attribute = f"self.{self.names[name]}"
+            lines += [
+                f"        if not 0 <= {attribute} <= {t.max_value}:",
+                "            raise ValueError(",
+                f'                f"{self.struct.name}.{name} must be between 0 and '
+                f'{t.max_value}, got {{{attribute}!r}}"',
+                "            )",
+            ]
+        return lines
+
+    def write(self) -> List[str]:
+        name = self.struct.name
+        attributes = list(self.names.values())
+        fields, values = self.get_values()
+        args = ", ".join(
+            f"{self.names[n]}: {get_annotation(f.tealish_type)}"
+            for n, f in self.struct.fields.items()
+        )
+        repr_fields = ", ".join(f"{a}={{self.{a}!r}}" for a in attributes)
+        slots = ", ".join(f'"{a}"' for a in attributes)
+        if len(attributes) == 1:
+            slots += ","
+        lines = [
+            f"class {name}:",
+            f'    """{name} struct ({self.struct.size} bytes)."""',
+            "",
+            f"    __slots__ = ({slots})",
+            f"    SIZE = {self.struct.size}",
+            f'    STRUCT = struct.Struct(">{get_format(self.struct)}")',
+            "",
+            f"    def __init__(self, {args}) -> None:",
+        ]
+        lines += [f"        self.{a} = {a}" for a in attributes]
+        lines += [
+            "",
+            "    @classmethod",
+            f'    def decode(cls, data: bytes, offset: int = 0) -> "{name}":',
+            "        return cls.from_values(cls.STRUCT.unpack_from(data, offset))",
+            "",
+            "    @classmethod",
+            f'    def iter_unpack(cls, buffer: bytes) -> Iterator["{name}"]:',
+            '        """Yields the structs of a buffer of consecutive structs."""',
+            "        from_values = cls.from_values",
+            "        for values in cls.STRUCT.iter_unpack(buffer):",
+            "            yield from_values(values)",
+            "",
+            "    def encode(self) -> bytes:",
+            "        return self.STRUCT.pack(*self.to_values())",
+            "",
+            "    @classmethod",
+            f'    def from_values(cls, values: Tuple) -> "{name}":',
+        ]
+        if fields == [f"values[{i}]" for i in range(len(fields))]:
+            lines.append("        return cls(*values)")
+        else:
+            lines.append(f"        return cls({', '.join(fields)})")
+        lines += [
+            "",
+            "    def to_values(self) -> Tuple:",
+        ]
+        lines += self.get_checks()
+        lines += [
+            f"        return ({', '.join(values)}{',' if len(values) == 1 else ''})",
+            "",
+            "    def __eq__(self, other: object) -> bool:",
+            f"        return isinstance(other, {name}) and self.to_values() == other.to_values()",
+            "",
+            "    def __repr__(self) -> str:",
+            f'        return f"{name}({repr_fields})"',
+        ]
+        return lines
+
+
+def emit_python(structs: Dict[str, StructType]) -> str:
+    """Returns the source of a Python module with a codec class for each struct."""
+    lines = HEADER.splitlines()
+    for struct in structs.values():
+        if not struct.fields:
+            continue
+        lines += ["", ""] + StructCodec(struct).write()
+    return "\n".join(lines) + "\n"
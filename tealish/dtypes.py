@@ -0,0 +1,91 @@
+"""
+NumPy structured dtypes of structs, to decode buffers of struct values (e.g. dumps of
+box arrays or of the boxes of a box map) into record arrays without copying.
+
+Ints are big-endian uints, bytes are fixed size raw bytes (`V`, unlike `S` trailing
+zero bytes are kept) and nested structs are nested dtypes. A byte of packed bit fields
+is a `u1` field under the name of each of its bit fields (see `get_bits`).
+
+NumPy is an optional dependency: `pip install tealish[numpy]`.
+
+Example:
+    records = decode_records("boxes.bin", get_struct("Order"))
+    records.price.sum()
+"""
+import os
+from typing import TYPE_CHECKING, Any, Dict, Union
+
+from .types import BitsType, IntType, StructType
+
+if TYPE_CHECKING:
+    import numpy
+
+
+def import_numpy() -> Any:
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "NumPy is required for struct dtypes, install it with `pip install tealish[numpy]`"
+        )
+    return numpy
+
+
+def get_dtype_spec(struct: StructType) -> Dict[str, Any]:
+    """Returns the names, formats, offsets & itemsize of the dtype of a struct."""
+    spec: Dict[str, Any] = {"names": [], "formats": [], "offsets": []}
+    for name, field in struct.fields.items():
+        t = field.tealish_type
+        if isinstance(t, StructType):
+            format: Any = get_dtype_spec(t)
+        elif isinstance(t, BitsType):
+            # the byte holding the bit field (shared with its neighbours)
+            format = "u1"
+        elif isinstance(t, IntType):
+            format = f">u{t.size}" if t.size > 1 else "u1"
+        else:
+            format = f"V{t.size}"
+        spec["names"].append(name)
+        spec["formats"].append(format)
+        spec["offsets"].append(field.offset)
+    spec["itemsize"] = struct.size
+    return spec
+
+
+def get_dtype(struct: StructType) -> "numpy.dtype":
+    """Returns a NumPy structured dtype with the layout of a struct."""
+    numpy = import_numpy()
+    return numpy.dtype(get_dtype_spec(struct))
+
+
+def decode_records(
+    buffer: Union[bytes, bytearray, memoryview, str, os.PathLike],
+    struct: StructType,
+    offset: int = 0,
+    count: int = -1,
+) -> "numpy.recarray":
+    """
+    Returns a record array of the structs of a buffer of consecutive struct values
+    without copying it. A path is memory-mapped (read only).
+    """
+    numpy = import_numpy()
+    dtype = get_dtype(struct)
+    if isinstance(buffer, (str, os.PathLike)):
+        shape = None if count == -1 else (count,)
+        array = numpy.memmap(buffer, dtype=dtype, mode="r", offset=offset, shape=shape)
+    else:
+        array = numpy.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+    return array.view(numpy.recarray)
+
+
+def get_bits(
+    records: "numpy.ndarray", struct: StructType, name: str
+) -> "numpy.ndarray":
+    """Returns the values of a bit field of records (e.g. from `decode_records`)."""
+    t = struct.fields[name].tealish_type
+    if not isinstance(t, BitsType):
+        raise ValueError(f"{struct.name}.{name} is not a bit field")
+    values = (records[name] >> t.shift) & t.max_value
+    if t.name == "bool":
+        return values.astype(bool)
+    return values
@@ -0,0 +1,241 @@
+"""
+Registry & decoder of ARC-28 events (logs of `ARC28Event(signature, ...)`).
+
+An event log is the 4 byte selector (SHA512/256 of the signature) followed by the
+ARC-4 encoding of its args: static args in order (consecutive bools packed in a byte)
+& a 2 byte offset of each dynamic arg (`string`, `byte[]`), whose value is prefixed
+with its 2 byte length after the static args.
+
+Each event has a precompiled `struct.Struct` of its static args & decoding a log is a
+dict lookup of its first 4 bytes and a single `unpack_from`.
+
+Example:
+    decoder = EventDecoder.from_registry(inspect_program(source)["events"])
+    with open("transactions.ndjson") as f:
+        for event, args in decoder.iter_events(read_transactions_file(f)):
+            ...
+"""
+import re
+import struct
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from Cryptodome.Hash import SHA512
+
+from .instrument import iter_transaction_logs
+
+SELECTOR_SIZE = 4
+# struct formats of uints of each size, larger ints are unpacked as bytes
+UINT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+DYNAMIC_TYPES = {"string", "byte[]"}
+
+UINT_RE = re.compile(r"^(?:uint(\d+)|ufixed(\d+)x\d+)$")
+BYTES_RE = re.compile(r"^byte\[(\d+)\]$")
+
+
+def get_selector(signature: str) -> bytes:
+    """Returns the selector of an event signature, e.g. `set_manager(address)`."""
+    return SHA512.new(signature.encode(), truncate="256").digest()[:SELECTOR_SIZE]
+
+
+def parse_signature(signature: str) -> Tuple[str, List[str]]:
+    """Returns the name & the arg types of an event signature."""
+    match = re.match(r"^(\w+)\((.*)\)$", signature)
+    if not match:
+        raise ValueError(f'Invalid event signature "{signature}"')
+    name, args = match.groups()
+    types: List[str] = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(args):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            types.append(args[start:i])
+            start = i + 1
+    if args:
+        types.append(args[start:])
+    return name, types
+
+
+class EventArg:
+    """
+    An arg of an event: the format of its head (static value or offset of a dynamic
+    value) and its offset in the head (after the selector).
+    """
+
+    def __init__(self, type: str, offset: int, format: str, bit: Optional[int] = None):
+        self.type = type
+        self.offset = offset
+        self.format = format
+        # bools are bits of a byte shared with the consecutive bools, from the most significant
+        self.bit = bit
+        self.size = 1 if bit is not None else struct.calcsize(">" + format)
+        self.is_dynamic = type in DYNAMIC_TYPES
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {"type": self.type, "offset": self.offset}
+        if self.is_dynamic:
+            d["dynamic"] = True
+        else:
+            d["size"] = self.size
+        if self.bit is not None:
+            d["bit"] = self.bit
+        return d
+
+
+def get_event_args(types: List[str]) -> Optional[List[EventArg]]:
+    """Returns the layout of the args of an event, None if a type is not supported."""
+    args = []
+    offset = 0
+    bit = None
+    for type in types:
+        if type == "bool":
+            if bit is None or bit == 8:
+                bit = 0
+                args.append(EventArg(type, offset, "B", bit))
+                offset += 1
+            else:
+                args.append(EventArg(type, offset - 1, "", bit))
+            bit += 1
+            continue
+        bit = None
+        uint_match = UINT_RE.match(type)
+        bytes_match = BYTES_RE.match(type)
+        if type in DYNAMIC_TYPES:
+            format = "H"
+        elif type == "byte":
+            format = "B"
+        elif type == "address":
+            format = "32s"
+        elif bytes_match:
+            format = f"{bytes_match.group(1)}s"
+        elif uint_match:
+            bits = int(uint_match.group(1) or uint_match.group(2))
+            if bits % 8 or not 8 <= bits <= 512:
+                return None
+            size = bits // 8
+            format = UINT_FORMATS.get(size, f"{size}s")
+        else:
+            return None
+        arg = EventArg(type, offset, format)
+        args.append(arg)
+        offset += arg.size
+    return args
+
+
+def get_value_getter(i: int) -> Callable[[Tuple, bytes], Any]:
+    return lambda values, data: values[i]
+
+
+def get_getter(arg: EventArg, i: int) -> Optional[Callable[[Tuple, bytes], Any]]:
+    """Returns the getter of an arg from the unpacked values & the log, None if it is values[i]."""
+    if arg.bit is not None:
+        shift = 7 - arg.bit
+        return lambda values, data: bool((values[i] >> shift) & 1)
+    if arg.is_dynamic:
+        start = SELECTOR_SIZE + 2
+        is_string = arg.type == "string"
+
+        def get_dynamic(values: Tuple, data: bytes) -> Any:
+            offset = start + values[i]
+            size = int.from_bytes(data[offset - 2 : offset], "big")
+            value = data[offset : offset + size]
+            return value.decode() if is_string else value
+
+        return get_dynamic
+    if UINT_RE.match(arg.type) and arg.format.endswith("s"):
+        # uints larger than 8 bytes
+        return lambda values, data: int.from_bytes(values[i], "big")
+    return None
+
+
+class Event:
+    """An event of a signature with a precompiled decoder of its args."""
+
+    def __init__(self, signature: str) -> None:
+        self.signature = signature
+        self.name, self.types = parse_signature(signature)
+        self.selector = get_selector(signature)
+        self.args = get_event_args(self.types)
+        self.struct: Optional[struct.Struct] = None
+        self.getters: Optional[List[Callable[[Tuple, bytes], Any]]] = None
+        if self.args is not None:
+            self.compile()
+
+    def compile(self) -> None:
+        assert self.args is not None
+        self.struct = struct.Struct(">" + "".join(a.format for a in self.args))
+        # the index of the unpacked value of each arg (bools sharing a byte share its value)
+        indexes = []
+        i = -1
+        for arg in self.args:
+            if arg.format:
+                i += 1
+            indexes.append(i)
+        getters = [get_getter(arg, i) for arg, i in zip(self.args, indexes)]
+        # the unpacked values are the args as is if there are no getters
+        if i + 1 < len(self.args) or any(g is not None for g in getters):
+            self.getters = [g or get_value_getter(i) for g, i in zip(getters, indexes)]
+
+    def decode(self, data: bytes) -> Any:
+        """
+        Returns the args of a log of the event (the data after the selector if not
+        supported or malformed, e.g. too short).
+        """
+        if self.struct is None:
+            return data[SELECTOR_SIZE:]
+        try:
+            values = self.struct.unpack_from(data, SELECTOR_SIZE)
+            if self.getters is None:
+                return values
+            return tuple(get(values, data) for get in self.getters)
+        except (struct.error, UnicodeDecodeError):
+            return data[SELECTOR_SIZE:]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "signature": self.signature,
+            "name": self.name,
+            "args": None if self.args is None else [a.to_dict() for a in self.args],
+        }
+
+
+def get_event_registry(signatures: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Returns the events of signatures by hex selector."""
+    events = (Event(signature) for signature in signatures)
+    return {event.selector.hex(): event.to_dict() for event in events}
+
+
+class EventDecoder:
+    """Decodes the ARC-28 events of logs by their selector."""
+
+    def __init__(self, signatures: Iterable[str]) -> None:
+        self.events: Dict[bytes, Event] = {}
+        for signature in signatures:
+            event = Event(signature)
+            self.events[event.selector] = event
+
+    @classmethod
+    def from_registry(cls, registry: Dict[str, Dict[str, Any]]) -> "EventDecoder":
+        """Returns a decoder of a registry (`inspect_program(source)["events"]`)."""
+        return cls(e["signature"] for e in registry.values())
+
+    def decode(self, log: bytes) -> Optional[Tuple[Event, Any]]:
+        """Returns the event & the args of a log, None for other logs."""
+        event = self.events.get(log[:SELECTOR_SIZE])
+        if event is None:
+            return None
+        return event, event.decode(log)
+
+    def iter_events(
+        self, transactions: Iterable[Dict[str, Any]]
+    ) -> Iterator[Tuple[Event, Any]]:
+        """Yields the events logged by transactions (e.g. from `read_transactions_file`)."""
+        events = self.events
+        for txn in transactions:
+            for log in iter_transaction_logs(txn):
+                event = events.get(log[:SELECTOR_SIZE])
+                if event is not None:
+                    yield event, event.decode(log)
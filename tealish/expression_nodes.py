@@ -6,10 +6,16 @@ from .types import (
     AVMType,
     AddrType,
     BigIntType,
+    BitsType,
+    BoxArrayType,
+    BoxMapType,
+    BoxRingType,
     BoxType,
     StructType,
     IntType,
     BytesType,
+    StateField,
+    TealishType,
     UIntType,
 )
 from .langspec import Op, type_lookup
@@ -18,6 +24,7 @@ from .langspec import Op, type_lookup
 if TYPE_CHECKING:
     from . import TealWriter
     from .nodes import Node, Func, GenericExpression
+    from .tealish_builtins import Var
 
 
 class Integer(BaseNode):
@@ -319,7 +326,7 @@ class OpCall(BaseNode):
     def _tealish(self) -> str:
         args = [a.tealish() for a in self.args]
         if self.immediate_args:
-            args = self.immediate_args.split(", ") + args
+            args = self.immediate_args.split() + args
         return f"{self.name}({', '.join(args)})"
 
 
@@ -373,7 +380,50 @@ class UserDefinedFuncCall(BaseNode):
         return f"{self.name}({', '.join(args)})"
 
 
-class TxnField(BaseNode):
+class FieldRead(BaseNode):
+    """
+    A read of a transaction or global field.
+
+    These are immutable within an evaluation (except Global.OpcodeBudget) so
+    repeated reads can be cached in a scratch slot by the cse optimization.
+    """
+
+    cache_slot: Optional[int] = None
+    # the first read stores the value in the cache slot, others load it
+    cache_store: bool = False
+
+    def get_indexes(self) -> List[BaseNode]:
+        return []
+
+    def is_volatile(self) -> bool:
+        return False
+
+    def is_cacheable(self) -> bool:
+        return not self.is_volatile() and all(
+            is_constant_index(i) for i in self.get_indexes()
+        )
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        if self.cache_slot is not None and not self.cache_store:
+            writer.write(self, f"load {self.cache_slot} // {self.tealish()}")
+            return
+        self._write_teal(writer)
+        if self.cache_slot is not None:
+            writer.write(
+                self, f"dup; store {self.cache_slot} // cache {self.tealish()}"
+            )
+
+    def _write_teal(self, writer: "TealWriter") -> None:
+        raise NotImplementedError()
+
+
+def is_constant_index(index: BaseNode) -> bool:
+    return isinstance(
+        index, (Integer, Constant, PositiveGroupIndex, NegativeGroupIndex)
+    )
+
+
+class TxnField(FieldRead):
     def __init__(self, field: str, parent: Optional[BaseNode] = None) -> None:
         self.field = field
         self.type = AVMType.any
@@ -382,14 +432,14 @@ class TxnField(BaseNode):
     def process(self) -> None:
         self.type = self.get_field_type("txn", self.field)
 
-    def write_teal(self, writer: "TealWriter") -> None:
+    def _write_teal(self, writer: "TealWriter") -> None:
         writer.write(self, f"txn {self.field}")
 
     def _tealish(self) -> str:
         return f"Txn.{self.field}"
 
 
-class TxnArrayField(BaseNode):
+class TxnArrayField(FieldRead):
     def __init__(
         self,
         field: str,
@@ -407,7 +457,10 @@ class TxnArrayField(BaseNode):
             # index is an expression that needs to be evaluated
             self.arrayIndex.process()
 
-    def write_teal(self, writer: "TealWriter") -> None:
+    def get_indexes(self) -> List[BaseNode]:
+        return [self.arrayIndex]
+
+    def _write_teal(self, writer: "TealWriter") -> None:
         if not isinstance(self.arrayIndex, Integer):
             writer.write(self, self.arrayIndex)
             writer.write(self, f"txnas {self.field}")
@@ -419,7 +472,7 @@ class TxnArrayField(BaseNode):
         return f"Txn.{self.field}[{self.arrayIndex.tealish()}]"
 
 
-class GroupTxnField(BaseNode):
+class GroupTxnField(FieldRead):
     def __init__(
         self, field: str, index: "Node", parent: Optional[BaseNode] = None
     ) -> None:
@@ -434,7 +487,10 @@ class GroupTxnField(BaseNode):
             # index is an expression that needs to be evaluated
             self.index.process()
 
-    def write_teal(self, writer: "TealWriter") -> None:
+    def get_indexes(self) -> List[BaseNode]:
+        return [self.index]
+
+    def _write_teal(self, writer: "TealWriter") -> None:
         if isinstance(self.index, Integer):
             assert self.index.value >= 0, "Group index < 0"
             assert self.index.value < 16, "Group index > 16"
@@ -450,7 +506,7 @@ class GroupTxnField(BaseNode):
         return f"Gtxn[{self.index.tealish()}].{self.field}"
 
 
-class GroupTxnArrayField(BaseNode):
+class GroupTxnArrayField(FieldRead):
     def __init__(
         self,
         field: str,
@@ -472,7 +528,10 @@ class GroupTxnArrayField(BaseNode):
         if not isinstance(self.arrayIndex, Integer):
             self.arrayIndex.process()
 
-    def write_teal(self, writer: "TealWriter") -> None:
+    def get_indexes(self) -> List[BaseNode]:
+        return [self.index, self.arrayIndex]
+
+    def _write_teal(self, writer: "TealWriter") -> None:
         if not isinstance(self.index, Integer):
             # index is an expression that needs to be evaluated
             writer.write(self, self.index)
@@ -531,7 +590,7 @@ class NegativeGroupIndex(BaseNode):
         return f"-{self.index}"
 
 
-class GlobalField(BaseNode):
+class GlobalField(FieldRead):
     def __init__(self, field: str, parent: Optional[BaseNode] = None) -> None:
         self.field = field
         self.type = AVMType.any
@@ -540,7 +599,10 @@ class GlobalField(BaseNode):
     def process(self) -> None:
         self.type = self.get_field_type("global", self.field)
 
-    def write_teal(self, writer: "TealWriter") -> None:
+    def is_volatile(self) -> bool:
+        return self.field == "OpcodeBudget"
+
+    def _write_teal(self, writer: "TealWriter") -> None:
         writer.write(self, f"global {self.field}")
 
     def _tealish(self) -> str:
@@ -563,25 +625,182 @@ class InnerTxnField(BaseNode):
         return f"Itxn.{self.field}"
 
 
+class StateRead(BaseNode):
+    """
+    A read of a key of global or local state declared with `state global:` or `state local:`.
+
+    Values are read as their declared type without runtime checks, a key that was
+    never set reads as 0. Fields of struct values (`GlobalState.pool.reserve`) are
+    extracted from the value. Repeated reads can be cached in a scratch slot by the
+    state optimization while nothing can change the key.
+    """
+
+    scope: str
+    cache_slot: Optional[int] = None
+    # the first read stores the value in the cache slot, others load it
+    cache_store: bool = False
+
+    def get_indexes(self) -> List[BaseNode]:
+        return []
+
+    def process(self) -> None:
+        for index in self.get_indexes():
+            index.process()
+        schema = self.get_compiler().state_schemas[self.scope]
+        if self.field not in schema.fields:
+            raise CompileError(
+                f'Unknown {self.scope} state key "{self.field}"', node=self
+            )
+        self.state_field = schema.fields[self.field]
+        schema.uses[self.state_field.key] += 1
+        self.offset, self.type = self.resolve_fields(
+            self.get_cache_key(), self.state_field.tealish_type, self.subfields
+        )
+        self.size = self.type.size
+
+    def get_cache_key(self) -> str:
+        """Returns the Tealish of the value read from state (without subfields)."""
+        raise NotImplementedError()
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        key = self.get_cache_key()
+        if self.cache_slot is not None and not self.cache_store:
+            writer.write(self, f"load {self.cache_slot} // {key}")
+        else:
+            self._write_teal(writer)
+            if self.cache_slot is not None:
+                writer.write(self, f"dup; store {self.cache_slot} // cache {key}")
+        if not self.subfields:
+            return
+        if isinstance(self.type, BitsType):
+            teal = get_bits_teal(self.type, self.offset)
+        else:
+            teal = [f"extract {self.offset} {self.size}"]
+            if isinstance(self.type, IntType):
+                teal.append("btoi")
+        writer.write(self, teal + [f"// {self.tealish()}"])
+
+    def _write_teal(self, writer: "TealWriter") -> None:
+        raise NotImplementedError()
+
+    def _tealish(self) -> str:
+        return ".".join([self.get_cache_key()] + self.subfields)
+
+
+class GlobalStateField(StateRead):
+    scope = "global"
+
+    def __init__(
+        self,
+        field: str,
+        subfields: Optional[List[str]] = None,
+        parent: Optional[BaseNode] = None,
+    ) -> None:
+        self.field = field
+        self.subfields = subfields or []
+        self.type = AVMType.any
+        self.parent = parent
+
+    def get_cache_key(self) -> str:
+        return f"GlobalState.{self.field}"
+
+    def _write_teal(self, writer: "TealWriter") -> None:
+        writer.write(
+            self,
+            [
+                get_state_key_op(self, self.state_field),
+                "app_global_get",
+                f"// {self.get_cache_key()}",
+            ],
+        )
+
+
+class LocalStateField(StateRead):
+    scope = "local"
+
+    def __init__(
+        self,
+        account: BaseNode,
+        field: str,
+        subfields: Optional[List[str]] = None,
+        parent: Optional[BaseNode] = None,
+    ) -> None:
+        self.account = account
+        self.field = field
+        self.subfields = subfields or []
+        self.type = AVMType.any
+        self.parent = parent
+        self.nodes = [account]
+
+    def get_indexes(self) -> List[BaseNode]:
+        return [self.account]
+
+    def get_cache_key(self) -> str:
+        return f"LocalState[{self.account.tealish()}].{self.field}"
+
+    def _write_teal(self, writer: "TealWriter") -> None:
+        writer.write(self, self.account)
+        writer.write(
+            self,
+            [
+                get_state_key_op(self, self.state_field),
+                "app_local_get",
+                f"// {self.get_cache_key()}",
+            ],
+        )
+
+
+class ScratchValue(BaseNode):
+    """An expression evaluated ahead of its use (e.g. out of a loop) and stored in a scratch slot."""
+
+    def __init__(
+        self, expression: BaseNode, slot: int, parent: Optional[BaseNode] = None
+    ) -> None:
+        self.expression = expression
+        self.slot = slot
+        self.type = expression.type
+        self.parent = parent
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        writer.write(self, f"load {self.slot} // {self.tealish()}")
+
+    def _tealish(self) -> str:
+        return self.expression.tealish()
+
+
 class StructOrBoxField(BaseNode):
-    def __init__(self, name, field, parent=None) -> None:
+    """A field of a struct or box. Fields of nested structs (`a.b.c`) are read with one extract."""
+
+    # set by the boxes optimization
+    cache_slot: Optional[int] = None
+
+    def __init__(self, name, field, subfields=None, parent=None) -> None:
         self.name = name
         self.field = field
+        self.subfields = subfields or []
         self.type = AVMType.none
         self.parent = parent
 
     def process(self) -> None:
         self.var = self.lookup_var(self.name)
         self.object_type = self.var.tealish_type
-        struct = self.var.tealish_type
-        struct_field = struct.fields[self.field]
-        self.offset = struct_field.offset
-        self.size = struct_field.size
-        self.type = struct_field.tealish_type
+        self.offset, self.type = self.resolve_fields(
+            self.name, self.object_type, [self.field] + self.subfields
+        )
+        self.size = self.type.size
 
     def write_teal(self, writer: "TealWriter") -> None:
+        if isinstance(self.type, BitsType):
+            self.write_bits(writer)
+            return
         teal = ""
-        if isinstance(self.object_type, StructType):
+        if self.cache_slot is not None:
+            # a box loaded into a scratch slot by the boxes optimization
+            teal = [
+                f"load {self.cache_slot}",
+                f"extract {self.offset} {self.size}",
+            ]
+        elif isinstance(self.object_type, StructType):
             teal = [
                 f"load {self.var.scratch_slot}",
                 f"extract {self.offset} {self.size}",
@@ -598,11 +817,303 @@ class StructOrBoxField(BaseNode):
         # If the field is a Int or Uint convert it from bytes to int
         if isinstance(self.type, IntType):
             teal.append("btoi")
-        teal.append(f"// {self.name}.{self.field}")
+        teal.append(f"// {self.tealish()}")
         writer.write(self, teal)
 
+    def write_bits(self, writer: "TealWriter") -> None:
+        if isinstance(self.object_type, BoxType) and self.cache_slot is None:
+            teal = [f"load {self.var.scratch_slot}", f"pushint {self.offset}"]
+            teal += ["pushint 1", "box_extract"]
+            teal += get_bits_teal(self.type)
+        else:
+            slot = self.var.scratch_slot if self.cache_slot is None else self.cache_slot
+            teal = [f"load {slot}"] + get_bits_teal(self.type, self.offset)
+        writer.write(self, teal + [f"// {self.tealish()}"])
+
+    def _tealish(self) -> str:
+        return ".".join([self.name, self.field] + self.subfields)
+
+
+class StructSlice(StructOrBoxField):
+    """
+    Bytes of a struct or box at an offset known at compile time, read with one extract.
+
+    Replaces an expression on fields, e.g. `extract(0, 4, item.name)` or
+    `concat(item.a, item.b)` of adjacent fields (see `tealish.optimizer.FieldExtractFuser`).
+    """
+
+    def __init__(
+        self,
+        field: StructOrBoxField,
+        expression: BaseNode,
+        offset: int,
+        size: int,
+    ) -> None:
+        self.name = field.name
+        self.field = field.field
+        self.subfields = field.subfields
+        self.var = field.var
+        self.object_type = field.object_type
+        self.offset = offset
+        self.size = size
+        # the replaced expression
+        self.expression = expression
+        if isinstance(expression.type, IntType):
+            self.type = IntType()
+        else:
+            self.type = BytesType(size)
+        self.parent = expression.parent
+
+    def _tealish(self) -> str:
+        return self.expression.tealish()
+
+
+class BoxArrayField(BaseNode):
+    """
+    An element of a box array (`orders[i]`), a field of one (`orders[i].price`)
+    or a slice of elements (`orders[i:j]`), read with one box_extract.
+
+    Constant indexes are checked at compile time, others at runtime.
+
+    Also the box of a box map key (`positions[Txn.Sender]`) or a field of it,
+    failing if the box doesn't exist, and the i-th oldest element of a ring buffer.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        index: BaseNode,
+        end: Optional[BaseNode] = None,
+        fields: Optional[List[str]] = None,
+        parent: Optional[BaseNode] = None,
+    ) -> None:
+        self.name = name
+        self.index = index
+        self.end = end
+        self.fields = fields or []
+        self.type: Union[AVMType, TealishType] = AVMType.none
+        self.parent = parent
+        self.nodes = [index] + ([end] if end else [])
+
+    def process(self) -> None:
+        self.var = self.lookup_var(self.name)
+        self.array = self.var.tealish_type
+        if isinstance(self.array, BoxMapType):
+            self.process_key()
+            return
+        if not isinstance(self.array, BoxArrayType):
+            raise CompileError(f"{self.name} is not a box array or map", node=self)
+        for index in self.nodes:
+            index.process()
+            if not IntType().can_hold(index.type):
+                raise CompileError(
+                    f"Index of {self.name} must be an int, got {index.type}", node=self
+                )
+        last = self.array.length if self.end else self.array.length - 1
+        for index in self.nodes:
+            if isinstance(index, Integer) and index.value > last:
+                raise CompileError(
+                    f"Index {index.value} out of bounds of {self.array}", node=self
+                )
+        if self.end is not None:
+            if isinstance(self.array, BoxRingType):
+                raise CompileError(
+                    f"Ring buffer {self.name} can't be sliced", node=self
+                )
+            if self.fields:
+                raise CompileError(f"Slices of {self.name} have no fields", node=self)
+            self.type = BytesType()
+            if isinstance(self.index, Integer) and isinstance(self.end, Integer):
+                length = self.end.value - self.index.value
+                if length <= 0:
+                    raise CompileError(f"Empty slice of {self.name}", node=self)
+                self.type = BytesType(length * self.array.struct.size)
+        else:
+            path = f"{self.name}[{self.index.tealish()}]"
+            self.offset, self.type = self.resolve_fields(
+                path, self.array.struct, self.fields
+            )
+        self.size = self.type.size
+
+    def process_key(self) -> None:
+        if self.end is not None:
+            raise CompileError(f"Box map {self.name} can't be sliced", node=self)
+        self.index.process()
+        if not self.array.can_hold_key(self.index.type):
+            raise CompileError(
+                f"Incorrect type for key of {self.name}. "
+                + f"Expected {self.array.key_type_name}, got {self.index.type}",
+                node=self,
+            )
+        path = f"{self.name}[{self.index.tealish()}]"
+        self.offset, self.type = self.resolve_fields(
+            path, self.array.struct, self.fields
+        )
+        self.size = self.type.size
+
+    def write_box_name(self, writer: "TealWriter") -> None:
+        """Writes the name of the box of a box map key."""
+        writer.write(self, f"load {self.var.scratch_slot} // {self.name}")
+        write_box_map_key(writer, self, self.array, self.index)
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        if isinstance(self.array, BoxMapType) and not self.fields:
+            self.write_box_name(writer)
+            writer.write(self, ["box_get", "assert", f"// {self.tealish()}"])
+            return
+        elif isinstance(self.array, BoxMapType):
+            self.write_box_name(writer)
+            writer.write(self, f"pushint {self.offset}")
+            writer.write(self, f"pushint {self.size}")
+        else:
+            writer.write(self, f"load {self.var.scratch_slot} // {self.name}")
+            if self.end is None:
+                write_box_array_offset(
+                    writer, self, self.array, self.index, self.offset
+                )
+                writer.write(self, f"pushint {self.size}")
+            elif self.size:
+                writer.write(
+                    self, f"pushint {self.index.value * self.array.struct.size}"
+                )
+                writer.write(self, f"pushint {self.size}")
+            else:
+                self.write_slice(writer)
+        teal = ["box_extract"]
+        if isinstance(self.type, BitsType):
+            teal += get_bits_teal(self.type)
+        elif isinstance(self.type, IntType):
+            teal.append("btoi")
+        teal.append(f"// {self.tealish()}")
+        writer.write(self, teal)
+
+    def write_slice(self, writer: "TealWriter") -> None:
+        """Writes the offset & size of a slice with a dynamic start or end."""
+        element_size = self.array.struct.size
+        # the start is evaluated once
+        writer.write(self, self.index)
+        writer.write(self, f"dup; pushint {element_size}; *; swap")
+        writer.write(self, self.end)
+        writer.write(self, f"dup; pushint {self.array.length}; <=; assert // in bounds")
+        # (end - start) * element size, fails if end < start
+        writer.write(self, f"swap; -; pushint {element_size}; *")
+
     def _tealish(self) -> str:
-        return f"{self.name}.{self.field}"
+        index = self.index.tealish()
+        if self.end is not None:
+            index += f":{self.end.tealish()}"
+        return ".".join([f"{self.name}[{index}]"] + self.fields)
+
+
+def write_box_array_offset(
+    writer: "TealWriter",
+    node: BaseNode,
+    array: BoxArrayType,
+    index: BaseNode,
+    offset: int,
+) -> None:
+    """Writes the offset of the element at index (plus offset) in a box array, checking bounds."""
+    element_size = array.struct.size
+    if isinstance(array, BoxRingType):
+        writer.write(node, index)
+        write_ring_header(writer, node, node.var)
+        # (head + index) % capacity if index < count
+        writer.write(node, "dig 2; >; assert // index < count")
+        writer.write(node, f"+; pushint {array.length}; %")
+        writer.write(
+            node, f"pushint {element_size}; *; pushint {array.header_size + offset}; +"
+        )
+        return
+    if isinstance(index, Integer):
+        writer.write(node, f"pushint {index.value * element_size + offset}")
+        return
+    writer.write(node, index)
+    writer.write(node, f"dup; pushint {array.length}; <; assert // in bounds")
+    teal = [f"pushint {element_size}", "*"]
+    if offset:
+        teal += [f"pushint {offset}", "+"]
+    writer.write(node, teal)
+
+
+def get_bits_teal(type: BitsType, byte: Optional[int] = None) -> List[str]:
+    """
+    Returns the ops reading a bit field in the byte at index byte of the bytes on the
+    stack, or in the byte on the stack (e.g. read with box_extract) if byte is None.
+    """
+    if type.bits == 1:
+        return [f"pushint {(byte or 0) * 8 + type.bit_offset}", "getbit"]
+    teal = ["btoi"] if byte is None else [f"pushint {byte}", "getbyte"]
+    if type.shift:
+        teal += [f"pushint {type.shift}", "shr"]
+    if type.bit_offset:
+        teal += [f"pushint {type.max_value}", "&"]
+    return teal
+
+
+def write_bits_update(
+    writer: "TealWriter",
+    node: BaseNode,
+    type: BitsType,
+    byte: int,
+    value: BaseNode,
+    fits: bool,
+) -> None:
+    """
+    Writes the bytes on the stack with a bit field in the byte at index byte set to value.
+
+    Values are asserted to fit in the field unless they provably do (`fits`).
+    """
+    if type.bits == 1:
+        # setbit fails if the value isn't 0 or 1
+        writer.write(node, f"pushint {byte * 8 + type.bit_offset}")
+        writer.write(node, value)
+        writer.write(node, "setbit")
+        return
+    clear = 255 ^ (type.max_value << type.shift)
+    writer.write(node, f"pushint {byte}; dup2; getbyte; pushint {clear}; &")
+    writer.write(node, value)
+    if not fits:
+        writer.write(
+            node,
+            f"dup; pushint {type.max_value}; <=; assert // fits in {type.bits} bits",
+        )
+    teal = []
+    if type.shift:
+        teal += [f"pushint {type.shift}", "shl"]
+    writer.write(node, teal + ["|", "setbyte"])
+
+
+def write_ring_header(writer: "TealWriter", node: BaseNode, var: "Var") -> None:
+    """Writes the head & count of a ring buffer, read with one box_extract."""
+    size = BoxRingType.header_size
+    writer.write(
+        node, f"load {var.scratch_slot}; pushint 0; pushint {size}; box_extract"
+    )
+    writer.write(
+        node, "dup; pushint 0; extract_uint64; swap; pushint 8; extract_uint64"
+    )
+
+
+def write_box_map_key(
+    writer: "TealWriter", node: BaseNode, map: BoxMapType, key: BaseNode
+) -> None:
+    """Writes the key of a box map & concats it to the prefix (on the stack) to name its box."""
+    writer.write(node, key)
+    teal = []
+    if isinstance(map.key_type, IntType):
+        teal.append("itob")
+    if map.hashed:
+        teal.append("sha256")
+    writer.write(node, teal + ["concat"])
+
+
+def get_state_key_op(node: BaseNode, field: StateField) -> str:
+    """Returns the op pushing the key of a state field, from the bytecblock if it is pooled."""
+    keys = node.get_compiler().state_keys
+    if field.key not in keys:
+        return f'pushbytes "{field.key}"'
+    i = keys.index(field.key)
+    return f"bytec_{i}" if i < 4 else f"bytec {i}"
 
 
 def class_provider(name: str) -> Optional[type]:
@@ -625,6 +1136,9 @@ def class_provider(name: str) -> Optional[type]:
         "NegativeGroupIndex": NegativeGroupIndex,
         "GlobalField": GlobalField,
         "InnerTxnField": InnerTxnField,
+        "GlobalStateField": GlobalStateField,
+        "LocalStateField": LocalStateField,
         "StructOrBoxField": StructOrBoxField,
+        "BoxArrayField": BoxArrayField,
     }
     return classes.get(name)
@@ -0,0 +1,113 @@
+import json
+from base64 import b64decode
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Instrumentation records are logged as:
+#   prefix (2 bytes) + id (2 bytes) + budget before (8 bytes) + budget after (8 bytes)
+INSTRUMENT_PREFIX = bytes.fromhex("746c")  # "tl"
+RECORD_SIZE = 20
+# Ops charged between the two budget reads that are not part of the measured code
+# (`store` of the entry budget & the exit `global OpcodeBudget` itself)
+INSTRUMENT_OVERHEAD = 2
+
+
+def decode_log(log: bytes) -> Optional[Tuple[int, int]]:
+    """Decodes an instrumentation log record to (id, cost) or None for other logs."""
+    if len(log) != RECORD_SIZE or log[:2] != INSTRUMENT_PREFIX:
+        return None
+    record_id = int.from_bytes(log[2:4], "big")
+    before = int.from_bytes(log[4:12], "big")
+    after = int.from_bytes(log[12:20], "big")
+    return record_id, before - after - INSTRUMENT_OVERHEAD
+
+
+def iter_transaction_logs(txn: Dict[str, Any]) -> Iterable[bytes]:
+    """Yields the logs of a transaction (algod or indexer JSON) excluding inner transactions.
+
+    Logs of inner transactions belong to other applications.
+    """
+    logs = txn.get("logs")
+    if logs is None:
+        logs = txn.get("dt", {}).get("lg", [])
+    for log in logs:
+        yield b64decode(log) if isinstance(log, str) else log
+
+
+def iter_transactions(obj: Any) -> Iterator[Dict[str, Any]]:
+    """Yields transactions from a decoded JSON object.
+
+    Supported shapes:
+        - a transaction: `{"logs": [...]}` (pending transaction info or indexer)
+        - a list of transactions
+        - an indexer search response: `{"transactions": [...]}`
+        - an algod simulate response
+    """
+    if isinstance(obj, list):
+        for item in obj:
+            yield from iter_transactions(item)
+    elif isinstance(obj, dict):
+        if "txn-group-results" in obj:
+            for group in obj["txn-group-results"]:
+                for result in group.get("txn-results", []):
+                    yield result.get("txn-result", {})
+        elif "transactions" in obj:
+            yield from iter_transactions(obj["transactions"])
+        else:
+            yield obj
+
+
+def read_transactions_file(f: IO) -> Iterator[Dict[str, Any]]:
+    """Streams transactions from a JSON or NDJSON file."""
+    first_line = f.readline()
+    try:
+        obj = json.loads(first_line)
+    except json.JSONDecodeError:
+        yield from iter_transactions(json.loads(first_line + f.read()))
+        return
+    yield from iter_transactions(obj)
+    for line in f:
+        if line.strip():
+            yield from iter_transactions(json.loads(line))
+
+
+class CostHistogram:
+    """
+    Aggregates instrumentation records into per function (and route) cost statistics.
+
+    `names` maps instrumentation ids to names, as produced by
+    `TealishCompiler.get_instrumentation`.
+    """
+
+    def __init__(self, names: Dict[int, str]) -> None:
+        self.names = names
+        self.costs: Dict[int, List[int]] = {}
+
+    def add_logs(self, logs: Iterable[bytes]) -> None:
+        for log in logs:
+            record = decode_log(log)
+            if record is not None:
+                record_id, cost = record
+                self.costs.setdefault(record_id, []).append(cost)
+
+    def add_transactions(self, txns: Iterable[Dict[str, Any]]) -> None:
+        for txn in txns:
+            self.add_logs(iter_transaction_logs(txn))
+
+    def as_dict(self) -> Dict[str, Any]:
+        output = {}
+        for record_id, costs in sorted(self.costs.items()):
+            name = self.names.get(record_id, f"unknown {record_id}")
+            buckets: Dict[int, int] = {}
+            for cost in costs:
+                # power of 2 buckets: 0, 1, 2-3, 4-7, 8-15, ...
+                bucket = 1 << (cost.bit_length() - 1) if cost > 0 else 0
+                buckets[bucket] = buckets.get(bucket, 0) + 1
+            output[name] = {
+                "calls": len(costs),
+                "total": sum(costs),
+                "min": min(costs),
+                "max": max(costs),
+                "mean": sum(costs) / len(costs),
+                "histogram": dict(sorted(buckets.items())),
+            }
+        return output
@@ -83,6 +83,23 @@ ignores = [
     "retsub",
 ]
 
+# Effects of ops, derived from their langspec groups. Ops in the pure groups only
+# compute on their args & the (immutable) transaction group.
+pure_groups = {
+    "Arithmetic",
+    "Byte Array Arithmetic",
+    "Byte Array Logic",
+    "Byte Array Manipulation",
+    "Loading Values",
+}
+# Ops in these groups read (or write) state that can change during evaluation
+state_groups = {"State Access", "Box Access", "Inner Transactions"}
+scratch_ops = ["load", "loads", "store", "stores"]
+# State ops that return a value but also have an effect
+state_write_ops = ["box_create", "box_del"]
+# Ops with effects that can't be read back during evaluation
+output_ops = ["log"]
+
 
 def type_lookup(a: str) -> TealishType:
     return _opcode_type_map[a]
@@ -131,6 +148,12 @@ class Op:
     doc_extra: str
     #: what categories of ops this op belongs to
     groups: List[str]
+    #: the result only depends on the args (and the transaction group)
+    is_pure: bool
+    #: reads state that can change during evaluation (app state, boxes, inner txns, scratch)
+    reads_state: bool
+    #: changes state that can be read by other ops
+    writes_state: bool
 
     #: inferred method signature
     sig: str
@@ -182,7 +205,20 @@ class Op:
 
         self.doc = op_def.get("Doc", "")
         self.doc_extra = op_def.get("DocExtra", "")
-        self.groups = op_def.get("groups", [])
+        self.groups = op_def.get("Groups", [])
+
+        groups = set(self.groups)
+        self.is_pure = (
+            groups <= pure_groups
+            and self.name not in scratch_ops
+            and len(self.returns) > 0
+        )
+        self.reads_state = (
+            bool(groups & state_groups) or self.name in scratch_ops
+        ) and self.name not in output_ops
+        self.writes_state = self.reads_state and (
+            len(self.returns) == 0 or self.name in state_write_ops
+        )
 
         arg_list = [f"{abc[i]}: {t.name}" for i, t in enumerate(self.arg_types)]
         if len(self.arg_enum) > 0:
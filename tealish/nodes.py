@@ -15,14 +15,36 @@ from typing import (
 
 from .base import BaseNode
 from .errors import CompileError, ParseError
+from .cfg import get_label, rename_labels
+from .instrument import INSTRUMENT_PREFIX
+from .expression_nodes import (
+    Bytes,
+    Constant,
+    GlobalField,
+    Integer,
+    TxnField,
+    Variable,
+    write_bits_update,
+    write_box_array_offset,
+    get_state_key_op,
+    write_box_map_key,
+)
+from .ranges import MAX_BYTES, get_max_value
 from .tx_expressions import parse_expression
 from .tealish_builtins import Var, constants
 from .types import (
     AVMType,
     AnyType,
+    BitsType,
+    BoxArrayType,
+    BoxMapType,
+    BoxRingType,
     BoxType,
     BytesType,
     IntType,
+    MAX_BOX_NAME_SIZE,
+    MAX_STATE_ENTRY_SIZE,
+    MAX_STATE_KEY_SIZE,
     StructType,
     TealishType,
     UIntType,
@@ -127,6 +149,19 @@ class Node(BaseNode):
     def get_current_scope(self) -> Scope:
         return self.current_scope
 
+    def get_profile_hits(self) -> Optional[int]:
+        """Returns the profiled hits of this node's line if a profile is in use."""
+        if self.compiler is None or not self.compiler.profile:
+            return None
+        return self.compiler.profile.get(self.line_no, 0)
+
+    def get_body_hits(self) -> int:
+        """Returns the profiled hits of the first executable child statement."""
+        for node in self.child_nodes:
+            if not isinstance(node, (Comment, Blank, Const)):
+                return node.get_profile_hits() or 0
+        return 0
+
     def new_scope(
         self, name: str = "", slot_range: Optional[Tuple[int, int]] = None
     ) -> None:
@@ -232,11 +267,15 @@ class Statement(Node):
         elif line.startswith("func "):
             return Func.consume(compiler, parent)
         elif line.startswith("@"):
+            if peek_decorated(compiler).startswith("for "):
+                return DecoratedFor.consume(compiler, parent)
             return DecoratedFunc.consume(compiler, parent)
         elif line.startswith("if "):
             return IfStatement.consume(compiler, parent)
         elif line.startswith("while "):
             return WhileStatement.consume(compiler, parent)
+        elif re.match(r"for .* in BoxChunks\(", line):
+            return BoxChunksStatement.consume(compiler, parent)
         elif line.startswith("for _"):
             return For_Statement.consume(compiler, parent)
         elif line.startswith("for "):
@@ -249,6 +288,8 @@ class Statement(Node):
             return InnerTxn.consume(compiler, parent)
         elif line.startswith("struct "):
             return StructDefinition.consume(compiler, parent)
+        elif line.startswith("state "):
+            return StateDefinition.consume(compiler, parent)
         elif line.startswith("router:"):
             return Router.consume(compiler, parent)
         else:
@@ -285,7 +326,9 @@ class Program(Node):
                     + "Struct definitions should be at the top of the file and "
                     + "only be preceeded by comments."
                 )
-            if not isinstance(n, (TealVersion, Blank, Comment, StructDefinition)):
+            if not isinstance(
+                n, (TealVersion, Blank, Comment, StructDefinition, StateDefinition)
+            ):
                 expect_struct_definition = False
 
             if exit_statement:
@@ -321,8 +364,48 @@ class Program(Node):
             )
             self.compiler.max_slot = max(self.compiler.max_slot, var.scratch_slot)
 
+        if self.compiler.instrument:
+            self.declare_instrumentation()
+
+    def declare_instrumentation(self) -> None:
+        # each func & route gets an id for its log records and a slot for its entry budget
+        scope = self.get_current_scope()
+        names = self.compiler.instrumented_names
+        for node in self.find_child_nodes(Func) + self.find_child_nodes(Route):
+            kind = "func" if isinstance(node, Func) else "route"
+            node.instrument_id = len(names)
+            names[node.instrument_id] = f"{kind} {node.name}"
+            var = scope.declare_scratch_var(
+                f"instrument__{node.instrument_id}",
+                IntType(),
+                self.compiler.max_slot + 1,
+            )
+            self.compiler.max_slot = var.scratch_slot
+            node.instrument_slot = var.scratch_slot
+        if self.compiler.max_slot > 255:
+            raise CompileError(
+                f"Not enough scratch slots to instrument {len(names)} funcs & routes"
+            )
+
+    def get_state_keys(self) -> List[str]:
+        """Returns the state keys accessed more than once (most first) to pool in a bytecblock."""
+        for teal in self.find_child_nodes(Teal):
+            # the program may have its own constants
+            if any("bytec" in n.line for n in teal.child_nodes):
+                return []
+        uses: Dict[str, int] = {}
+        for schema in self.compiler.state_schemas.values():
+            for key, n in schema.uses.items():
+                uses[key] = uses.get(key, 0) + n
+        return sorted([key for key, n in uses.items() if n > 1], key=lambda k: -uses[k])
+
     def write_teal(self, writer: "TealWriter") -> None:
+        keys = self.compiler.state_keys = self.get_state_keys()
         for n in self.child_nodes:
+            if keys and not isinstance(n, TealVersion):
+                keys_teal = " ".join(f'"{key}"' for key in keys)
+                writer.write(self, f"bytecblock {keys_teal} // state keys")
+                keys = []
             n.write_teal(writer)
 
         if self.compiler.use_inner_txns_macro:
@@ -392,10 +475,16 @@ class LineStatement(InlineStatement):
             r"[A-Za-z][a-zA-Z_0-9]*(\[[0-9]+\])? [a-zA-Z_0-9]+( = .*)?", line
         ):
             return VarDeclaration(line, parent, compiler=compiler)
-        elif line.startswith("box<"):
+        elif line.startswith("boxmap<"):
+            return BoxMapDeclaration(line, parent, compiler=compiler)
+        elif line.startswith("box<") or line.startswith("boxring<"):
             return BoxDeclaration(line, parent, compiler=compiler)
+        elif re.match(r"[a-z][a-zA-Z_0-9]*\[.+\](\.[a-z][a-zA-Z_0-9]*)* = .*", line):
+            return BoxArrayAssignment(line, parent, compiler=compiler)
         elif re.match(r"[a-z][a-zA-Z_0-9]*\.[a-z][a-zA-Z_0-9]* = .*", line):
             return StructOrBoxAssignment(line, parent, compiler=compiler)
+        elif re.match(r"(GlobalState\.|LocalState\[)", line):
+            return StateAssignment(line, parent, compiler=compiler)
         elif " = " in line:
             return Assignment(line, parent, compiler=compiler)
         # Statement functions
@@ -739,6 +828,35 @@ class SwitchElse(Node):
         return output
 
 
+def get_string_bytes(value: str) -> Optional[bytes]:
+    """Returns the bytes of a string literal (without its quotes), None if invalid."""
+    try:
+        return value.encode().decode("unicode_escape").encode("latin-1")
+    except UnicodeError:
+        return None
+
+
+def get_literal_value(node: BaseNode) -> Union[int, bytes, None]:
+    """
+    Returns the value of an int or bytes literal (or const) as the AVM compares it,
+    e.g. b"a" for both "a" and "\\x61", None for other expressions.
+    """
+    value = getattr(node, "value", None)
+    if isinstance(node, Integer):
+        return value
+    if isinstance(node, Bytes) and isinstance(value, str):
+        return get_string_bytes(value)
+    if isinstance(node, Constant):
+        # the value of a const is its literal (with quotes)
+        if isinstance(node.type, IntType):
+            return int(value)  # type: ignore
+        if isinstance(value, str) and value.startswith("0x"):
+            return bytes.fromhex(value[2:])
+        if isinstance(value, str) and value.startswith('"'):
+            return get_string_bytes(value[1:-1])
+    return None
+
+
 class Switch(InlineStatement):
     possible_child_nodes = [SwitchOption, SwitchElse]
     pattern = r"switch (?P<expression>.*):$"
@@ -784,9 +902,44 @@ class Switch(InlineStatement):
         for node in self.options:
             node.expression.process()
 
+    def get_options_order(self) -> List[SwitchOption]:
+        """
+        Returns the options ordered by profiled hits (hottest first) when the
+        reordering cannot change behaviour: the switch expression must be free
+        of side effects and the options must be distinct literals.
+        """
+        if self.get_profile_hits() is None:
+            return self.options
+        pure_expressions = (Integer, Bytes, Constant, Variable, TxnField, GlobalField)
+        if not isinstance(self.expression, pure_expressions):
+            return self.options
+        values = [get_literal_value(node.expression) for node in self.options]
+        if None in values:
+            return self.options
+        if len(set(values)) != len(values):
+            return self.options
+        hits = {
+            node: self.get_block(node.block_name).get_body_hits()
+            for node in self.options
+        }
+        options = sorted(self.options, key=lambda node: -hits[node])
+        # each option check costs 4 ops (expression, option, ==, bnz)
+        saving = sum(
+            hits[node] * 4 * (self.options.index(node) - i)
+            for i, node in enumerate(options)
+        )
+        if saving <= 0:
+            return self.options
+        self.compiler.report(
+            "pgo",
+            f"line {self.line_no}: switch options reordered by hits, "
+            + f"estimated saving {saving} ops",
+        )
+        return options
+
     def write_teal(self, writer: "TealWriter") -> None:
         writer.write(self, f"// tl:{self.line_no}: {self.line}")
-        for node in self.options:
+        for node in self.get_options_order():
             writer.write(self, self.expression)
             writer.write(self, node.expression)
             writer.write(self, "==")
@@ -819,6 +972,7 @@ class Route(Node):
         self.func = self.lookup_func(self.name)
         if "public" not in self.func.attributes:
             raise CompileError(f"{self.name} is not a public function", node=self)
+        self.compiler.routes[self.name] = self
         for i, (arg, type_name) in enumerate(self.func.args.args):
             a = i + 1
             arg_type = get_type_instance(type_name)
@@ -893,11 +1047,16 @@ class Router(InlineStatement):
                     self,
                     f"txn OnCompletion; pushint {constants[oc][1]}; ==; assert // assert OnCompletion == {oc}",
                 )
+            if self.compiler.instrument:
+                writer.write(self, instrument_entry_teal(route))
 
             for arg_expression in route.arg_expressions:
                 # writer.write(self, f"// {arg_expression.tealish()}")
                 writer.write(self, arg_expression, one_line=True)
             writer.write(self, f"callsub {func.label}")
+            if self.compiler.instrument:
+                # logged before the arc4 return log which must be the last log
+                writer.write(self, instrument_exit_teal(route))
             if func.returns:
                 writer.write(
                     self, f"// return {', '.join([r.name for r in func.returns])}"
@@ -1339,7 +1498,70 @@ class IfStatement(InlineStatement):
         if self.else_ is not None:
             self.else_.process()
 
+    def get_hot_branch(self) -> Optional[int]:
+        """
+        Returns the index of the branch to lay out last if profile data shows
+        that doing so is cheaper than the source order.
+
+        Every branch body except the last one laid out ends with `b end` so
+        placing the hottest branch last saves one op per execution of it.
+        """
+        if self.get_profile_hits() is None:
+            return None
+        total = self.get_profile_hits()
+        branches = [self.if_then, *self.elifs] + ([self.else_] if self.else_ else [])
+        hits = [b.get_body_hits() for b in branches]
+        hot = hits.index(max(hits))
+        if hot == len(branches) - 1 or not total:
+            return None
+        # hot branch last; every other branch and the no match path pay `b end`
+        no_match = 0 if self.else_ else max(total - sum(hits), 0)
+        cost = sum(hits) - hits[hot] + no_match
+        source_order_cost = sum(hits[:-1])
+        saving = source_order_cost - cost
+        if saving <= 0:
+            return None
+        self.compiler.report(
+            "pgo",
+            f"line {self.line_no}: hot branch at line {branches[hot].line_no} "
+            + f"laid out last, estimated saving {saving} ops",
+        )
+        return hot
+
+    def write_teal_hot_last(self, writer: "TealWriter", hot: int) -> None:
+        # condition chain first, cold branch bodies after it, hot body last
+        conditionals = [self, *self.elifs]
+        labels = [f"l{self.conditional_index}_then"] + [n.label for n in self.elifs]
+        writer.write(self, f"// tl:{self.line_no}: {self.line} [pgo]")
+        for node, label in zip(conditionals, labels):
+            writer.write(self, node.condition)
+            if node.modifier == "not":
+                writer.write(self, f"bz {label}")
+            else:
+                writer.write(self, f"bnz {label}")
+        if self.else_:
+            writer.write(self, f"// tl:{self.else_.line_no}: {self.else_.line}")
+            writer.level += 1
+            self.else_.write_teal(writer)
+            writer.level -= 1
+        writer.write(self, f"b {self.end_label}")
+        branches = [self.if_then, *self.elifs]
+        order = [i for i in range(len(branches)) if i != hot] + [hot]
+        for i in order:
+            writer.write(self, f"{labels[i]}:")
+            writer.level += 1
+            for n in branches[i].child_nodes:
+                n.write_teal(writer)
+            if i != hot:
+                writer.write(self, f"b {self.end_label}")
+            writer.level -= 1
+        writer.write(self, f"{self.end_label}:")
+
     def write_teal(self, writer: "TealWriter") -> None:
+        hot = self.get_hot_branch()
+        if hot is not None:
+            self.write_teal_hot_last(writer, hot)
+            return
         writer.write(self, f"// tl:{self.line_no}: {self.line}")
         writer.write(self, self.condition)
         if self.modifier == "not":
@@ -1403,7 +1625,64 @@ class Break(LineStatement):
         return "break\n"
 
 
-class WhileStatement(InlineStatement):
+class LoopStatement(InlineStatement):
+    """
+    Base of the loop statements.
+
+    The loops optimization rotates loops (testing the condition at the end so each
+    iteration takes one branch) and hoists loop invariant expressions which are
+    then evaluated once, before the loop, into scratch slots. The unroll
+    optimization unrolls for loops with constant bounds.
+    """
+
+    # whether the condition can be moved after the body
+    rotatable = True
+
+    def __init__(self, line: str, parent: Node, compiler: "TealishCompiler") -> None:
+        super().__init__(line, parent, compiler)
+        # from decorators (e.g. @unroll())
+        self.attributes: Dict[str, Dict[str, str]] = {}
+        self.rotate = False
+        # copies of the body per iteration of the unrolled loop (None if not unrolled)
+        self.unroll: Optional[int] = None
+        # whether the body of an unrolled loop reads the loop variable
+        self.unroll_counter = True
+        # (expression, slot) evaluated before the loop condition
+        self.hoisted_condition: List[Tuple[BaseNode, int]] = []
+        # (expression, slot) evaluated after the loop condition passes the first time
+        self.hoisted: List[Tuple[BaseNode, int]] = []
+
+    def write_hoisted(
+        self, writer: "TealWriter", hoisted: List[Tuple[BaseNode, int]]
+    ) -> None:
+        for expression, slot in hoisted:
+            writer.write(self, expression)
+            writer.write(self, f"store {slot} // hoisted {expression.tealish()}")
+
+    def get_range(self) -> Optional[Tuple[int, int]]:
+        """Returns the (start, end) of for loops with constant bounds."""
+        return None
+
+    def write_body_copy(self, writer: "TealWriter", copy: int) -> None:
+        """Writes a copy of the body for an unrolled loop, with its labels renamed."""
+        start = len(writer.output)
+        for n in self.child_nodes:
+            n.write_teal(writer)
+        lines = writer.output[start:]
+        labels = [get_label(teal) for teal in lines]
+        renames = {label: f"{label}_u{copy}" for label in labels if label}
+        writer.output[start:] = [rename_labels(teal, renames) for teal in lines]
+
+
+def get_constant_int(node: BaseNode) -> Optional[int]:
+    if isinstance(node, Integer):
+        return node.value
+    elif isinstance(node, Constant) and isinstance(node.type, IntType):
+        return node.value  # type: ignore
+    return None
+
+
+class WhileStatement(LoopStatement):
     possible_child_nodes = [InlineStatement]
     pattern = r"while ((?P<modifier>not) )?(?P<condition>.*):$"
     condition: GenericExpression
@@ -1438,6 +1717,8 @@ class WhileStatement(InlineStatement):
             n.process()
 
     def write_teal(self, writer: "TealWriter") -> None:
+        if self.rotate:
+            return self.write_rotated_teal(writer)
         writer.write(self, f"// tl:{self.line_no}: {self.line}")
         writer.write(self, f"{self.start_label}:")
         writer.level += 1
@@ -1452,6 +1733,27 @@ class WhileStatement(InlineStatement):
         writer.write(self, f"{self.end_label}:")
         writer.level -= 1
 
+    def write_rotated_teal(self, writer: "TealWriter") -> None:
+        writer.write(self, f"// tl:{self.line_no}: {self.line}")
+        writer.level += 1
+        self.write_hoisted(writer, self.hoisted_condition)
+        writer.write(self, self.condition)
+        if self.modifier == "not":
+            writer.write(self, f"bnz {self.end_label}")
+        else:
+            writer.write(self, f"bz {self.end_label}")
+        self.write_hoisted(writer, self.hoisted)
+        writer.write(self, f"{self.start_label}:")
+        for n in self.child_nodes:
+            n.write_teal(writer)
+        writer.write(self, self.condition)
+        if self.modifier == "not":
+            writer.write(self, f"bz {self.start_label}")
+        else:
+            writer.write(self, f"bnz {self.start_label}")
+        writer.write(self, f"{self.end_label}:")
+        writer.level -= 1
+
     def _tealish(self) -> str:
         output = f"while {'not ' if self.modifier else ''}{self.condition.tealish()}:\n"
         for n in self.child_nodes:
@@ -1460,7 +1762,7 @@ class WhileStatement(InlineStatement):
         return output
 
 
-class ForStatement(InlineStatement):
+class ForStatement(LoopStatement):
     possible_child_nodes = [InlineStatement]
     pattern = (
         r"for (?P<var_name>[a-z_][a-zA-Z0-9_]*) in "
@@ -1494,7 +1796,17 @@ class ForStatement(InlineStatement):
             n.process()
         self.del_var(self.var_name)
 
+    def get_range(self) -> Optional[Tuple[int, int]]:
+        start, end = get_constant_int(self.start), get_constant_int(self.end)
+        if start is None or end is None:
+            return None
+        return start, end
+
     def write_teal(self, writer: "TealWriter") -> None:
+        if self.unroll:
+            return self.write_unrolled_teal(writer)
+        if self.rotate:
+            return self.write_rotated_teal(writer)
         writer.write(self, f"// tl:{self.line_no}: {self.line}")
         writer.level += 1
         writer.write(self, self.start)
@@ -1514,6 +1826,63 @@ class ForStatement(InlineStatement):
         writer.write(self, f"{self.end_label}:")
         writer.level -= 1
 
+    def write_rotated_teal(self, writer: "TealWriter") -> None:
+        writer.write(self, f"// tl:{self.line_no}: {self.line}")
+        writer.level += 1
+        writer.write(self, self.start)
+        writer.write(self, f"store {self.var.scratch_slot} // {self.var.name}")
+        writer.write(self, f"load {self.var.scratch_slot} // {self.var.name}")
+        writer.write(self, self.end)
+        writer.write(self, "==")
+        writer.write(self, f"bnz {self.end_label}")
+        self.write_hoisted(writer, self.hoisted)
+        writer.write(self, f"{self.start_label}:")
+        for n in self.child_nodes:
+            n.write_teal(writer)
+        writer.write(self, f"load {self.var.scratch_slot} // {self.var.name}")
+        writer.write(self, "pushint 1")
+        writer.write(self, "+")
+        writer.write(self, "dup")
+        writer.write(self, f"store {self.var.scratch_slot} // {self.var.name}")
+        writer.write(self, self.end)
+        writer.write(self, "!=")
+        writer.write(self, f"bnz {self.start_label}")
+        writer.write(self, f"{self.end_label}:")
+        writer.level -= 1
+
+    def write_unrolled_teal(self, writer: "TealWriter") -> None:
+        assert self.unroll is not None
+        start, end = cast(Tuple[int, int], self.get_range())
+        slot, name = self.var.scratch_slot, self.var.name
+        # iterations before the loop (all of them if fully unrolled)
+        peeled = (end - start) % self.unroll
+        if self.unroll >= end - start:
+            peeled = end - start
+        writer.write(self, f"// tl:{self.line_no}: {self.line}")
+        writer.level += 1
+        self.write_hoisted(writer, self.hoisted)
+        for i in range(peeled):
+            if self.unroll_counter:
+                writer.write(self, f"pushint {start + i}; store {slot} // {name}")
+            self.write_body_copy(writer, i)
+        if peeled < end - start:
+            writer.write(self, f"pushint {start + peeled}; store {slot} // {name}")
+            writer.write(self, f"{self.start_label}:")
+            for i in range(self.unroll):
+                if i and self.unroll_counter:
+                    writer.write(
+                        self, f"load {slot}; pushint 1; +; store {slot} // {name}"
+                    )
+                self.write_body_copy(writer, peeled + i)
+            step = 1 if self.unroll_counter else self.unroll
+            writer.write(
+                self, f"load {slot}; pushint {step}; +; dup; store {slot} // {name}"
+            )
+            writer.write(self, self.end)
+            writer.write(self, "!=")
+            writer.write(self, f"bnz {self.start_label}")
+        writer.level -= 1
+
     def _tealish(self) -> str:
         output = (
             f"for {self.var_name} in {self.start.tealish()}:{self.end.tealish()}:\n"
@@ -1524,7 +1893,7 @@ class ForStatement(InlineStatement):
         return output
 
 
-class For_Statement(InlineStatement):
+class For_Statement(LoopStatement):
     possible_child_nodes = [InlineStatement]
     pattern = r"for _ in (?P<start>[a-zA-Z0-9_]+):(?P<end>[a-zA-Z0-9_]+):$"
     start: GenericExpression
@@ -1557,7 +1926,17 @@ class For_Statement(InlineStatement):
         for n in self.nodes:
             n.process()
 
+    def get_range(self) -> Optional[Tuple[int, int]]:
+        start, end = get_constant_int(self.start), get_constant_int(self.end)
+        if start is None or end is None:
+            return None
+        return start, end
+
     def write_teal(self, writer: "TealWriter") -> None:
+        if self.unroll:
+            return self.write_unrolled_teal(writer)
+        if self.rotate:
+            return self.write_rotated_teal(writer)
         writer.write(self, f"// tl:{self.line_no}: {self.line}")
         writer.level += 1
         writer.write(self, self.start)
@@ -1576,6 +1955,54 @@ class For_Statement(InlineStatement):
         writer.write(self, f"{self.end_label}:")
         writer.level -= 1
 
+    def write_rotated_teal(self, writer: "TealWriter") -> None:
+        writer.write(self, f"// tl:{self.line_no}: {self.line}")
+        writer.level += 1
+        # the counter stays on the stack during the loop
+        writer.write(self, self.start)
+        writer.write(self, "dup")
+        writer.write(self, self.end)
+        writer.write(self, "==")
+        writer.write(self, f"bnz {self.end_label}")
+        self.write_hoisted(writer, self.hoisted)
+        writer.write(self, f"{self.start_label}:")
+        for n in self.child_nodes:
+            n.write_teal(writer)
+        writer.write(self, "pushint 1")
+        writer.write(self, "+")
+        writer.write(self, "dup")
+        writer.write(self, self.end)
+        writer.write(self, "!=")
+        writer.write(self, f"bnz {self.start_label}")
+        writer.write(self, f"{self.end_label}:")
+        writer.write(self, "pop")
+        writer.level -= 1
+
+    def write_unrolled_teal(self, writer: "TealWriter") -> None:
+        assert self.unroll is not None
+        start, end = cast(Tuple[int, int], self.get_range())
+        # iterations before the loop (all of them if fully unrolled)
+        peeled = (end - start) % self.unroll
+        if self.unroll >= end - start:
+            peeled = end - start
+        writer.write(self, f"// tl:{self.line_no}: {self.line}")
+        writer.level += 1
+        self.write_hoisted(writer, self.hoisted)
+        for i in range(peeled):
+            self.write_body_copy(writer, i)
+        if peeled < end - start:
+            # the counter stays on the stack during the loop
+            writer.write(self, f"pushint {start + peeled}")
+            writer.write(self, f"{self.start_label}:")
+            for i in range(self.unroll):
+                self.write_body_copy(writer, peeled + i)
+            writer.write(self, f"pushint {self.unroll}; +; dup")
+            writer.write(self, self.end)
+            writer.write(self, "!=")
+            writer.write(self, f"bnz {self.start_label}")
+            writer.write(self, "pop")
+        writer.level -= 1
+
     def _tealish(self) -> str:
         output = f"for _ in {self.start.tealish()}:{self.end.tealish()}:\n"
         for n in self.child_nodes:
@@ -1584,6 +2011,104 @@ class For_Statement(InlineStatement):
         return output
 
 
+class BoxChunksStatement(LoopStatement):
+    """
+    Iterates over the contents of a typed box in chunks of at most 4096 bytes.
+
+    for offset, chunk in BoxChunks(blob, 1024):
+        log(chunk)
+    end
+
+    The last chunk is shorter if the size of the box isn't a multiple of the chunk size.
+    """
+
+    possible_child_nodes = [InlineStatement]
+    # the condition is tested after the body already
+    rotatable = False
+    pattern = (
+        r"for (?P<offset_name>[a-z_][a-zA-Z0-9_]*), (?P<var_name>[a-z_][a-zA-Z0-9_]*)"
+        r" in BoxChunks\((?P<box_name>[a-z][a-zA-Z0-9_]*)(, (?P<chunk_size>[0-9]+))?\):$"
+    )
+    offset_name: str
+    var_name: str
+    box_name: str
+    chunk_size: Optional[str]
+
+    def __init__(self, line: str, parent: Node, compiler: "TealishCompiler") -> None:
+        super().__init__(line, parent, compiler)
+        self.conditional_index = compiler.conditional_count
+        compiler.conditional_count += 1
+        self.start_label = f"l{self.conditional_index}_chunks"
+        self.end_label = f"l{self.conditional_index}_end"
+        self.new_scope(f"for__{self.conditional_index}")
+
+    @classmethod
+    def consume(cls, compiler: "TealishCompiler", parent: Node) -> "BoxChunksStatement":
+        node = BoxChunksStatement(compiler.consume_line(), parent, compiler=compiler)
+        while True:
+            if compiler.peek() == "end":
+                compiler.consume_line()
+                break
+            node.add_child(InlineStatement.consume(compiler, node))
+        return node
+
+    def process(self) -> None:
+        self.box = self.get_var(self.box_name)
+        if self.box is None or not isinstance(self.box.tealish_type, BoxType):
+            raise CompileError(f"{self.box_name} is not a box", node=self)
+        self.size = self.box.tealish_type.size
+        self.step = int(self.chunk_size or MAX_BYTES)
+        if not 0 < self.step <= MAX_BYTES:
+            raise CompileError(
+                f"The chunk size of BoxChunks must be from 1 to {MAX_BYTES}", node=self
+            )
+        self.offset_var = self.declare_scratch_var(self.offset_name, "int")
+        chunk_type = "bytes" if self.size % self.step else f"bytes[{self.step}]"
+        self.var = self.declare_scratch_var(self.var_name, chunk_type)
+        for n in self.nodes:
+            n.process()
+        self.del_var(self.offset_name)
+        self.del_var(self.var_name)
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        offset = self.offset_var.scratch_slot
+        writer.write(self, f"// tl:{self.line_no}: {self.line}")
+        writer.level += 1
+        self.write_hoisted(writer, self.hoisted)
+        writer.write(self, f"pushint 0; store {offset} // {self.offset_name}")
+        # the box has at least one chunk so the condition is tested after the body
+        writer.write(self, f"{self.start_label}:")
+        writer.write(self, f"load {self.box.scratch_slot}; load {offset}")
+        if self.size % self.step:
+            # min(size - offset, step)
+            writer.write(
+                self, f"pushint {self.size}; load {offset}; -; pushint {self.step}"
+            )
+            writer.write(self, "dup2; >; select")
+        else:
+            writer.write(self, f"pushint {self.step}")
+        writer.write(
+            self, f"box_extract; store {self.var.scratch_slot} // {self.var_name}"
+        )
+        for n in self.child_nodes:
+            n.write_teal(writer)
+        writer.write(self, f"load {offset}; pushint {self.step}; +; dup")
+        writer.write(self, f"store {offset}; pushint {self.size}; <")
+        writer.write(self, f"bnz {self.start_label}")
+        writer.write(self, f"{self.end_label}:")
+        writer.level -= 1
+
+    def _tealish(self) -> str:
+        args = self.box_name
+        if self.chunk_size:
+            args += f", {self.chunk_size}"
+        output = f"for {self.offset_name}, {self.var_name} in BoxChunks({args}):\n"
+        for n in self.child_nodes:
+            output += indent(n.tealish())
+        output += "end\n"
+        return output
+
+
 class ArgsList(Expression):
     arg_pattern = r"(?P<arg_name>[a-z][a-z_0-9]*): (?P<arg_type>[a-zA-Z][A-Za-z_0-9<>]*(?:\[\d+\])?)"
     pattern = rf"(?P<args>({arg_pattern}(, )?)*)"
@@ -1654,6 +2179,7 @@ class Func(InlineStatement):
             node.process()
 
     def write_teal(self, writer: "TealWriter") -> None:
+        start = len(writer.output)
         writer.write(self, f"// tl:{self.line_no}: {self.line}")
         writer.write(self, f"{self.label}:")
         writer.level += 1
@@ -1662,9 +2188,13 @@ class Func(InlineStatement):
             writer.write(
                 self, f"store {var.scratch_slot} // {name} [{var.tealish_type}]"
             )
+        if self.compiler.instrument:
+            writer.write(self, instrument_entry_teal(self))
         for node in self.child_nodes:
             node.write_teal(writer)
         writer.level -= 1
+        # used by the optimizer to find the body of the func in the output
+        self.teal_range = (start, len(writer.output))
 
     def _tealish(self) -> str:
         returns = (
@@ -1722,6 +2252,8 @@ class Return(LineStatement):
         if self.args:
             for i, expression in enumerate(self.args_expressions[::-1]):
                 writer.write(self, expression)
+        if self.compiler.instrument:
+            writer.write(self, instrument_exit_teal(self.func))
         writer.write(self, "retsub")
 
     def _tealish(self) -> str:
@@ -1801,6 +2333,75 @@ class DecoratedFunc(InlineStatement):
         return output
 
 
+class DecoratedFor(InlineStatement):
+    possible_child_nodes = [Decorator, ForStatement, For_Statement]
+    pattern = r""
+
+    def __init__(
+        self,
+        line: str,
+        parent: Optional[Node] = None,
+        compiler: Optional["TealishCompiler"] = None,
+    ) -> None:
+        super().__init__(line, parent, compiler)
+        self.loop = None
+        self.decorators = []
+
+    def add_decorator(self, node) -> None:
+        self.decorators.append(node)
+        self.add_child(node)
+
+    def set_loop(self, node) -> None:
+        self.loop = node
+        for decorator in self.decorators:
+            if decorator.name != "unroll":
+                raise ParseError(
+                    f'Unexpected decorator "@{decorator.name}" for a for loop '
+                    + f"at line {decorator.line_no}."
+                )
+            self.loop.attributes[decorator.name] = {}
+            if m := re.match(r"(?P<key>.*)=(?P<value>.*)", decorator.params):
+                self.loop.attributes[decorator.name] = {
+                    m.groupdict()["key"]: m.groupdict()["value"]
+                }
+        self.add_child(node)
+
+    @classmethod
+    def consume(
+        cls, compiler: "TealishCompiler", parent: Optional[Node]
+    ) -> "DecoratedFor":
+        decorated_for = DecoratedFor("", parent, compiler=compiler)
+        while compiler.peek().startswith("@"):
+            decorated_for.add_decorator(Decorator.consume(compiler, parent))
+        if compiler.peek().startswith("for _"):
+            decorated_for.set_loop(For_Statement.consume(compiler, decorated_for))
+        else:
+            decorated_for.set_loop(ForStatement.consume(compiler, decorated_for))
+        return decorated_for
+
+    def process(self) -> None:
+        for node in self.child_nodes:
+            node.process()
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        writer.write(self, self.loop)
+
+    def _tealish(self) -> str:
+        output = ""
+        for n in self.decorators:
+            output += n.tealish()
+        output += self.loop.tealish()
+        return output
+
+
+def peek_decorated(compiler: "TealishCompiler") -> str:
+    """Returns the line following the decorators at the current line."""
+    for line in compiler.source_lines[compiler.line_no :]:
+        if not line.strip().startswith("@"):
+            return line.strip()
+    return ""
+
+
 class StructFieldDefinition(InlineStatement):
     pattern = (
         r"(?P<field_name>[a-z][A-Z-a-z0-9_]*): "
@@ -1886,6 +2487,162 @@ class StructDefinition(InlineStatement):
         return output
 
 
+class StateFieldDefinition(InlineStatement):
+    pattern = (
+        r"(?P<field_name>[a-z][a-zA-Z0-9_]*): "
+        + r"(?P<data_type>[a-zA-Z][a-zA-Z0-9_]+(\[\d+\])?)"
+        + r"( = \"(?P<key>.*)\")?$"
+    )
+    field_name: str
+    data_type: str
+    # defaults to the field name
+    key: Optional[str]
+
+    def process(self) -> None:
+        pass
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        pass
+
+    def _tealish(self) -> str:
+        output = f"{self.field_name}: {self.data_type}"
+        if self.key is not None:
+            output += f' = "{self.key}"'
+        return output
+
+
+class StateDefinition(InlineStatement):
+    """
+    state global:
+        manager: bytes[32] = "MANAGER"
+        fee_rate: int
+    end
+
+    state local:
+        balance: int
+    end
+    """
+
+    possible_child_nodes = [StateFieldDefinition]
+    pattern = r"state (?P<scope>global|local):$"
+    scope: str
+
+    @classmethod
+    def consume(
+        cls, compiler: "TealishCompiler", parent: Optional[Node]
+    ) -> "StateDefinition":
+        node = cls(compiler.consume_line(), parent, compiler=compiler)
+        if not isinstance(parent, Program):
+            raise ParseError(
+                f"Unexpected StateDefinition definition at line {node.line_no}. "
+                + "StateDefinition definitions should be at the top level of the file."
+            )
+        while True:
+            if compiler.peek() == "end":
+                compiler.consume_line()
+                break
+            elif compiler.peek().startswith("#"):
+                compiler.consume_line()
+            else:
+                node.add_child(
+                    StateFieldDefinition(
+                        compiler.consume_line(), node, compiler=compiler
+                    )
+                )
+        return node
+
+    def process(self) -> None:
+        schema = self.compiler.state_schemas[self.scope]
+        keys = {f.key for f in schema.fields.values()}
+        for field in self.child_nodes:
+            field_node = cast(StateFieldDefinition, field)
+            name = field_node.field_name
+            key = name if field_node.key is None else field_node.key
+            try:
+                type = get_type_instance(field_node.data_type)
+            except KeyError:
+                raise CompileError(
+                    f'Unknown type "{field_node.data_type}"', node=field_node
+                )
+            if isinstance(type, UIntType) or not isinstance(type, (IntType, BytesType)):
+                raise CompileError(
+                    f"State values are int or bytes, got {type}", node=field_node
+                )
+            if name in schema.fields or key in keys:
+                raise CompileError(
+                    f'Redefinition of {self.scope} state key "{key}"', node=field_node
+                )
+            schema.add_field(name, type, key)
+            field = schema.fields[name]
+            if len(field.key_bytes) > MAX_STATE_KEY_SIZE:
+                raise CompileError(
+                    f'State key "{key}" is longer than {MAX_STATE_KEY_SIZE} bytes',
+                    node=field_node,
+                )
+            if len(field.key_bytes) + type.size > MAX_STATE_ENTRY_SIZE:
+                raise CompileError(
+                    f'State key "{key}" & its {type} value exceed {MAX_STATE_ENTRY_SIZE} bytes',
+                    node=field_node,
+                )
+            keys.add(key)
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        pass
+
+    def _tealish(self) -> str:
+        output = f"state {self.scope}:\n"
+        for n in self.child_nodes:
+            output += indent(n.tealish()) + "\n"
+        output += "end\n"
+        return output
+
+
+class StateAssignment(LineStatement):
+    # GlobalState.fee_rate = 30
+    # LocalState[Txn.Sender].balance = amount
+    pattern = (
+        r"(GlobalState|LocalState\[(?P<account>.*?)\])\.(?P<field_name>[a-z][a-zA-Z0-9_]*)"
+        r" = (?P<expression>.*)$"
+    )
+    # None for global state
+    account: GenericExpression
+    field_name: str
+    expression: GenericExpression
+
+    def process(self) -> None:
+        self.scope = "global" if self.account is None else "local"
+        schema = self.compiler.state_schemas[self.scope]
+        if self.field_name not in schema.fields:
+            raise CompileError(
+                f'Unknown {self.scope} state key "{self.field_name}"', node=self
+            )
+        self.field = schema.fields[self.field_name]
+        schema.uses[self.field.key] += 1
+        if self.account is not None:
+            self.account.process()
+        self.expression.process()
+        if not self.field.tealish_type.can_hold(self.expression.type):
+            raise CompileError(
+                "Incorrect type for state assignment. "
+                + f"Expected {self.field.tealish_type}, got {self.expression.type}",
+                node=self,
+            )
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        writer.write(self, f"// tl:{self.line_no}: {self.line}")
+        if self.account is not None:
+            writer.write(self, self.account)
+        writer.write(self, get_state_key_op(self, self.field))
+        writer.write(self, self.expression)
+        writer.write(self, f"app_{self.scope}_put")
+
+    def _tealish(self) -> str:
+        target = "GlobalState"
+        if self.account is not None:
+            target = f"LocalState[{self.account.tealish()}]"
+        return f"{target}.{self.field_name} = {self.expression.tealish()}\n"
+
+
 class StructOrBoxAssignment(LineStatement):
     pattern = (
         r"(?P<name>[a-z][a-zA-Z0-9_]*).(?P<field_name>[a-z][a-zA-Z0-9_]*)"
@@ -1894,6 +2651,8 @@ class StructOrBoxAssignment(LineStatement):
     name: Name
     field_name: str
     expression: GenericExpression
+    # set by the boxes optimization
+    cache_slot: Optional[int] = None
 
     def process(self) -> None:
         self.var = self.get_var(self.name.value)
@@ -1928,10 +2687,14 @@ class StructOrBoxAssignment(LineStatement):
             raise CompileError(message)
 
     def write_teal(self, writer: "TealWriter") -> None:
-        if isinstance(self.object_type, StructType):
+        # a box loaded into a scratch slot by the boxes optimization is set like a struct
+        slot = self.var.scratch_slot if self.cache_slot is None else self.cache_slot
+        if isinstance(self.data_type, BitsType):
+            self.write_bits(writer, slot)
+        elif isinstance(self.object_type, StructType) or self.cache_slot is not None:
             writer.write(
                 self,
-                f"// tl:{self.line_no}: {self.line} [slot {self.var.scratch_slot}]",
+                f"// tl:{self.line_no}: {self.line} [slot {slot}]",
             )
             writer.write(self, self.expression)
             teal = []
@@ -1943,10 +2706,10 @@ class StructOrBoxAssignment(LineStatement):
                     )
             # struct setter one liner
             teal += [
-                f"load {self.var.scratch_slot}",
+                f"load {slot}",
                 "swap",
                 f"replace {self.offset}",
-                f"store {self.var.scratch_slot}",
+                f"store {slot}",
                 f"// set {self.name.value}.{self.field_name}",
             ]
             writer.write(self, teal)
@@ -1971,6 +2734,26 @@ class StructOrBoxAssignment(LineStatement):
             ]
             writer.write(self, teal)
 
+    def write_bits(self, writer: "TealWriter", slot: int) -> None:
+        fits = get_max_value(self.expression) <= self.data_type.max_value
+        name = f"{self.name.value}.{self.field_name}"
+        if isinstance(self.object_type, StructType) or self.cache_slot is not None:
+            writer.write(self, f"// tl:{self.line_no}: {self.line} [slot {slot}]")
+            writer.write(self, f"load {slot}")
+            write_bits_update(
+                writer, self, self.data_type, self.offset, self.expression, fits
+            )
+            writer.write(self, [f"store {slot}", f"// set {name}"])
+        else:
+            # the byte of the field is read, updated & replaced
+            writer.write(self, f"// tl:{self.line_no}: {self.line}")
+            writer.write(
+                self,
+                f"load {slot}; pushint {self.offset}; dup2; pushint 1; box_extract",
+            )
+            write_bits_update(writer, self, self.data_type, 0, self.expression, fits)
+            writer.write(self, ["box_replace", f"// boxset {name}"])
+
     def _tealish(self) -> str:
         s = f"{self.name.tealish()}.{self.field_name}"
         if self.expression:
@@ -1978,6 +2761,108 @@ class StructOrBoxAssignment(LineStatement):
         return s + "\n"
 
 
+class BoxArrayAssignment(LineStatement):
+    # orders[i].price = 5
+    # orders[i] = order
+    # sets a field of an existing box of a box map
+    # positions[Txn.Sender].amount = 5
+    # creates or replaces the box of a box map key
+    # positions[Txn.Sender] = position
+    pattern = (
+        r"(?P<name>[a-z][a-zA-Z0-9_]*)\[(?P<index>.+?)\]"
+        r"(?P<fields>(\.[a-z][a-zA-Z0-9_]*)*) = (?P<expression>.*)$"
+    )
+    name: str
+    index: GenericExpression
+    fields: str
+    expression: GenericExpression
+
+    def process(self) -> None:
+        self.var = self.get_var(self.name)
+        if self.var is None or not isinstance(
+            self.var.tealish_type, (BoxArrayType, BoxMapType)
+        ):
+            raise CompileError(f"{self.name} is not a box array or map", node=self)
+        self.array = self.var.tealish_type
+        self.index.process()
+        if isinstance(self.array, BoxMapType):
+            if not self.array.can_hold_key(self.index.type):
+                raise CompileError(
+                    f"Incorrect type for key of {self.name}. "
+                    + f"Expected {self.array.key_type_name}, got {self.index.type}",
+                    node=self,
+                )
+        elif not IntType().can_hold(self.index.type):
+            raise CompileError(
+                f"Index of {self.name} must be an int, got {self.index.type}", node=self
+            )
+        elif isinstance(self.index, Integer) and self.index.value >= self.array.length:
+            raise CompileError(
+                f"Index {self.index.value} out of bounds of {self.array}", node=self
+            )
+        path = f"{self.name}[{self.index.tealish()}]"
+        self.field_names = self.fields.split(".")[1:]
+        self.offset, self.data_type = self.resolve_fields(
+            path, self.array.struct, self.field_names
+        )
+        self.expression.process()
+        if not self.data_type.can_hold(self.expression.type):
+            raise CompileError(
+                "Incorrect type for box assignment. "
+                + f"Expected {self.data_type}, got {self.expression.type}",
+                node=self,
+            )
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        writer.write(self, f"// tl:{self.line_no}: {self.line}")
+        if isinstance(self.array, BoxMapType) and not self.field_names:
+            # box_put creates the box if it doesn't exist
+            writer.write(self, f"load {self.var.scratch_slot} // {self.name}")
+            write_box_map_key(writer, self, self.array, self.index)
+            writer.write(self, self.expression)
+            writer.write(self, "box_put")
+            return
+        if isinstance(self.data_type, BitsType):
+            self.write_bits(writer)
+            return
+        writer.write(self, self.expression)
+        if isinstance(self.data_type, IntType):
+            writer.write(self, "itob")
+            if isinstance(self.data_type, UIntType):
+                size = self.data_type.size
+                writer.write(self, f"extract {8 - size} {size}")
+        writer.write(self, f"load {self.var.scratch_slot} // {self.name}")
+        if isinstance(self.array, BoxMapType):
+            write_box_map_key(writer, self, self.array, self.index)
+            writer.write(self, f"pushint {self.offset}")
+        else:
+            write_box_array_offset(writer, self, self.array, self.index, self.offset)
+        writer.write(self, "uncover 2; box_replace")
+
+    def write_bits(self, writer: "TealWriter") -> None:
+        # the byte of the field is read, updated & replaced
+        writer.write(self, f"load {self.var.scratch_slot} // {self.name}")
+        if isinstance(self.array, BoxMapType):
+            write_box_map_key(writer, self, self.array, self.index)
+            writer.write(self, f"pushint {self.offset}")
+        else:
+            write_box_array_offset(writer, self, self.array, self.index, self.offset)
+        writer.write(self, "dup2; pushint 1; box_extract")
+        fits = get_max_value(self.expression) <= self.data_type.max_value
+        write_bits_update(writer, self, self.data_type, 0, self.expression, fits)
+        writer.write(self, "box_replace")
+
+    def _tealish(self) -> str:
+        return (
+            f"{self.name}[{self.index.tealish()}]{self.fields}"
+            + f" = {self.expression.tealish()}\n"
+        )
+
+
+# The largest box
+MAX_BOX_SIZE = 32768
+
+
 class BoxDeclaration(LineStatement):
     # asserts box does not already exist
     # box<Item> item1 = CreateBox("a")
@@ -1985,12 +2870,20 @@ class BoxDeclaration(LineStatement):
     # box<Item> item1 = OpenBox("a")
     # makes no assertions about the box
     # box<Item> item1 = Box("a")
+    # box<Order[1000]> orders = CreateBox("orders")
+    # a ring buffer of the latest 100 trades
+    # boxring<Trade[100]> trades = CreateBox("trades")
     pattern = (
-        r"box<(?P<struct_name>[A-Z][a-zA-Z0-9_]*)> (?P<name>[a-z][a-zA-Z0-9_]*)"
+        r"(?P<kind>box|boxring)<(?P<struct_name>[A-Z][a-zA-Z0-9_]*)"
+        r"(\[(?P<length>[0-9]+)\])?>"
+        r" (?P<name>[a-z][a-zA-Z0-9_]*)"
         r" = (?P<method>OpenOrCreate|Open|Create)?Box\((?P<key>.*)\)$"
     )
+    kind: str
     # Name to struct type
     struct_name: str
+    # the number of structs of a box array (or capacity of a ring buffer)
+    length: Optional[str]
     name: Name
     method: str
     key: GenericExpression
@@ -1998,7 +2891,25 @@ class BoxDeclaration(LineStatement):
     def process(self):
         self.struct = get_struct(self.struct_name)
         self.box_size = self.struct.size
-        self.var = self.declare_scratch_var(self.name.value, f"box<{self.struct_name}>")
+        type_name = self.struct_name
+        if self.length:
+            self.box_size *= int(self.length)
+            type_name += f"[{self.length}]"
+        elif self.kind == "boxring":
+            raise CompileError(
+                f"Ring buffer {self.name.value} needs a capacity, e.g. {self.kind}<{type_name}[100]>",
+                node=self,
+            )
+        if self.kind == "boxring":
+            self.box_size += BoxRingType.header_size
+        if self.box_size > MAX_BOX_SIZE:
+            raise CompileError(
+                f"Box of {self.box_size} bytes exceeds the maximum of {MAX_BOX_SIZE}",
+                node=self,
+            )
+        self.var = self.declare_scratch_var(
+            self.name.value, f"{self.kind}<{type_name}>"
+        )
         self.key.process()
         if not BytesType().can_hold(self.key.type):
             raise CompileError(
@@ -2011,10 +2922,15 @@ class BoxDeclaration(LineStatement):
             self, f"// tl:{self.line_no}: {self.line} [slot {self.var.scratch_slot}]"
         )
         writer.write(self, self.key)
+        size = f"{self.struct_name}.size"
+        if self.length:
+            size = f"{self.length} * {size}"
+        if self.kind == "boxring":
+            size = f"{BoxRingType.header_size} + {size}"
         if self.method == "Open":
             writer.write(
                 self,
-                f"dup; box_len; assert; pushint {self.box_size}; ==; assert // len(box) == {self.struct_name}.size",
+                f"dup; box_len; assert; pushint {self.box_size}; ==; assert // len(box) == {size}",
             )
         elif self.method == "Create":
             writer.write(
@@ -2032,13 +2948,114 @@ class BoxDeclaration(LineStatement):
         writer.write(self, f"store {self.var.scratch_slot} // box:{self.name.value}")
 
     def _tealish(self):
+        type_name = self.struct_name
+        if self.length:
+            type_name += f"[{self.length}]"
         s = (
-            f"box<{self.struct_name}> {self.name.tealish()} = "
-            f"{self.method}Box({self.key.tealish()})"
+            f"{self.kind}<{type_name}> {self.name.tealish()} = "
+            f"{self.method or ''}Box({self.key.tealish()})"
         )
         return s + "\n"
 
 
+class BoxMapDeclaration(LineStatement):
+    # boxes of Position structs named "p" + the address
+    # boxmap<addr, Position> positions = BoxMap("p")
+    # boxes named "o" + itob(id)
+    # boxmap<int, Order> orders = BoxMap("o")
+    # boxes named "n" + sha256(name)
+    # boxmap<bytes, Item> items = BoxMap("n")
+    pattern = (
+        r"boxmap<(?P<key_type>int|addr|bytes(\[[0-9]+\])?), ?"
+        r"(?P<struct_name>[A-Z][a-zA-Z0-9_]*)> (?P<name>[a-z][a-zA-Z0-9_]*)"
+        r" = BoxMap\((?P<prefix>.*)\)$"
+    )
+    key_type: str
+    struct_name: str
+    name: Name
+    prefix: GenericExpression
+
+    def process(self) -> None:
+        get_struct(self.struct_name)
+        self.var = self.declare_scratch_var(
+            self.name.value, f"boxmap<{self.key_type}, {self.struct_name}>"
+        )
+        self.prefix.process()
+        if not (isinstance(self.prefix, Bytes) and isinstance(self.prefix.value, str)):
+            raise CompileError(
+                f"The prefix of box map {self.name.value} must be a bytes literal",
+                node=self,
+            )
+        # box names are derived at compile time so the prefix is part of the type
+        self.map = self.var.tealish_type
+        self.map.prefix = self.prefix.value.encode()
+        name_size = len(self.map.get_box_name(b"\x00" * (self.map.key_size or 0)))
+        if name_size > MAX_BOX_NAME_SIZE:
+            raise CompileError(
+                f"Box names of {self.name.value} are longer than {MAX_BOX_NAME_SIZE} bytes",
+                node=self,
+            )
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        writer.write(
+            self, f"// tl:{self.line_no}: {self.line} [slot {self.var.scratch_slot}]"
+        )
+        writer.write(self, self.prefix)
+        writer.write(self, f"store {self.var.scratch_slot} // boxmap:{self.name.value}")
+
+    def _tealish(self) -> str:
+        return (
+            f"boxmap<{self.key_type}, {self.struct_name}> {self.name.tealish()}"
+            + f" = BoxMap({self.prefix.tealish()})\n"
+        )
+
+
+class BoxCache(InlineStatement):
+    """
+    Loads a box into a scratch slot or writes it back.
+
+    Inserted by the boxes optimization (rather than parsed) before the first
+    statement of a func, block or program reading or setting fields of the box,
+    and before its exits when fields are set.
+    """
+
+    def __init__(
+        self, statement: Node, declaration: BoxDeclaration, slot: int, load: bool
+    ) -> None:
+        super().__init__("", parent=statement.parent)
+        self.compiler = statement.compiler
+        self._line_no = statement.line_no
+        self.declaration = declaration
+        self.slot = slot
+        self.load = load
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        box_slot = self.declaration.var.scratch_slot
+        name = self.declaration.name.value
+        if self.load:
+            teal = [f"load {box_slot}", "box_get", "assert", f"store {self.slot}"]
+            teal.append(f"// load box {name} into slot {self.slot}")
+        elif self.declaration.method:
+            # the size of the box is asserted (or set) by its declaration
+            teal = [f"load {box_slot}", f"load {self.slot}", "box_put"]
+            teal.append(f"// write back box {name}")
+        else:
+            teal = [f"load {box_slot}", "pushint 0", f"load {self.slot}"]
+            teal += ["box_replace", f"// write back box {name}"]
+        writer.write(self, teal)
+
+    def insert_before(self, statement: Node) -> None:
+        for nodes in (self.parent.nodes, self.parent.child_nodes):
+            nodes.insert(next(i for i, n in enumerate(nodes) if n is statement), self)
+
+    def append(self) -> None:
+        self.parent.nodes.append(self)
+        self.parent.child_nodes.append(self)
+
+    def _tealish(self) -> str:
+        return ""
+
+
 def split_return_args(s):
     parentheses = 0
     quotes = False
@@ -2055,6 +3072,23 @@ def split_return_args(s):
     return [s]
 
 
+def instrument_entry_teal(node: Union["Func", "Route"]) -> str:
+    return (
+        f"global OpcodeBudget; store {node.instrument_slot}"
+        f" // instrument: budget before {node.name}"
+    )
+
+
+def instrument_exit_teal(node: Union["Func", "Route"]) -> str:
+    # prefix + id + budget before + budget after. The cost is computed off chain
+    # because inner app calls can increase the budget between the two reads.
+    record = INSTRUMENT_PREFIX.hex() + f"{node.instrument_id:04x}"
+    return (
+        f"global OpcodeBudget; itob; load {node.instrument_slot}; itob; swap; concat; "
+        f"pushbytes 0x{record}; swap; concat; log // instrument: {node.name}"
+    )
+
+
 def indent(s: str) -> str:
     return textwrap.indent(s, "    ")
 
@@ -0,0 +1,1678 @@
+import re
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .base import BaseNode
+from .cfg import (
+    ALL_SLOTS,
+    BRANCH_OPS,
+    CFG,
+    TERMINATOR_OPS,
+    Line,
+    Liveness,
+    clobbers_scratch,
+    get_branch_targets,
+    get_label,
+    get_ops,
+    get_slot_op,
+    is_code,
+    rename_labels,
+    solve,
+    split_comment,
+    split_label,
+)
+from .errors import CompileError
+from .expression_nodes import (
+    BinaryOp,
+    BoxArrayField,
+    Bytes,
+    Constant,
+    Enum,
+    FieldRead,
+    FunctionCall,
+    Group,
+    InnerTxnField,
+    Integer,
+    NegativeGroupIndex,
+    OpCall,
+    PositiveGroupIndex,
+    ScratchValue,
+    StateRead,
+    StdLibFunctionCall,
+    StructOrBoxField,
+    StructSlice,
+    UnaryOp,
+    UserDefinedFuncCall,
+    Variable,
+    is_constant_index,
+)
+from .langspec import get_active_langspec, scratch_ops
+from .nodes import (
+    Assignment,
+    Blank,
+    Block,
+    BoxArrayAssignment,
+    BoxDeclaration,
+    BoxCache,
+    BoxChunksStatement,
+    BoxMapDeclaration,
+    Break,
+    Comment,
+    DecoratedFunc,
+    Exit,
+    ForStatement,
+    Func,
+    InnerGroup,
+    InnerTxn,
+    Jump,
+    LoopStatement,
+    Node,
+    Return,
+    Router,
+    StateAssignment,
+    StructOrBoxAssignment,
+    Switch,
+    Teal,
+    VarDeclaration,
+    WhileStatement,
+)
+from .ranges import MAX_BYTES
+from .types import BoxType, IntType, StructType
+
+if TYPE_CHECKING:
+    from . import TealishCompiler
+
+
+# Funcs with at most this many ops are inlined at every call site
+INLINE_THRESHOLD = 8
+# With profile data funcs with at least 1/HOT_CALLS_RATIO of the calls of the hottest func
+# are inlined up to HOT_INLINE_FACTOR times the threshold; funcs never called are not
+HOT_CALLS_RATIO = 10
+HOT_INLINE_FACTOR = 4
+# Constant range for loops are unrolled when the unrolled body has at most this many ops
+UNROLL_LIMIT = 64
+# Factors tried (largest first) when a fully unrolled loop exceeds the limit
+UNROLL_FACTORS = [8, 4, 2]
+# Most values kept on the stack at once by the stack pass, far below the 1000 item limit
+MAX_STACK_TEMPORARIES = 8
+# The largest immediate of dig & uncover
+MAX_STACK_DEPTH = 255
+
+
+def count_ops(lines: List[Line]) -> int:
+    return sum(len(get_ops(teal)) for teal, _ in lines)
+
+
+def get_label_lines(lines: List[Line]) -> Dict[str, int]:
+    """Returns a map of label => index of the line defining it."""
+    labels = {}
+    for i, (teal, _) in enumerate(lines):
+        label = get_label(teal)
+        if label is not None:
+            labels[label] = i
+    return labels
+
+
+def run_ast_passes(compiler: "TealishCompiler") -> None:
+    """Runs the enabled optimization passes on the processed nodes, before Teal is written."""
+    for name, optimization_pass in AST_PASSES.items():
+        if name in compiler.optimize:
+            optimization_pass(compiler)
+
+
+def run_passes(compiler: "TealishCompiler", lines: List[Line]) -> List[Line]:
+    """Runs the enabled optimization passes on the Teal output, in order."""
+    for name, optimization_pass in PASSES.items():
+        if name in compiler.optimize:
+            lines = optimization_pass(compiler, lines)
+    return lines
+
+
+def count_teal_ops(node: BaseNode) -> int:
+    """Returns the number of ops written for a node."""
+    from . import OneLineTealWriter
+
+    writer = OneLineTealWriter()
+    node.write_teal(writer)
+    return sum(len(get_ops(teal)) for teal in writer.teal)
+
+
+def get_regions(compiler: "TealishCompiler") -> List[Node]:
+    """
+    Returns the program, blocks & funcs.
+
+    The statements of a region (excluding nested block & func definitions)
+    are executed in sequence from its start.
+    """
+    program = compiler.nodes[0]
+    return [program] + program.find_child_nodes(Block) + program.find_child_nodes(Func)
+
+
+def get_region_statements(region: Node) -> List[Node]:
+    return [
+        n
+        for n in region.child_nodes
+        if not isinstance(n, (Block, Func, DecoratedFunc, Comment, Blank))
+    ]
+
+
+def get_header_expressions(statement: Node) -> List[BaseNode]:
+    """Returns the expressions of a statement (excluding those of nested statements)."""
+    return [
+        n for n in statement.nodes if not any(n is c for c in statement.child_nodes)
+    ]
+
+
+def iter_nodes(node: BaseNode) -> Iterator[BaseNode]:
+    """Yields a node & its descendants, excluding nested block & func definitions."""
+    yield node
+    for child in getattr(node, "nodes", []):
+        if not isinstance(child, (Block, Func, DecoratedFunc)):
+            yield from iter_nodes(child)
+
+
+def iter_assertions(compiler: "TealishCompiler") -> Iterator[Tuple[int, BaseNode]]:
+    """Yields the runtime type assertions (of `Cast`, `Convert` & `EnsureType`) & their lines."""
+    from .stdlib import AssertionWrapper
+
+    seen: Set[int] = set()
+
+    def visit(obj: BaseNode, line_no: int) -> Iterator[Tuple[int, BaseNode]]:
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        line_no = getattr(obj, "line_no", line_no)
+        if isinstance(obj, AssertionWrapper):
+            yield line_no, obj
+        for key, value in vars(obj).items():
+            if key == "parent":
+                continue
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, BaseNode):
+                    yield from visit(item, line_no)
+
+    yield from visit(compiler.nodes[0], 0)
+
+
+def remove_proven_assertions(compiler: "TealishCompiler") -> None:
+    """Removes type assertions that always hold (see `tealish.ranges`)."""
+    for line_no, assertion in iter_assertions(compiler):
+        proven, reason = assertion.prove()
+        if proven:
+            assertion.checked = False
+            compiler.report(
+                "asserts", f"line {line_no}: {assertion.describe()} removed, {reason}"
+            )
+
+
+def report_assertions(compiler: "TealishCompiler") -> None:
+    """Reports the type assertions kept in the output & why they are needed."""
+    for line_no, assertion in iter_assertions(compiler):
+        if not assertion.checked:
+            continue
+        proven, reason = assertion.prove()
+        if proven:
+            reason += ", -O asserts removes it"
+        compiler.report(
+            "assertions", f"line {line_no}: {assertion.describe()} kept, {reason}"
+        )
+
+
+class FieldCSE:
+    """
+    Caches repeated reads of transaction & global fields in scratch slots.
+
+    In each region the first statement that reads a field unconditionally (in its
+    own expressions rather than in a nested body) stores the value & later reads
+    (in the nested bodies of that statement & in following statements) load it.
+    All reads of a field have the same value within an evaluation so a recursive
+    call storing the value again is harmless.
+
+    Cost model: a read of c ops read n more times costs (n + 1) * c ops. Cached it
+    costs c + 2 (dup & store) + n (loads). Single op reads (e.g. `txn Sender`)
+    are never cheaper cached, reads with computed group indexes (e.g. `Gtxn[+1]`) are.
+    """
+
+    def __init__(self, compiler: "TealishCompiler") -> None:
+        self.compiler = compiler
+
+    def find_reads(
+        self, region: Node
+    ) -> Tuple[Dict[str, FieldRead], Dict[str, List[FieldRead]]]:
+        """Returns the defining read & the dominated reads of each field."""
+        defines: Dict[str, FieldRead] = {}
+        uses: Dict[str, List[FieldRead]] = {}
+        for statement in get_region_statements(region):
+            defined_here = set()
+            for expression in get_header_expressions(statement):
+                for node in iter_nodes(expression):
+                    if isinstance(node, FieldRead) and node.is_cacheable():
+                        key = node.tealish()
+                        if key in defined_here:
+                            continue
+                        elif key in defines:
+                            uses[key].append(node)
+                        else:
+                            defines[key] = node
+                            uses[key] = []
+                            defined_here.add(key)
+            for child in statement.child_nodes:
+                for node in iter_nodes(child):
+                    if isinstance(node, FieldRead) and node.tealish() in defines:
+                        uses[node.tealish()].append(node)
+        return defines, uses
+
+    def run(self) -> None:
+        for region in get_regions(self.compiler):
+            defines, uses = self.find_reads(region)
+            for key, define in defines.items():
+                n = len(uses[key])
+                if not n:
+                    continue
+                cost = count_teal_ops(define)
+                saving = n * cost - (2 + n)
+                if saving <= 0:
+                    self.compiler.report(
+                        "cse",
+                        f"line {define.parent.line_no}: {key} read {n + 1} times not cached"
+                        + f" ({cost} op read)",
+                    )
+                    continue
+                slot = self.compiler.max_slot + 1
+                if slot > 255:
+                    self.compiler.report("cse", f"{key}: no scratch slot to cache it")
+                    continue
+                self.compiler.max_slot = slot
+                define.cache_slot = slot
+                define.cache_store = True
+                for use in uses[key]:
+                    use.cache_slot = slot
+                self.compiler.report(
+                    "cse",
+                    f"line {define.parent.line_no}: {key} read {n + 1} times cached"
+                    + f" in slot {slot}, saving {saving} ops",
+                )
+
+
+def eliminate_common_field_reads(compiler: "TealishCompiler") -> None:
+    FieldCSE(compiler).run()
+
+
+# Ops changing global or local state
+STATE_WRITE_OPS = {"app_global_put", "app_global_del", "app_local_put", "app_local_del"}
+
+
+class StateCache:
+    """
+    Caches repeated reads of global & local state keys in scratch slots.
+
+    As for `FieldCSE` the first statement of a region reading a key in its own
+    expressions stores the value & later reads (in the nested bodies of that statement
+    & in following statements) load it, until a statement may change the key: an
+    assignment of it (of any account for local state), a call of a func changing it,
+    `app_global_put` & co or Teal. Reads in a statement changing the key are cached
+    if they are evaluated before the change (e.g. in `GlobalState.n = GlobalState.n + 1`)
+    but not in loop conditions. Local state is only cached for accounts that don't
+    change within an evaluation (e.g. `Txn.Sender`).
+
+    Cost model as for `FieldCSE`: a read of c ops (2 for global state) read n more times
+    is cached if n * c > 2 + n. Loads also drop uses of the key from the bytecblock.
+    """
+
+    def __init__(self, compiler: "TealishCompiler") -> None:
+        self.compiler = compiler
+        self.func_writes: Dict[int, Optional[Set[Tuple[str, str]]]] = {}
+
+    def get_writes(self, node: BaseNode) -> Optional[Set[Tuple[str, str]]]:
+        """Returns the (scope, field) of the state keys node may change, None for any key."""
+        writes: Set[Tuple[str, str]] = set()
+        for n in iter_written_nodes(node):
+            if isinstance(n, Teal):
+                return None
+            elif isinstance(n, StateAssignment):
+                writes.add((n.scope, n.field_name))
+            elif isinstance(n, OpCall) and n.name in STATE_WRITE_OPS:
+                return None
+            elif isinstance(n, UserDefinedFuncCall):
+                func_writes = self.get_func_writes(n.func)
+                if func_writes is None:
+                    return None
+                writes |= func_writes
+        return writes
+
+    def get_func_writes(self, func: Func) -> Optional[Set[Tuple[str, str]]]:
+        if id(func) not in self.func_writes:
+            # recursive calls are assumed to change any key
+            self.func_writes[id(func)] = None
+            self.func_writes[id(func)] = self.get_writes(func)
+        return self.func_writes[id(func)]
+
+    def get_header_writes(self, statement: Node) -> Optional[Set[Tuple[str, str]]]:
+        writes: Set[Tuple[str, str]] = set()
+        for expression in get_header_expressions(statement):
+            expression_writes = self.get_writes(expression)
+            if expression_writes is None:
+                return None
+            writes |= expression_writes
+        return writes
+
+    def is_cacheable(self, read: StateRead) -> bool:
+        return read.cache_slot is None and all(
+            is_constant_index(i) or (isinstance(i, FieldRead) and i.is_cacheable())
+            for i in read.get_indexes()
+        )
+
+    def find_reads(self, region: Node) -> List[Tuple[StateRead, List[StateRead]]]:
+        """Returns the defining read & the dominated reads of each value of a key."""
+        values: List[Tuple[StateRead, List[StateRead]]] = []
+        active: Dict[str, Tuple[StateRead, List[StateRead]]] = {}
+
+        def changes(writes: Optional[Set[Tuple[str, str]]], read: StateRead) -> bool:
+            return writes is None or (read.scope, read.field) in writes
+
+        def kill(writes: Optional[Set[Tuple[str, str]]]) -> None:
+            for key, (define, _) in list(active.items()):
+                if changes(writes, define):
+                    del active[key]
+
+        for statement in get_region_statements(region):
+            writes = self.get_writes(statement)
+            # loop conditions are evaluated again after the body
+            header_writes = (
+                writes
+                if isinstance(statement, LoopStatement)
+                else self.get_header_writes(statement)
+            )
+            kill(header_writes)
+            defined_here = set()
+            for expression in get_header_expressions(statement):
+                for node in iter_nodes(expression):
+                    if not isinstance(node, StateRead) or not self.is_cacheable(node):
+                        continue
+                    key = node.get_cache_key()
+                    if key in defined_here or changes(header_writes, node):
+                        continue
+                    elif key in active:
+                        active[key][1].append(node)
+                    else:
+                        active[key] = (node, [])
+                        values.append(active[key])
+                        defined_here.add(key)
+            for child in statement.child_nodes:
+                for node in iter_nodes(child):
+                    if (
+                        isinstance(node, StateRead)
+                        and node.get_cache_key() in active
+                        and self.is_cacheable(node)
+                        and not changes(writes, node)
+                    ):
+                        active[node.get_cache_key()][1].append(node)
+            kill(writes)
+        return values
+
+    def run(self) -> None:
+        for region in get_regions(self.compiler):
+            for define, uses in self.find_reads(region):
+                key = define.get_cache_key()
+                n = len(uses)
+                if not n:
+                    continue
+                cost = 2 + sum(count_teal_ops(i) for i in define.get_indexes())
+                saving = n * cost - (2 + n)
+                if saving <= 0:
+                    self.compiler.report(
+                        "state",
+                        f"line {define.line_no}: {key} read {n + 1} times not cached"
+                        + f" ({cost} op read)",
+                    )
+                    continue
+                slot = self.compiler.max_slot + 1
+                if slot > 255:
+                    self.compiler.report("state", f"{key}: no scratch slot to cache it")
+                    continue
+                self.compiler.max_slot = slot
+                define.cache_slot = slot
+                define.cache_store = True
+                for use in uses:
+                    use.cache_slot = slot
+                schema = self.compiler.state_schemas[define.scope]
+                schema.uses[define.state_field.key] -= n
+                self.compiler.report(
+                    "state",
+                    f"line {define.line_no}: {key} read {n + 1} times cached"
+                    + f" in slot {slot}, saving {saving} ops",
+                )
+
+
+def cache_state_reads(compiler: "TealishCompiler") -> None:
+    StateCache(compiler).run()
+
+
+# Bytes read by extract_uintN ops
+EXTRACT_UINT_SIZES = {"extract_uint64": 8, "extract_uint32": 4, "extract_uint16": 2}
+
+
+class FieldExtractFuser:
+    """
+    Reads bytes of struct & box fields with a single extract.
+
+    The offset & size of a field are known at compile time so ops reading part of
+    a field (`extract(1, 2, item.name)`, `extract_uint64(item.data, 8)`) or joining
+    adjacent fields of one struct (`concat(item.name, item.description)`) can read
+    the bytes from the struct directly. Ops are fused bottom up so chains of them
+    (`concat(concat(item.a, item.b), item.c)`) end up as one extract.
+
+    Ops reading outside the field are kept as they fail at runtime.
+    """
+
+    def __init__(self, compiler: "TealishCompiler") -> None:
+        self.compiler = compiler
+        self.results: Dict[int, BaseNode] = {}
+
+    def visit(self, obj: BaseNode, line_no: int) -> BaseNode:
+        if id(obj) in self.results:
+            return self.results[id(obj)]
+        self.results[id(obj)] = obj
+        line_no = getattr(obj, "line_no", line_no)
+        for key, value in vars(obj).items():
+            if key == "parent":
+                continue
+            if isinstance(value, list):
+                for i, item in enumerate(value):
+                    if isinstance(item, BaseNode):
+                        value[i] = self.visit(item, line_no)
+            elif isinstance(value, BaseNode):
+                setattr(obj, key, self.visit(value, line_no))
+        fused = self.fuse(obj)
+        if fused is None:
+            return obj
+        saving = count_teal_ops(obj) - count_teal_ops(fused)
+        self.compiler.report(
+            "fields",
+            f"line {line_no}: {obj.tealish()} read with one extract, saving {saving} ops",
+        )
+        self.results[id(obj)] = fused
+        return fused
+
+    def fuse(self, node: BaseNode) -> Optional[StructSlice]:
+        if not isinstance(node, OpCall):
+            return None
+        fields = [a for a in node.args if is_bytes_field(a)]
+        if node.name in ("extract", "substring") and len(fields) == 1:
+            field = fields[0]
+            immediates = node.immediate_args.split()
+            if not all(i.isdigit() for i in immediates):
+                return None
+            start, end = map(int, immediates)
+            if node.name == "extract":
+                end = start + end if end else field.size
+            if start < end <= field.size:
+                return StructSlice(field, node, field.offset + start, end - start)
+        elif node.name in EXTRACT_UINT_SIZES and is_bytes_field(node.args[0]):
+            field, start = node.args
+            size = EXTRACT_UINT_SIZES[node.name]
+            if isinstance(start, Integer) and start.value + size <= field.size:
+                return StructSlice(field, node, field.offset + start.value, size)
+        elif node.name == "concat" and len(fields) == 2:
+            a, b = fields
+            if a.var is b.var and a.offset + a.size == b.offset:
+                return StructSlice(a, node, a.offset, a.size + b.size)
+        return None
+
+    def run(self) -> None:
+        self.visit(self.compiler.nodes[0], 0)
+
+
+def is_bytes_field(node: BaseNode) -> bool:
+    return isinstance(node, StructOrBoxField) and not isinstance(node.type, IntType)
+
+
+def fuse_field_extracts(compiler: "TealishCompiler") -> None:
+    FieldExtractFuser(compiler).run()
+
+
+def iter_written_nodes(node: BaseNode) -> Iterator[BaseNode]:
+    """
+    Yields a node & the nodes written with it, excluding nested block & func definitions.
+
+    Unlike `iter_nodes` this includes expressions moved by optimizations (e.g. hoisted
+    out of loops) and excludes expressions they replaced.
+    """
+    seen: Set[int] = set()
+
+    def visit(obj: BaseNode) -> Iterator[BaseNode]:
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        yield obj
+        # the expression is written elsewhere (e.g. before a loop) or not at all
+        if isinstance(obj, ScratchValue):
+            return
+        for key, value in vars(obj).items():
+            if key == "parent" or (
+                key == "expression" and isinstance(obj, StructSlice)
+            ):
+                continue
+            for item in value if isinstance(value, (list, tuple)) else [value]:
+                # e.g. (expression, slot) of hoisted expressions
+                for n in item if isinstance(item, tuple) else [item]:
+                    if isinstance(n, BaseNode) and not isinstance(
+                        n, (Block, Func, DecoratedFunc)
+                    ):
+                        yield from visit(n)
+
+    yield from visit(node)
+
+
+# Ops changing boxes, the others (e.g. box_get, box_len) only read them
+BOX_WRITE_OPS = {
+    "box_create",
+    "box_del",
+    "box_put",
+    "box_replace",
+    "box_resize",
+    "box_splice",
+}
+
+
+class BoxCoalescer:
+    """
+    Chooses per func, block & program between field-wise box access & loading the box once.
+
+    Fields of a `box<Struct>` are read with `box_extract` & set with `box_replace`,
+    4 ops each. Alternatively the box is loaded into a scratch slot (`box_get`, 4 ops)
+    before the first statement accessing it, reads take 2 ops (`load` & `extract`),
+    sets take 4 as for structs and the box is written back (`box_put`, 3 ops or a
+    `box_replace` of the whole box for `Box()`, 4 ops) before each exit (`return`,
+    `exit`, `jump`, `switch`, `router`) if fields are set. The box is loaded if that
+    costs fewer ops.
+
+    Boxes are accessed field-wise if anything else could observe the difference:
+    calls of funcs accessing boxes (they would read stale fields or have their sets
+    overwritten), other box accesses when either sets fields (the keys may be the
+    same), Teal, or declarations in nested statements (the key isn't known before
+    them). Boxes declared with `Box()` (no assertion) are only loaded if the first
+    statement accessing them does so unconditionally, so `box_get` can't fail where
+    the program wouldn't.
+    """
+
+    def __init__(self, compiler: "TealishCompiler") -> None:
+        self.compiler = compiler
+        self.declarations = {
+            id(n.var): n for n in compiler.nodes[0].find_child_nodes(BoxDeclaration)
+        }
+        self.func_accesses: Dict[int, bool] = {}
+
+    def is_box_access(self, node: BaseNode) -> bool:
+        from .stdlib import BoxFunction
+
+        if isinstance(node, (StructOrBoxField, StructOrBoxAssignment)):
+            return isinstance(node.object_type, BoxType)
+        elif isinstance(node, OpCall):
+            return node.name.startswith("box_")
+        return isinstance(
+            node,
+            (
+                BoxArrayAssignment,
+                BoxArrayField,
+                BoxChunksStatement,
+                BoxDeclaration,
+                BoxFunction,
+                Teal,
+            ),
+        )
+
+    def is_box_write(self, node: BaseNode) -> bool:
+        from .stdlib import BoxFunction
+
+        if isinstance(node, BoxDeclaration):
+            return "Create" in (node.method or "")
+        elif isinstance(node, OpCall):
+            return node.name in BOX_WRITE_OPS
+        elif isinstance(node, BoxFunction):
+            return node.writes_boxes
+        return isinstance(node, (BoxArrayAssignment, StructOrBoxAssignment, Teal))
+
+    def accesses_boxes(self, func: Func) -> bool:
+        """Returns True if func (or a func it calls) accesses boxes."""
+        if id(func) not in self.func_accesses:
+            # recursive calls are assumed to access boxes
+            self.func_accesses[id(func)] = True
+            self.func_accesses[id(func)] = any(
+                self.is_box_access(n)
+                or (isinstance(n, UserDefinedFuncCall) and self.accesses_boxes(n.func))
+                for n in iter_written_nodes(func)
+            )
+        return self.func_accesses[id(func)]
+
+    def get_reason(
+        self,
+        region: Node,
+        statements: List[Node],
+        nodes: List[BaseNode],
+        declaration: BoxDeclaration,
+    ) -> Optional[str]:
+        """Returns why the box must be accessed field-wise in the region."""
+        var = declaration.var
+        first = statements[0]
+        accesses = [n for n in nodes if self.is_box_access(n)]
+        others = [n for n in accesses if getattr(n, "var", None) is not var]
+        if declaration.box_size > MAX_BYTES:
+            return f"it is larger than {MAX_BYTES} bytes"
+        if any(isinstance(n, Teal) for n in nodes):
+            return "Teal is used"
+        if declaration in nodes and declaration.parent is not region:
+            return "it is declared in a nested statement"
+        for call in nodes:
+            if isinstance(call, UserDefinedFuncCall) and self.accesses_boxes(call.func):
+                return f"{call.name}() accesses boxes"
+        if others and any(self.is_box_write(n) for n in accesses):
+            return "other boxes are used"
+        if not declaration.method:
+            if isinstance(first, StructOrBoxAssignment) and first.var is var:
+                return None
+            for expression in get_header_expressions(first):
+                for n in iter_written_nodes(expression):
+                    if isinstance(n, StructOrBoxField) and n.var is var:
+                        return None
+            return f"it may not exist at line {first.line_no}"
+        return None
+
+    def optimize_box(
+        self, region: Node, statements: List[Node], declaration: BoxDeclaration
+    ) -> None:
+        var = declaration.var
+        name = declaration.name.value
+        # from the first statement accessing the box
+        while not any(
+            isinstance(n, (StructOrBoxField, StructOrBoxAssignment)) and n.var is var
+            for n in iter_written_nodes(statements[0])
+        ):
+            statements = statements[1:]
+        first = statements[0]
+        nodes = [
+            n for s in get_region_statements(region) for n in iter_written_nodes(s)
+        ]
+        reason = self.get_reason(region, statements, nodes, declaration)
+        if reason:
+            self.compiler.report(
+                "boxes", f"line {first.line_no}: box {name} kept field-wise, {reason}"
+            )
+            return
+        nodes = [n for s in statements for n in iter_written_nodes(s)]
+        reads = [n for n in nodes if isinstance(n, StructOrBoxField) and n.var is var]
+        writes = [
+            n for n in nodes if isinstance(n, StructOrBoxAssignment) and n.var is var
+        ]
+        exits = []
+        if writes:
+            exits = [
+                n for n in nodes if isinstance(n, (Exit, Jump, Return, Router, Switch))
+            ]
+        # the end of a block or program without an exit statement
+        last = statements[-1]
+        falls_through = bool(writes) and not isinstance(
+            last, (Exit, Jump, Return, Router, Switch)
+        )
+        write_back = 3 if declaration.method else 4
+        saving = 2 * len(reads) - 4 - write_back * (len(exits) + falls_through)
+        accesses = f"read {len(reads)} times & set {len(writes)} times"
+        if saving <= 0:
+            self.compiler.report(
+                "boxes",
+                f"line {first.line_no}: box {name} {accesses} kept field-wise,"
+                + f" loading it costs {-saving} more ops",
+            )
+            return
+        slot = self.compiler.max_slot + 1
+        if slot > 255:
+            self.compiler.report("boxes", f"box {name}: no scratch slot to load it")
+            return
+        self.compiler.max_slot = slot
+        for node in reads + writes:
+            node.cache_slot = slot
+        BoxCache(first, declaration, slot, load=True).insert_before(first)
+        for node in exits:
+            BoxCache(node, declaration, slot, load=False).insert_before(node)
+        if falls_through:
+            BoxCache(last, declaration, slot, load=False).append()
+        self.compiler.report(
+            "boxes",
+            f"line {first.line_no}: box {name} {accesses} loaded into slot {slot},"
+            + f" saving {saving} ops",
+        )
+
+    def run(self) -> None:
+        for region in get_regions(self.compiler):
+            statements = get_region_statements(region)
+            boxes = []
+            for statement in statements:
+                for n in iter_written_nodes(statement):
+                    if isinstance(n, (StructOrBoxField, StructOrBoxAssignment)):
+                        declaration = self.declarations.get(id(n.var))
+                        if declaration and declaration not in boxes:
+                            boxes.append(declaration)
+            for declaration in boxes:
+                self.optimize_box(region, statements, declaration)
+
+
+def coalesce_box_accesses(compiler: "TealishCompiler") -> None:
+    BoxCoalescer(compiler).run()
+
+
+def replace_node(node: BaseNode, old: BaseNode, new: BaseNode) -> None:
+    """Replaces references to `old` in node & its expressions (e.g. args of calls & wrappers)."""
+    seen = {id(new)}
+
+    def visit(obj: BaseNode) -> None:
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        for key, value in vars(obj).items():
+            if key == "parent":
+                continue
+            if value is old:
+                setattr(obj, key, new)
+            elif isinstance(value, list):
+                for i, item in enumerate(value):
+                    if item is old:
+                        value[i] = new
+                    elif is_expression(item):
+                        visit(item)
+            elif is_expression(value):
+                visit(value)
+
+    visit(node)
+
+
+def is_expression(obj: object) -> bool:
+    return isinstance(obj, BaseNode) and not isinstance(obj, Node)
+
+
+class LoopOptimizer:
+    """
+    Rotates loops & hoists loop invariant expressions out of them.
+
+    A rotated loop tests its condition at the end of the body (after an initial test
+    before the loop) so each iteration takes one branch instead of two.
+
+    An expression is invariant if it reads no variable assigned in the loop and its
+    ops are pure (from their langspec groups) or only read state (app state, boxes,
+    inner transactions) that nothing in the loop changes. Hoisted expressions are
+    evaluated once into a scratch slot and loaded in the loop. Single op
+    expressions (e.g. `Txn.NumAppArgs`) are not hoisted as a load costs the same.
+
+    Expressions of a while condition are evaluated before the loop. Expressions of
+    the body are evaluated after the first condition test, and only from statements
+    executed in every iteration before anything that can leave the loop (break,
+    exit, jump, return, function calls), so a hoisted expression that fails would
+    have failed in the first iteration.
+    """
+
+    def __init__(self, compiler: "TealishCompiler") -> None:
+        self.compiler = compiler
+
+    def get_effects(self, loop: LoopStatement) -> Tuple[Set[int], bool]:
+        """Returns the scratch slots written in the loop & whether it changes state."""
+        from .stdlib import BoxFunction
+
+        slots: Set[int] = set()
+        writes_state = False
+        for node in iter_nodes(loop):
+            if isinstance(node, Teal):
+                return set(ALL_SLOTS), True
+            elif isinstance(
+                node,
+                (VarDeclaration, ForStatement, BoxDeclaration, BoxMapDeclaration),
+            ):
+                slots.add(node.var.scratch_slot)
+                if isinstance(node, BoxDeclaration) and "Create" in (node.method or ""):
+                    writes_state = True
+            elif isinstance(node, Assignment):
+                slots.update(var.scratch_slot for var in node.vars)
+            elif isinstance(node, BoxChunksStatement):
+                slots.update([node.offset_var.scratch_slot, node.var.scratch_slot])
+            elif isinstance(node, StructOrBoxAssignment):
+                slots.add(node.var.scratch_slot)
+                if isinstance(node.object_type, BoxType):
+                    writes_state = True
+            elif isinstance(node, (BoxArrayAssignment, StateAssignment)):
+                writes_state = True
+            elif isinstance(node, StdLibFunctionCall):
+                func_call = node.func_call
+                if isinstance(func_call, BoxFunction) and func_call.writes_boxes:
+                    writes_state = True
+            elif isinstance(node, (InnerTxn, InnerGroup)):
+                writes_state = True
+            elif isinstance(node, FunctionCall):
+                func_call = node.func_call
+                if isinstance(func_call, UserDefinedFuncCall):
+                    writes_state = True
+                elif isinstance(func_call, OpCall):
+                    if func_call.name in scratch_ops:
+                        return set(ALL_SLOTS), True
+                    writes_state = writes_state or func_call.op.writes_state
+        return slots, writes_state
+
+    def is_invariant(self, node: BaseNode, slots: Set[int], writes_state: bool) -> bool:
+        def invariant(n: BaseNode) -> bool:
+            return self.is_invariant(n, slots, writes_state)
+
+        if isinstance(
+            node,
+            (
+                Integer,
+                Bytes,
+                Constant,
+                Enum,
+                PositiveGroupIndex,
+                NegativeGroupIndex,
+                ScratchValue,
+            ),
+        ):
+            return True
+        elif isinstance(node, Variable):
+            # names of types (e.g. in Cast) are parsed as variables
+            var = getattr(node, "var", None)
+            return var is None or var.scratch_slot not in slots
+        elif isinstance(node, (UnaryOp, BinaryOp, Group)):
+            return all(invariant(n) for n in node.nodes)
+        elif isinstance(node, FieldRead):
+            return not node.is_volatile() and all(
+                invariant(n) for n in node.get_indexes()
+            )
+        elif isinstance(node, InnerTxnField):
+            return not writes_state
+        elif isinstance(node, StateRead):
+            return not writes_state and all(invariant(n) for n in node.get_indexes())
+        elif isinstance(node, StructOrBoxField):
+            if node.var.scratch_slot in slots:
+                return False
+            return isinstance(node.object_type, StructType) or not writes_state
+        elif isinstance(node, (FunctionCall, StdLibFunctionCall)):
+            func_call = node.func_call
+            if isinstance(func_call, UserDefinedFuncCall):
+                return False
+            elif isinstance(func_call, OpCall):
+                op = func_call.op
+                reads_unchanged_state = (
+                    op.reads_state
+                    and not op.writes_state
+                    and not writes_state
+                    and op.name not in scratch_ops
+                )
+                if not (op.is_pure or reads_unchanged_state):
+                    return False
+                # e.g. global OpcodeBudget
+                if "OpcodeBudget" in func_call.immediate_args:
+                    return False
+            elif not func_call.is_pure:
+                return False
+            return all(invariant(n) for n in node.nodes)
+        return False
+
+    def may_leave(self, node: BaseNode) -> bool:
+        """Returns True if the loop can be left (or the program can exit) from node."""
+        for n in iter_nodes(node):
+            if isinstance(n, (Break, Exit, Jump, Return, Switch, Teal)):
+                return True
+            if isinstance(n, FunctionCall) and isinstance(
+                n.func_call, UserDefinedFuncCall
+            ):
+                return True
+        return False
+
+    def find_invariants(
+        self, node: BaseNode, slots: Set[int], writes_state: bool
+    ) -> Iterator[BaseNode]:
+        """Yields the largest invariant expressions of node worth hoisting."""
+        if self.is_invariant(node, slots, writes_state):
+            if (
+                not isinstance(node.type, list)
+                and node.type is not None
+                and count_teal_ops(node) > 1
+            ):
+                yield node
+            return
+        for child in getattr(node, "nodes", []):
+            if is_expression(child):
+                yield from self.find_invariants(child, slots, writes_state)
+
+    def replace(
+        self,
+        roots: List[BaseNode],
+        key: str,
+        slot: int,
+        slots: Set[int],
+        writes_state: bool,
+    ) -> None:
+        """Replaces invariant occurrences of the expression key under roots with loads."""
+        for root in roots:
+            for owner in list(iter_nodes(root)):
+                for node in list(getattr(owner, "nodes", [])):
+                    if (
+                        is_expression(node)
+                        and not isinstance(node, ScratchValue)
+                        and node.tealish() == key
+                        and self.is_invariant(node, slots, writes_state)
+                    ):
+                        replace_node(owner, node, ScratchValue(node, slot, owner))
+
+    def hoist(
+        self,
+        loop: LoopStatement,
+        candidates: List[BaseNode],
+        roots: List[BaseNode],
+        slots: Set[int],
+        writes_state: bool,
+    ) -> List[Tuple[BaseNode, int]]:
+        hoisted = []
+        for expression in candidates:
+            key = expression.tealish()
+            if any(e.tealish() == key for e, _ in hoisted):
+                continue
+            slot = self.compiler.max_slot + 1
+            if slot > 255:
+                self.compiler.report("loops", f"{key}: no scratch slot to hoist it")
+                break
+            self.compiler.max_slot = slot
+            hoisted.append((expression, slot))
+            self.replace(roots, key, slot, slots, writes_state)
+            self.compiler.report(
+                "loops",
+                f"line {loop.line_no}: {key} hoisted out of the loop into slot {slot}",
+            )
+        return hoisted
+
+    def optimize_loop(self, loop: LoopStatement) -> None:
+        # unrolled loops have no condition to rotate
+        loop.rotate = loop.rotatable and not loop.unroll
+        slots, writes_state = self.get_effects(loop)
+        body = get_region_statements(loop)
+        if isinstance(loop, WhileStatement) and not self.may_leave(loop.condition):
+            candidates = list(self.find_invariants(loop.condition, slots, writes_state))
+            loop.hoisted_condition = self.hoist(
+                loop, candidates, [loop.condition] + body, slots, writes_state
+            )
+        candidates = []
+        for statement in body:
+            if self.may_leave(statement):
+                break
+            for expression in get_header_expressions(statement):
+                candidates += self.find_invariants(expression, slots, writes_state)
+        loop.hoisted = self.hoist(loop, candidates, body, slots, writes_state)
+
+    def run(self) -> None:
+        loops = self.compiler.nodes[0].find_child_nodes(LoopStatement)
+        # outer loops first, so invariants of nested loops are hoisted as far as possible
+        for loop in loops:
+            self.optimize_loop(loop)
+        rotated = [loop for loop in loops if loop.rotate]
+        if rotated:
+            self.compiler.report("loops", f"{len(rotated)} loops rotated")
+
+
+def optimize_loops(compiler: "TealishCompiler") -> None:
+    LoopOptimizer(compiler).run()
+
+
+def write_loop_body(loop: LoopStatement) -> List[str]:
+    """Returns the Teal of one copy of a loop body."""
+    from . import TealWriter
+
+    writer = TealWriter()
+    # inner transactions reset this when written
+    use_inner_txns_macro = loop.compiler.use_inner_txns_macro
+    for n in loop.child_nodes:
+        n.write_teal(writer)
+    loop.compiler.use_inner_txns_macro = use_inner_txns_macro
+    return writer.output
+
+
+class LoopUnroller:
+    """
+    Unrolls for loops with constant bounds.
+
+    A fully unrolled loop writes the body once per iteration, setting the loop
+    variable with `pushint; store` (only if the body reads it) instead of updating,
+    testing & branching on the counter (9 ops per iteration). Loops are unrolled
+    fully when the unrolled body has at most `unroll_limit` ops, otherwise by the
+    largest factor within the limit with the remaining iterations peeled off
+    before the loop.
+
+    `@unroll()` unrolls a loop fully regardless of its size, `@unroll(factor=N)` by N.
+    """
+
+    def __init__(self, compiler: "TealishCompiler") -> None:
+        self.compiler = compiler
+
+    def get_factor(
+        self, loop: LoopStatement, iterations: int, body_ops: int
+    ) -> Optional[int]:
+        hint = loop.attributes.get("unroll")
+        if hint is not None:
+            if "factor" not in hint:
+                return iterations
+            try:
+                factor = int(hint["factor"])
+            except ValueError:
+                factor = 0
+            if factor < 1:
+                raise CompileError(
+                    f'Invalid unroll factor "{hint["factor"]}"', node=loop
+                )
+            return min(factor, iterations)
+        if iterations * body_ops <= self.compiler.unroll_limit:
+            return iterations
+        for factor in UNROLL_FACTORS:
+            if factor < iterations and factor * body_ops <= self.compiler.unroll_limit:
+                return factor
+        return None
+
+    def unroll(self, loop: LoopStatement) -> Optional[str]:
+        """Sets the unroll factor of the loop & returns a report message."""
+        loop_range = loop.get_range()
+        if loop_range is None:
+            return None
+        start, end = loop_range
+        iterations = end - start
+        if iterations <= 0:
+            return None
+        ops = [op for teal in write_loop_body(loop) for op in get_ops(teal)]
+        if isinstance(loop, ForStatement):
+            slot = loop.var.scratch_slot
+            if f"store {slot}" in ops:
+                return f"line {loop.line_no}: not unrolled, {loop.var_name} is assigned in the loop"
+            loop.unroll_counter = f"load {slot}" in ops
+        factor = self.get_factor(loop, iterations, len(ops))
+        if factor is None:
+            return (
+                f"line {loop.line_no}: not unrolled, {iterations} iterations of"
+                + f" {len(ops)} ops exceed the limit"
+            )
+        elif factor == iterations:
+            loop.unroll = factor
+            return f"line {loop.line_no}: unrolled {iterations} iterations"
+        elif factor > 1:
+            loop.unroll = factor
+            return f"line {loop.line_no}: unrolled by {factor}"
+        return None
+
+    def run(self) -> None:
+        loops = self.compiler.nodes[0].find_child_nodes(LoopStatement)
+        # nested loops first, so the size of outer loops includes them unrolled
+        messages = {loop: self.unroll(loop) for loop in reversed(loops)}
+        for loop in loops:
+            if messages[loop]:
+                self.compiler.report("unroll", messages[loop])
+
+
+def unroll_loops(compiler: "TealishCompiler") -> None:
+    LoopUnroller(compiler).run()
+
+
+def replace_ops(teal: str, ops: str) -> str:
+    """Replaces the ops of a line of Teal (keeping its indentation, label & comment)."""
+    indent = teal[: len(teal) - len(teal.lstrip())]
+    code, comment = split_comment(teal)
+    label, _ = split_label(code)
+    teal = indent + (f"{label}: {ops}" if label is not None else ops)
+    return f"{teal} {comment}" if comment else teal
+
+
+class Inliner:
+    """
+    Replaces `callsub` of small funcs (or funcs decorated with `@inline()`) with their body.
+
+    Func args are passed on the stack & stored by the func body so inlining the
+    body after the evaluated args keeps the evaluation order. Scratch slots of funcs
+    are unique so the inlined body can use them as is. Labels are renamed per copy
+    and each `retsub` becomes a branch to the end of the copy.
+    Recursive & unused funcs are never inlined (dce removes unused funcs).
+    With profile data the threshold is raised for hot funcs (see `get_threshold`).
+    """
+
+    def __init__(self, compiler: "TealishCompiler", lines: List[Line]) -> None:
+        self.compiler = compiler
+        self.lines = lines
+        self.copies = 0
+        self.funcs: Dict[str, Func] = {}
+        self.bodies: Dict[str, List[Line]] = {}
+        self.indents: Dict[str, int] = {}
+        # func label of each line of an out of line func
+        self.owners: List[Optional[str]] = [None] * len(lines)
+        for func in compiler.nodes[0].find_child_nodes(Func):
+            if getattr(func, "teal_range", None) is None:
+                continue
+            start, end = func.teal_range
+            self.funcs[func.label] = func
+            # skip the func comment & label
+            self.bodies[func.label] = lines[start + 2 : end]
+            label_line = lines[start + 1][0]
+            self.indents[func.label] = len(label_line) - len(label_line.lstrip()) + 4
+            for i in range(start, end):
+                self.owners[i] = func.label
+
+    def get_callees(self, label: str) -> Set[str]:
+        callees = set()
+        for teal, _ in self.bodies[label]:
+            for op in get_ops(teal):
+                if op.startswith("callsub "):
+                    callees.add(op.split()[1])
+        return callees
+
+    def is_recursive(self, label: str) -> bool:
+        seen: Set[str] = set()
+        stack = list(self.get_callees(label))
+        while stack:
+            callee = stack.pop()
+            if callee == label:
+                return True
+            if callee in seen or callee not in self.bodies:
+                continue
+            seen.add(callee)
+            stack += self.get_callees(callee)
+        return False
+
+    def count_calls(self, label: str) -> int:
+        call = f"callsub {label}"
+        return sum(get_ops(teal).count(call) for teal, _ in self.lines if call in teal)
+
+    def get_threshold(self, func: Func) -> int:
+        """Returns the inline threshold of a func, scaled by its profiled calls if any."""
+        threshold = self.compiler.inline_threshold
+        counts = self.compiler.call_counts
+        if not any(counts.values()):
+            return threshold
+        calls = counts.get(func.name, 0)
+        if not calls:
+            return 0
+        if calls * HOT_CALLS_RATIO >= max(counts.values()):
+            return threshold * HOT_INLINE_FACTOR
+        return threshold
+
+    def get_inlinable(self) -> Set[str]:
+        inlinable = set()
+        for label, func in self.funcs.items():
+            calls = self.count_calls(label)
+            # funcs without calls are unused, not inlined (removed by dce)
+            if not calls or self.is_recursive(label):
+                continue
+            if "inline" in func.attributes:
+                inlinable.add(label)
+            elif count_ops(self.bodies[label]) - 1 <= self.get_threshold(func):
+                # (not counting the retsub)
+                inlinable.add(label)
+            elif calls == 1:
+                # a single call site: inlining doesn't increase the program size
+                inlinable.add(label)
+        return inlinable
+
+    def expand(self, lines: List[Line], inlinable: Set[str]) -> List[List[Line]]:
+        """Returns the expansion of each line."""
+        output: List[List[Line]] = []
+        for teal, line_no in lines:
+            ops = get_ops(teal)
+            if len(ops) == 1 and ops[0].startswith("callsub "):
+                label = ops[0].split()[1]
+                if label in inlinable:
+                    indent = teal[: len(teal) - len(teal.lstrip())]
+                    output.append(self.inline(label, indent, inlinable))
+                    continue
+            output.append([(teal, line_no)])
+        return output
+
+    def inline(self, label: str, indent: str, inlinable: Set[str]) -> List[Line]:
+        self.copies += 1
+        func = self.funcs[label]
+        body = [
+            line
+            for lines in self.expand(self.bodies[label], inlinable)
+            for line in lines
+        ]
+        return_label = f"{label}__return"
+        # drop the trailing retsub, others branch to the end of the copy
+        last = max(i for i, (teal, _) in enumerate(body) if get_ops(teal))
+        if get_ops(body[last][0]) == ["retsub"]:
+            body = body[:last] + body[last + 1 :]
+        body = [
+            (replace_ops(teal, f"b {return_label}"), line_no)
+            if get_ops(teal) == ["retsub"]
+            else (teal, line_no)
+            for teal, line_no in body
+        ]
+        if any(return_label in get_branch_targets(teal) for teal, _ in body):
+            body.append((" " * self.indents[label] + f"{return_label}:", func.line_no))
+        renames = {}
+        for teal, _ in body:
+            body_label = get_label(teal)
+            if body_label is not None:
+                renames[body_label] = f"{body_label}_i{self.copies}"
+        output = [(f"{indent}// inline: {func.name}", func.line_no)]
+        for teal, line_no in body:
+            teal = rename_labels(teal, renames)
+            stripped = teal.lstrip()
+            extra = len(teal) - len(stripped) - self.indents[label]
+            output.append((indent + " " * max(extra, 0) + stripped, line_no))
+        return output
+
+    def run(self) -> List[Line]:
+        inlinable = self.get_inlinable()
+        if not inlinable:
+            return self.lines
+        # out of line copies are expanded too as they are kept if any calls remain
+        expanded = self.expand(self.lines, inlinable)
+
+        dropped = set(inlinable)
+        while True:
+            called = set()
+            for owner, lines in zip(self.owners, expanded):
+                if owner not in dropped:
+                    for teal, _ in lines:
+                        called.update(
+                            op.split()[1]
+                            for op in get_ops(teal)
+                            if op.startswith("callsub ")
+                        )
+            if not dropped & called:
+                break
+            dropped -= called
+        for label in sorted(inlinable, key=lambda x: self.funcs[x].line_no):
+            name = self.funcs[label].name
+            message = f"func {name}: inlined"
+            if self.compiler.call_counts.get(name):
+                message += f" ({self.compiler.call_counts[name]} profiled calls)"
+            if label in dropped:
+                message += ", out of line copy removed"
+            self.compiler.report("inline", message)
+        return [
+            line
+            for owner, lines in zip(self.owners, expanded)
+            if owner not in dropped
+            for line in lines
+        ]
+
+
+def inline_functions(compiler: "TealishCompiler", lines: List[Line]) -> List[Line]:
+    return Inliner(compiler, lines).run()
+
+
+def find_reachable(lines: List[Line]) -> List[bool]:
+    """Returns whether each line can be executed, following branches & calls from the first line."""
+    cfg = CFG(lines)
+    reached = [False] * len(lines)
+    for index in cfg.reachable():
+        block = cfg.blocks[index]
+        for i in range(block.start, block.end):
+            reached[i] = True
+    return reached
+
+
+def eliminate_dead_code(compiler: "TealishCompiler", lines: List[Line]) -> List[Line]:
+    """Removes unreachable code: unused funcs & blocks and code after exits, jumps & errors."""
+    names = {}
+    for node in compiler.nodes[0].find_child_nodes(Func):
+        names[node.label] = f"func {node.name}"
+    for node in compiler.nodes[0].find_child_nodes(Block):
+        names[node.label] = f"block {node.name}"
+
+    reached = find_reachable(lines)
+    output: List[Line] = []
+    removed_ops = 0
+    run: List[Line] = []
+    for i, line in enumerate(lines):
+        if reached[i]:
+            output.append(line)
+            if is_code(line[0]) and run:
+                report_dead_code(compiler, run, names)
+                run = []
+        elif is_code(line[0]):
+            removed_ops += len(get_ops(line[0]))
+            run.append(line)
+    if run:
+        report_dead_code(compiler, run, names)
+    if removed_ops:
+        compiler.report("dce", f"{removed_ops} ops removed")
+    return output
+
+
+def report_dead_code(
+    compiler: "TealishCompiler", run: List[Line], names: Dict[str, str]
+) -> None:
+    if get_label(run[0][0]) not in names:
+        compiler.report("dce", f"line {run[0][1]}: unreachable code removed")
+    for teal, _ in run:
+        label = get_label(teal)
+        if label in names:
+            compiler.report("dce", f"{names[label]} removed (unreachable)")
+
+
+# Labels of the branches of statements (e.g. `l0_end`, `l3_else_i1` once inlined) & of
+# the ends of inlined funcs. Func & block labels are left to dce.
+BRANCH_LABEL_RE = re.compile(r"^(l\d+_\w+|__func__\w+__return_i\d+)$")
+
+
+class JumpThreader:
+    """
+    Simplifies the branches of the output:
+        - branches to a label followed by `b X` (or to a run of labels) are retargeted to X
+        - `b X` directly before the label X is removed
+        - `bz L1; b L2; L1:` becomes `bnz L2; L1:` (and vice versa)
+        - branch labels no longer referenced are removed (func & block labels are kept)
+
+    Only branches & labels are changed or removed so the source map of all other lines is kept.
+    """
+
+    def __init__(self, compiler: "TealishCompiler", lines: List[Line]) -> None:
+        self.compiler = compiler
+        self.lines = lines
+        self.counts = {"threaded": 0, "removed": 0, "inverted": 0, "labels": 0}
+
+    def next_code(self, i: int) -> int:
+        """Returns the index of the first line of code at or after i."""
+        while i < len(self.lines) and not is_code(self.lines[i][0]):
+            i += 1
+        return i
+
+    def get_ops_at(self, i: int) -> List[str]:
+        return get_ops(self.lines[i][0]) if i < len(self.lines) else []
+
+    def following_labels(self, i: int) -> List[str]:
+        """Returns the run of labels (without ops) starting at the first line of code at or after i."""
+        labels = []
+        i = self.next_code(i)
+        while i < len(self.lines):
+            label = get_label(self.lines[i][0])
+            if label is None:
+                break
+            labels.append(label)
+            if self.get_ops_at(i):
+                break
+            i = self.next_code(i + 1)
+        return labels
+
+    def resolve(self, label: str, labels: Dict[str, int]) -> str:
+        """Returns the final target of a branch to label."""
+        seen = {label}
+        while True:
+            # the last label of a run of labels is used for all of them
+            label = self.following_labels(labels[label])[-1]
+            ops = self.get_ops_at(labels[label])
+            if not ops:
+                ops = self.get_ops_at(self.next_code(labels[label] + 1))
+            target = (
+                ops[0].split()[1] if len(ops) == 1 and ops[0].startswith("b ") else None
+            )
+            if target is None or target in seen or target not in labels:
+                return label
+            seen.add(target)
+            label = target
+
+    def thread(self) -> bool:
+        labels = get_label_lines(self.lines)
+        changed = False
+        for i, (teal, line_no) in enumerate(self.lines):
+            renames = {}
+            for op in get_ops(teal):
+                opcode, *args = op.split()
+                if opcode in BRANCH_OPS and opcode != "callsub":
+                    for target in args:
+                        if target in labels and self.resolve(target, labels) != target:
+                            renames[target] = self.resolve(target, labels)
+            if renames:
+                self.lines[i] = (rename_labels(teal, renames), line_no)
+                self.counts["threaded"] += len(renames)
+                changed = True
+        return changed
+
+    def simplify(self) -> bool:
+        output: List[Line] = []
+        changed = False
+        i = 0
+        while i < len(self.lines):
+            teal, line_no = self.lines[i]
+            ops = get_ops(teal)
+            if len(ops) == 1 and get_label(teal) is None:
+                opcode, *args = ops[0].split()
+                if opcode == "b" and args[0] in self.following_labels(i + 1):
+                    self.counts["removed"] += 1
+                    changed = True
+                    i += 1
+                    continue
+                if opcode in ("bz", "bnz"):
+                    j = self.next_code(i + 1)
+                    next_ops = self.get_ops_at(j)
+                    if (
+                        len(next_ops) == 1
+                        and next_ops[0].split()[0] == "b"
+                        and get_label(self.lines[j][0]) is None
+                        and args[0] in self.following_labels(j + 1)
+                    ):
+                        inverse = "bnz" if opcode == "bz" else "bz"
+                        target = next_ops[0].split()[1]
+                        indent = teal[: len(teal) - len(teal.lstrip())]
+                        output.append((f"{indent}{inverse} {target}", line_no))
+                        output += self.lines[i + 1 : j]
+                        self.counts["inverted"] += 1
+                        changed = True
+                        i = j + 1
+                        continue
+            output.append((teal, line_no))
+            i += 1
+        self.lines = output
+        return changed
+
+    def remove_labels(self) -> bool:
+        referenced = set()
+        for teal, _ in self.lines:
+            referenced.update(get_branch_targets(teal))
+        output = []
+        for teal, line_no in self.lines:
+            label = get_label(teal)
+            if (
+                label is not None
+                and BRANCH_LABEL_RE.match(label)
+                and label not in referenced
+                and not get_ops(teal)
+            ):
+                self.counts["labels"] += 1
+                continue
+            output.append((teal, line_no))
+        changed = len(output) != len(self.lines)
+        self.lines = output
+        return changed
+
+    def run(self) -> List[Line]:
+        # each step can enable the others
+        while any([self.thread(), self.simplify(), self.remove_labels()]):
+            pass
+        messages = {
+            "threaded": "branches threaded to their final target",
+            "removed": "branches to the next op removed",
+            "inverted": "conditional branches inverted to remove a b",
+            "labels": "unused labels removed",
+        }
+        for key, message in messages.items():
+            if self.counts[key]:
+                self.compiler.report("jumps", f"{self.counts[key]} {message}")
+        return self.lines
+
+
+def thread_jumps(compiler: "TealishCompiler", lines: List[Line]) -> List[Line]:
+    return JumpThreader(compiler, list(lines)).run()
+
+
+# Ops that push one constant
+PUSH_OPS = {"int", "byte", "addr", "method", "pushint", "pushbytes"}
+# Ops using the stack in ways the stack pass doesn't follow
+FRAME_OPS = {"proto", "frame_dig", "frame_bury"}
+
+
+def get_stack_effect(op: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns (reach, delta) of an op: how many items below the top it uses & the change
+    of the stack height. None for ops with effects beyond the current block.
+    """
+    opcode, *args = op.split()
+    if opcode in PUSH_OPS:
+        return 0, 1
+    if opcode in ("pushints", "pushbytess"):
+        return 0, len(args)
+    if opcode in BRANCH_OPS or opcode in TERMINATOR_OPS or opcode in FRAME_OPS:
+        return None
+    if opcode in ("dig", "cover", "uncover", "bury", "popn", "dupn"):
+        n = int(args[0])
+        effects = {
+            "dig": (n + 1, 1),
+            "cover": (n + 1, 0),
+            "uncover": (n + 1, 0),
+            "bury": (n + 1, -1),
+            "popn": (n, -n),
+            "dupn": (1, n),
+        }
+        return effects[opcode]
+    try:
+        spec = get_active_langspec().lookup_op(opcode)
+    except KeyError:
+        return None
+    return len(spec.args), len(spec.returns) - len(spec.args)
+
+
+class StackScheduler:
+    """
+    Keeps short lived values on the stack instead of a scratch slot round trip.
+
+    A `store S` followed in the same basic block by `load S`s is removed when S is dead
+    after the last load & the ops in between never reach below the stored value. The
+    value stays where it was stored: loads become `dup` or `dig n` and the last load
+    takes it with `swap` or `uncover n` (nothing if it is on top, or if the `swap`
+    would be undone by the next op). Each rewrite
+    saves at least one op. At most MAX_STACK_TEMPORARIES values are kept at any op.
+    """
+
+    def __init__(self, compiler: "TealishCompiler", lines: List[Line]) -> None:
+        self.compiler = compiler
+        self.lines = lines
+
+    def get_live_after(self, ops: List[List], live_out: Set[int]) -> List[Set[int]]:
+        live = set(live_out)
+        live_after: List[Set[int]] = [set()] * len(ops)
+        for k in range(len(ops) - 1, -1, -1):
+            live_after[k] = set(live)
+            live = self.liveness.transfer_op(ops[k][1], live)
+        return live_after
+
+    def find_uses(self, ops: List[List], k: int, slot: int) -> List[Tuple[int, int]]:
+        """Returns (index, items above the stored value) of the loads following ops[k]."""
+        uses = []
+        height = 0
+        for m in range(k + 1, len(ops)):
+            op = ops[m][1]
+            kind, op_slot = get_slot_op(op)
+            if op_slot == slot:
+                if kind == "store":
+                    break
+                uses.append((m, height))
+                height += 1
+                continue
+            effect = None if clobbers_scratch(op) else get_stack_effect(op)
+            if effect is None or effect[0] > height:
+                break
+            height += effect[1]
+        return uses
+
+    def schedule(self, ops: List[List], live_out: Set[int]) -> bool:
+        """Keeps the first possible value of a block on the stack. Returns whether one was."""
+        live_after = self.get_live_after(ops, live_out)
+        for k, (line_index, op, _) in enumerate(ops):
+            kind, slot = get_slot_op(op)
+            if kind != "store":
+                continue
+            uses = self.find_uses(ops, k, slot)
+            if not uses:
+                continue
+            last, height = uses[-1]
+            if (
+                slot in live_after[last]
+                or height > MAX_STACK_DEPTH
+                or any(ops[m][2] >= MAX_STACK_TEMPORARIES for m in range(k + 1, last))
+            ):
+                continue
+            for m, h in uses[:-1]:
+                ops[m][1] = "dup" if h == 0 else f"dig {h}"
+            for m in range(k + 1, last):
+                ops[m][2] += 1
+            # the value is on top or under a copy of itself pushed by the previous load
+            removed = height == 0 or (height == 1 and uses[-2:-1] == [(last - 1, 0)])
+            saved = 2 if removed else 1
+            if removed:
+                del ops[last]
+            elif height == 1 and last + 1 < len(ops) and ops[last + 1][1] == "swap":
+                del ops[last : last + 2]
+                saved = 3
+            else:
+                ops[last][1] = "swap" if height == 1 else f"uncover {height}"
+            del ops[k]
+            line_no = self.lines[line_index][1]
+            self.compiler.report(
+                "stack",
+                f"line {line_no}: slot {slot} kept on the stack ({len(uses)} loads), "
+                f"saving {saved} ops",
+            )
+            return True
+        return False
+
+    def run(self) -> List[Line]:
+        cfg = CFG(self.lines)
+        self.liveness = Liveness(cfg)
+        _, live_out = solve(cfg, self.liveness)
+        line_ops: Dict[int, List[str]] = {}
+        for block in cfg.blocks:
+            # [line index, op, number of values kept on the stack across the op]
+            ops = [[i, op, 0] for i, op in block.ops]
+            while self.schedule(ops, set(live_out[block.index])):
+                pass
+            # lines can be split between blocks
+            for i, _ in block.ops:
+                line_ops.setdefault(i, [])
+            for i, op, _ in ops:
+                line_ops[i].append(op)
+
+        output: List[Line] = []
+        for i, (teal, line_no) in enumerate(self.lines):
+            if i not in line_ops or line_ops[i] == get_ops(teal):
+                output.append((teal, line_no))
+                continue
+            indent = teal[: len(teal) - len(teal.lstrip())]
+            code, comment = split_comment(teal)
+            label, _ = split_label(code)
+            if not line_ops[i] and label is None:
+                continue
+            teal = indent + "; ".join(line_ops[i])
+            if label is not None:
+                teal = f"{indent}{label}: " + "; ".join(line_ops[i])
+            if comment:
+                teal = teal.rstrip().ljust(60) + comment
+            output.append((teal.rstrip(), line_no))
+        return output
+
+
+def schedule_stack(compiler: "TealishCompiler", lines: List[Line]) -> List[Line]:
+    return StackScheduler(compiler, lines).run()
+
+
+AST_PASSES: Dict[str, Callable[["TealishCompiler"], None]] = {
+    "asserts": remove_proven_assertions,
+    "unroll": unroll_loops,
+    "loops": optimize_loops,
+    "cse": eliminate_common_field_reads,
+    "fields": fuse_field_extracts,
+    "boxes": coalesce_box_accesses,
+    "state": cache_state_reads,
+}
+
+PASSES: Dict[str, Callable[["TealishCompiler", List[Line]], List[Line]]] = {
+    "inline": inline_functions,
+    "jumps": thread_jumps,
+    "dce": eliminate_dead_code,
+    "stack": schedule_stack,
+}
@@ -0,0 +1,223 @@
+import json
+from array import array
+from hashlib import sha1
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from .utils import TealishMap
+
+
+MAIN = "main"
+PGO_VERSION = 1
+
+
+def iter_trace_steps(obj: Any) -> Iterator[Tuple[int, int]]:
+    """Yields (pc, cost) pairs from a decoded trace object.
+
+    Supported shapes:
+        - a pc: `12`
+        - a step: `{"pc": 12, "cost": 1}` (cost defaults to 1)
+        - a list of any of the supported shapes
+        - an algod simulate response with exec traces enabled
+    """
+    if isinstance(obj, int):
+        yield obj, 1
+    elif isinstance(obj, list):
+        for item in obj:
+            yield from iter_trace_steps(item)
+    elif isinstance(obj, dict):
+        if "pc" in obj:
+            yield int(obj["pc"]), int(obj.get("cost", 1))
+        elif "txn-group-results" in obj:
+            for group in obj["txn-group-results"]:
+                for result in group.get("txn-results", []):
+                    exec_trace = result.get("exec-trace", {})
+                    yield from iter_trace_steps(
+                        exec_trace.get("approval-program-trace", [])
+                    )
+        elif "trace" in obj:
+            yield from iter_trace_steps(obj["trace"])
+
+
+def read_trace_file(f: IO) -> Iterator[Tuple[int, int]]:
+    """Streams (pc, cost) pairs from a JSON or NDJSON trace file.
+
+    NDJSON files are decoded one line at a time so arbitrarily large trace
+    dumps can be processed without loading them into memory.
+    """
+    first_line = f.readline()
+    try:
+        obj = json.loads(first_line)
+    except json.JSONDecodeError:
+        # Not NDJSON; the file is a single (pretty printed) JSON document
+        yield from iter_trace_steps(json.loads(first_line + f.read()))
+        return
+    yield from iter_trace_steps(obj)
+    for line in f:
+        if line.strip():
+            yield from iter_trace_steps(json.loads(line))
+
+
+class Profile:
+    """
+    Aggregates execution traces of a compiled program.
+
+    Hits and cost are accumulated per pc in flat arrays which are only mapped
+    back to Tealish lines (via the TealishMap) when a report is requested.
+    """
+
+    def __init__(
+        self,
+        tealish_map: TealishMap,
+        line_functions: Optional[Dict[int, str]] = None,
+    ) -> None:
+        self.map = tealish_map
+        self.line_functions = line_functions or {}
+        size = (max(tealish_map.pc_teal) + 1) if tealish_map.pc_teal else 0
+        self.pc_hits = array("Q", bytes(8 * size))
+        self.pc_cost = array("Q", bytes(8 * size))
+        self.steps = 0
+
+    def _grow(self, pc: int) -> None:
+        extra = pc + 1 - len(self.pc_hits)
+        self.pc_hits.extend(bytes(8 * extra))
+        self.pc_cost.extend(bytes(8 * extra))
+
+    def add_steps(self, steps: Iterable[Tuple[int, int]]) -> None:
+        pc_hits = self.pc_hits
+        pc_cost = self.pc_cost
+        n = len(pc_hits)
+        count = 0
+        for pc, cost in steps:
+            if pc >= n:
+                self._grow(pc)
+                n = len(pc_hits)
+            pc_hits[pc] += 1
+            pc_cost[pc] += cost
+            count += 1
+        self.steps += count
+
+    def add_trace(self, trace: Any) -> None:
+        self.add_steps(iter_trace_steps(trace))
+
+    def add_trace_file(self, f: IO) -> None:
+        self.add_steps(read_trace_file(f))
+
+    def line_totals(self) -> Dict[int, Tuple[int, int]]:
+        """Returns a map of `tealish line` => (hits, cost).
+
+        Hits of a line are the hits of its first executed pc so that lines
+        compiling to many ops are not over counted. Cost is the total.
+        """
+        hits: Dict[int, int] = {}
+        cost: Dict[int, int] = {}
+        pc_hits = self.pc_hits
+        pc_cost = self.pc_cost
+        for pc in range(len(pc_hits)):
+            if not pc_hits[pc]:
+                continue
+            line = self.map.get_tealish_line_for_pc(pc)
+            if line is None:
+                continue
+            if line not in hits:
+                hits[line] = pc_hits[pc]
+            cost[line] = cost.get(line, 0) + pc_cost[pc]
+        return {line: (hits[line], cost[line]) for line in sorted(hits)}
+
+    def function_totals(self) -> Dict[str, int]:
+        """Returns a map of `function name` => total cost."""
+        totals: Dict[str, int] = {}
+        for line, (_, cost) in self.line_totals().items():
+            name = self.line_functions.get(line, MAIN)
+            totals[name] = totals.get(name, 0) + cost
+        return dict(sorted(totals.items(), key=lambda x: -x[1]))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "steps": self.steps,
+            "lines": {
+                line: {"hits": hits, "cost": cost}
+                for line, (hits, cost) in self.line_totals().items()
+            },
+            "functions": self.function_totals(),
+        }
+
+    def pgo_dict(self, source: str) -> Dict[str, Any]:
+        """Returns line hits keyed by line fingerprint for profile guided builds."""
+        fingerprints = line_fingerprints(source)
+        return {
+            "version": PGO_VERSION,
+            "lines": {
+                fingerprints[line]: hits
+                for line, (hits, _) in self.line_totals().items()
+                if line in fingerprints
+            },
+        }
+
+    def annotate(self, source_lines: List[str]) -> List[str]:
+        """Returns the source listing prefixed with hits & cost per line."""
+        totals = self.line_totals()
+        output = [f"{'hits':>10} {'cost':>10}  {'line':>5}  source"]
+        for i, source_line in enumerate(source_lines):
+            line = i + 1
+            if line in totals:
+                hits, cost = totals[line]
+                prefix = f"{hits:>10} {cost:>10}"
+            else:
+                prefix = " " * 21
+            output.append(f"{prefix}  {line:>5}  {source_line}")
+        return output
+
+
+def get_line_functions(source: str) -> Dict[int, str]:
+    """Returns a map of `tealish line` => name of the enclosing func or block."""
+    from . import TealishCompiler
+    from .nodes import Block, Func
+
+    compiler = TealishCompiler(source.split("\n"))
+    compiler.parse()
+    line_functions = {}
+    for line, node in compiler.line_nodes.items():
+        if isinstance(node, (Func, Block)):
+            parent = node
+        else:
+            parent = node.find_parent(Func) or node.find_parent(Block)
+        if isinstance(parent, Func):
+            line_functions[line] = parent.name
+        elif isinstance(parent, Block):
+            line_functions[line] = f"block {parent.name}"
+    return line_functions
+
+
+def line_fingerprints(source: str) -> Dict[int, str]:
+    """Returns a map of `tealish line` => fingerprint.
+
+    A fingerprint identifies a line by its enclosing func/block, its
+    whitespace normalised text and its occurrence among identical lines in
+    that func/block. It is independent of the line number so a profile
+    survives edits elsewhere in the program.
+    """
+    line_functions = get_line_functions(source)
+    seen: Dict[str, int] = {}
+    fingerprints = {}
+    for i, text in enumerate(source.split("\n")):
+        line = i + 1
+        text = " ".join(text.split())
+        if not text or text.startswith("#"):
+            continue
+        key = f"{line_functions.get(line, MAIN)}:{text}"
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        fingerprints[line] = sha1(f"{key}:{n}".encode()).hexdigest()[:16]
+    return fingerprints
+
+
+def load_line_hits(pgo: Dict[str, Any], source: str) -> Dict[int, int]:
+    """Resolves a profile produced by `Profile.pgo_dict` to `tealish line` => hits."""
+    if pgo.get("version") != PGO_VERSION:
+        raise ValueError(f"Unsupported profile version {pgo.get('version')}")
+    hits = pgo["lines"]
+    return {
+        line: hits[fingerprint]
+        for line, fingerprint in line_fingerprints(source).items()
+        if fingerprint in hits
+    }
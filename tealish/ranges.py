@@ -0,0 +1,129 @@
+"""
+Sizes & value ranges of expressions, used to prove runtime type assertions.
+
+The type of an expression is a guarantee: sized values are checked where they are
+created (`Cast`, `Convert`, typed assignments) or have their size by construction
+(`bzero(32)`, `Rpad`, struct field extracts). Int expressions are also bounded by
+their operations, e.g. `x % 256` is at most 255 & `a == b` at most 1.
+
+Example:
+    get_size(node)  # 32 for a bytes[32] expression, None if unknown
+    get_max_value(node)  # 255 for a uint8 expression
+"""
+from typing import Optional
+
+from .base import BaseNode
+from .expression_nodes import (
+    BinaryOp,
+    FunctionCall,
+    Group,
+    OpCall,
+    StdLibFunctionCall,
+    UnaryOp,
+)
+from .types import BitsType, BoxType, BytesType, IntType
+
+MAX_UINT = 2**64 - 1
+# The maximum size of a byte array on the stack
+MAX_BYTES = 4096
+
+# Ops returning an int of at most 0 or 1
+BOOLEAN_OPS = {"==", "!=", "<", ">", "<=", ">=", "&&", "||", "!", "getbit"}
+# Ops returning bytes of a fixed size
+SIZED_OPS = {
+    "itob": 8,
+    "sha256": 32,
+    "sha512_256": 32,
+    "sha3_256": 32,
+    "keccak256": 32,
+}
+
+
+def get_size(node: BaseNode) -> Optional[int]:
+    """Returns the length of a bytes expression if it is known at compile time."""
+    type = getattr(node, "type", None)
+    # the value of a box is its name, not the struct
+    if isinstance(type, BytesType) and type.size and not isinstance(type, BoxType):
+        return type.size
+    if isinstance(node, Group):
+        return get_size(node.expression)
+    if isinstance(node, (FunctionCall, StdLibFunctionCall)):
+        return get_size(node.func_call)
+    if isinstance(node, OpCall):
+        if node.name in SIZED_OPS:
+            return SIZED_OPS[node.name]
+        if node.name == "concat":
+            sizes = [get_size(arg) for arg in node.args]
+            if None not in sizes:
+                return sum(sizes)  # type: ignore
+        if node.name == "extract" and node.immediate_args:
+            length = int(node.immediate_args.split()[1])
+            return length or None
+        if node.name == "substring" and node.immediate_args:
+            start, end = map(int, node.immediate_args.split())
+            return end - start
+    return None
+
+
+def get_type_max_value(node: BaseNode) -> int:
+    type = getattr(node, "type", None)
+    if isinstance(type, BitsType):
+        return type.max_value
+    if isinstance(type, IntType) and type.size < 8:
+        return 2 ** (type.size * 8) - 1
+    return MAX_UINT
+
+
+def get_max_value(node: BaseNode) -> int:
+    """Returns an upper bound of the value of an int expression."""
+    value = getattr(node, "value", None)
+    if isinstance(getattr(node, "type", None), IntType) and isinstance(value, int):
+        return value
+    return min(get_type_max_value(node), get_op_max_value(node))
+
+
+def get_op_max_value(node: BaseNode) -> int:
+    if isinstance(node, Group):
+        return get_max_value(node.expression)
+    if isinstance(node, (FunctionCall, StdLibFunctionCall)):
+        return get_max_value(node.func_call)
+    if isinstance(node, UnaryOp):
+        return 1 if node.op == "!" else MAX_UINT
+    if isinstance(node, BinaryOp):
+        if node.op in BOOLEAN_OPS:
+            return 1
+        a, b = get_max_value(node.a), get_max_value(node.b)
+        if node.op == "%":
+            return max(min(a, b - 1), 0)
+        if node.op == "&":
+            return min(a, b)
+        if node.op in ("|", "^"):
+            return 2 ** max(a.bit_length(), b.bit_length()) - 1
+        if node.op in ("/", "-"):
+            return a
+        if node.op == "+":
+            return min(a + b, MAX_UINT)
+        if node.op == "*":
+            return min(a * b, MAX_UINT)
+    if isinstance(node, OpCall):
+        if node.name in BOOLEAN_OPS:
+            return 1
+        if node.name == "getbyte":
+            return 255
+        if node.name == "bitlen":
+            arg = node.args[0]
+            if isinstance(getattr(arg, "type", None), IntType):
+                return 64
+            # bitlen of bytes is up to 8 bits per byte
+            size = get_size(arg)
+            return 8 * (MAX_BYTES if size is None else size)
+        if node.name == "sqrt":
+            return 2**32 - 1
+        if node.name == "len":
+            size = get_size(node.args[0])
+            return MAX_BYTES if size is None else size
+        if node.name == "btoi":
+            size = get_size(node.args[0])
+            if size is not None and size <= 8:
+                return 2 ** (size * 8) - 1
+    return MAX_UINT
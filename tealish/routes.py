@@ -0,0 +1,238 @@
+"""
+Dispatch table of the routes of a router & decoder of application calls of them.
+
+The router dispatches on the name of the route in `Txn.ApplicationArgs[0]` (the
+selector) & passes the next application args to the function: ints are `btoi`-ed
+(uintN args are then asserted to fit), sized bytes & structs asserted to have their
+size. The return values are logged (ints as 8 bytes) after the ARC-4 return prefix.
+
+Example:
+    decoder = RouteDecoder(inspect_program(source)["routes"], application_id=APP_ID)
+    with open("transactions.ndjson") as f:
+        for call in decoder.iter_calls(read_transactions_file(f)):
+            ...
+"""
+import struct
+from base64 import b64decode
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional
+
+from .instrument import iter_transaction_logs
+from .tealish_builtins import constants
+from .types import BitsType, BytesType, IntType, TealishType, get_type_instance
+
+if TYPE_CHECKING:
+    from .nodes import Route
+
+RETURN_PREFIX = bytes.fromhex("151f7c75")
+ON_COMPLETIONS = [
+    "NoOp",
+    "OptIn",
+    "CloseOut",
+    "ClearState",
+    "UpdateApplication",
+    "DeleteApplication",
+]
+# OnCompletion of indexer transactions
+INDEXER_ON_COMPLETIONS = {
+    "noop": 0,
+    "optin": 1,
+    "closeout": 2,
+    "clear": 3,
+    "update": 4,
+    "delete": 5,
+}
+
+
+def get_value_layout(tealish_type: TealishType) -> Dict[str, Any]:
+    """
+    Returns the type, encoding & size (None if not fixed) of an arg or return value,
+    and the maximum value of ints.
+    """
+    if isinstance(tealish_type, IntType):
+        if isinstance(tealish_type, BitsType):
+            max_value = tealish_type.max_value
+        else:
+            max_value = 2 ** (tealish_type.size * 8) - 1
+        return {
+            "type": str(tealish_type),
+            "encoding": "uint",
+            "size": None,
+            "max_value": max_value,
+        }
+    size = tealish_type.size if isinstance(tealish_type, BytesType) else 0
+    return {"type": str(tealish_type), "encoding": "bytes", "size": size or None}
+
+
+def get_route_entry(route: "Route") -> Dict[str, Any]:
+    """Returns the entry of a (processed) route in the dispatch table."""
+    func = route.func
+    args = []
+    for name, type_name in func.args.args:
+        args.append({"name": name, **get_value_layout(get_type_instance(type_name))})
+    returns = []
+    for r in func.returns:
+        layout = get_value_layout(r)
+        # ints are returned with itob
+        if layout["encoding"] == "uint":
+            layout["size"] = 8
+        returns.append(layout)
+    return {
+        "name": route.name,
+        "selector": route.name.encode().hex(),
+        # CreateApplication routes assert ApplicationID == 0 instead
+        "on_completion": func.attributes["public"].get("OnCompletion", "NoOp"),
+        "args": args,
+        "returns": returns,
+    }
+
+
+def get_route_table(routes: Iterable["Route"]) -> List[Dict[str, Any]]:
+    return [get_route_entry(route) for route in routes]
+
+
+class Call:
+    """An application call of a route."""
+
+    __slots__ = ("route", "args", "returns", "txn")
+
+    def __init__(self, route: str, args: tuple, returns: Any, txn: Dict[str, Any]):
+        self.route = route
+        self.args = args
+        # the return values, None if not logged
+        self.returns = returns
+        self.txn = txn
+
+    def __repr__(self) -> str:
+        return f"Call({self.route!r}, args={self.args!r}, returns={self.returns!r})"
+
+
+class RouteCodec:
+    """Decodes the application args & the return log of a route."""
+
+    def __init__(self, entry: Dict[str, Any]) -> None:
+        self.name: str = entry["name"]
+        self.on_completion: str = entry["on_completion"]
+        self.is_create = self.on_completion == "CreateApplication"
+        self.on_completion_value = (
+            None if self.is_create else constants[self.on_completion][1]
+        )
+        self.uint_args = [a["encoding"] == "uint" for a in entry["args"]]
+        self.arg_max_values = [a.get("max_value") for a in entry["args"]]
+        self.arg_sizes = [a["size"] for a in entry["args"]]
+        returns = entry["returns"]
+        self.return_struct: Optional[struct.Struct] = None
+        self.returns_tail = False
+        if returns and all(r["size"] for r in returns[:-1]):
+            # bytes of unknown size can only be the last return value
+            self.returns_tail = returns[-1]["size"] is None
+            sized = returns[:-1] if self.returns_tail else returns
+            format = "".join(
+                "Q" if r["encoding"] == "uint" else f"{r['size']}s" for r in sized
+            )
+            self.return_struct = struct.Struct(">" + format)
+        self.has_returns = bool(returns)
+
+    def decode_args(self, app_args: List[bytes]) -> Optional[tuple]:
+        """Returns the args of the application args, None if the router rejects them."""
+        # the router does not check Txn.NumAppArgs, extra application args are ignored
+        if len(app_args) < len(self.uint_args) + 1:
+            return None
+        args = []
+        for value, is_uint, size, max_value in zip(
+            app_args[1:], self.uint_args, self.arg_sizes, self.arg_max_values
+        ):
+            if is_uint:
+                if len(value) > 8:
+                    return None
+                n = int.from_bytes(value, "big")
+                # uintN args are asserted to fit
+                if max_value is not None and n > max_value:
+                    return None
+                args.append(n)
+            elif size is not None and len(value) != size:
+                return None
+            else:
+                args.append(value)
+        return tuple(args)
+
+    def decode_returns(self, log: bytes) -> Any:
+        """Returns the return values of the return log (the bytes if not decodable)."""
+        data = log[len(RETURN_PREFIX) :]
+        if self.return_struct is None:
+            return data
+        values = self.return_struct.unpack_from(data)
+        if self.returns_tail:
+            values += (data[self.return_struct.size :],)
+        return values
+
+
+def get_application_call(txn: Dict[str, Any]) -> Optional[tuple]:
+    """
+    Returns the application id, the OnCompletion value & the application args of an
+    application call transaction (algod or indexer JSON), None for other transactions.
+    """
+    if "application-transaction" in txn:
+        app_txn = txn["application-transaction"]
+        app_id = app_txn.get("application-id", 0)
+        on_completion = INDEXER_ON_COMPLETIONS[app_txn.get("on-completion", "noop")]
+        app_args = app_txn.get("application-args", [])
+    else:
+        fields = txn.get("txn", {})
+        fields = fields.get("txn", fields)
+        if fields.get("type") != "appl":
+            return None
+        app_id = fields.get("apid", 0)
+        on_completion = fields.get("apan", 0)
+        app_args = fields.get("apaa", [])
+    app_args = [b64decode(a) if isinstance(a, str) else a for a in app_args]
+    return app_id, on_completion, app_args
+
+
+class RouteDecoder:
+    """
+    Classifies application calls by their route & decodes their args and return
+    values. Calls of other applications (if application_id is given) or rejected by
+    the router (unknown selector, wrong OnCompletion or args) are skipped.
+    """
+
+    def __init__(
+        self, table: List[Dict[str, Any]], application_id: Optional[int] = None
+    ) -> None:
+        self.application_id = application_id
+        self.routes: Dict[bytes, RouteCodec] = {
+            bytes.fromhex(entry["selector"]): RouteCodec(entry) for entry in table
+        }
+
+    def decode(self, txn: Dict[str, Any]) -> Optional[Call]:
+        """Returns the call of a transaction, None if it is not a call of a route."""
+        application_call = get_application_call(txn)
+        if application_call is None:
+            return None
+        app_id, on_completion, app_args = application_call
+        if self.application_id is not None and app_id not in (0, self.application_id):
+            return None
+        route = self.routes.get(app_args[0]) if app_args else None
+        if route is None:
+            return None
+        if route.is_create:
+            if app_id != 0:
+                return None
+        elif app_id == 0 or on_completion != route.on_completion_value:
+            return None
+        args = route.decode_args(app_args)
+        if args is None:
+            return None
+        returns = None
+        if route.has_returns:
+            # the return log is the last log
+            logs = list(iter_transaction_logs(txn))
+            if logs and logs[-1].startswith(RETURN_PREFIX):
+                returns = route.decode_returns(logs[-1])
+        return Call(route.name, args, returns, txn)
+
+    def iter_calls(self, transactions: Iterable[Dict[str, Any]]) -> Iterator[Call]:
+        """Yields the calls of routes of transactions (e.g. from `read_transactions_file`)."""
+        for txn in transactions:
+            call = self.decode(txn)
+            if call is not None:
+                yield call
@@ -1,14 +1,18 @@
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 from Cryptodome.Hash import SHA512
 from tealish import TealWriter
 from tealish.base import BaseNode
 from tealish.errors import CompileError, warning
-from tealish.expression_nodes import Integer
+from tealish.expression_nodes import BoxArrayField, Integer, Variable, write_ring_header
 from tealish.nodes import Node
+from tealish.ranges import MAX_BYTES, get_max_value, get_size
 from tealish.types import (
     AVMType,
     AnyType,
     BigIntType,
+    BoxMapType,
+    BoxRingType,
+    BoxType,
     BytesType,
     IntType,
     UIntType,
@@ -17,6 +21,9 @@ from tealish.types import (
 
 
 class FunctionCall(BaseNode):
+    # the result only depends on the args (used by the loop optimization)
+    is_pure = True
+
     def __init__(self, args: List["Node"], parent: Optional[BaseNode] = None) -> None:
         self.args = args
         self.parent = parent
@@ -40,6 +47,7 @@ class Pop(FunctionCall):
     """No-op function to allow using a value from the top of the stack"""
 
     name = "pop"
+    is_pure = False
 
     def process(self) -> None:
         self.type = AnyType()
@@ -52,6 +60,7 @@ class Push(FunctionCall):
     """Explicitly push arguments to the top of the stack"""
 
     name = "push"
+    is_pure = False
 
     def process(self) -> None:
         self.type = None
@@ -208,7 +217,40 @@ class FromBytes(FunctionCall):
             writer.write(self, "btoi // convert to int")
 
 
-class TypeAssertionWrapper(BaseNode):
+class AssertionWrapper(BaseNode):
+    """
+    Base of wrappers asserting the type of an expression at runtime.
+
+    The asserts optimization clears `checked` when `prove` shows the assertion always holds.
+    """
+
+    checked = True
+
+    def describe(self) -> str:
+        raise NotImplementedError()
+
+    def prove(self) -> Tuple[bool, str]:
+        """Returns whether the assertion always holds & the reason (or why it can't be proven)."""
+        raise NotImplementedError()
+
+
+def prove_size(expression: BaseNode, size: int) -> Tuple[bool, str]:
+    known_size = get_size(expression)
+    if known_size is None:
+        return False, f"the size of {expression.tealish()} is unknown"
+    if known_size != size:
+        return False, f"{expression.tealish()} has {known_size} bytes, it always fails"
+    return True, f"{expression.tealish()} has {size} bytes"
+
+
+def prove_bits(expression: BaseNode, bits: int) -> Tuple[bool, str]:
+    max_value = get_max_value(expression)
+    if max_value.bit_length() > bits:
+        return False, f"{expression.tealish()} can be up to {max_value}"
+    return True, f"{expression.tealish()} is at most {max_value}"
+
+
+class TypeAssertionWrapper(AssertionWrapper):
     def __init__(self, expression, types, return_val=True) -> None:
         self.expression = expression
         self.types = types if type(types) == list else [types]
@@ -224,8 +266,39 @@ class TypeAssertionWrapper(BaseNode):
         )
         self.parent = expression
 
+    def get_checks(self):
+        """Returns the types asserted (those not known from the incoming types)."""
+        checks = []
+        for i, type in enumerate(self.types):
+            if (
+                isinstance(type, BytesType)
+                and type.size
+                and type.size != self.incoming_types[i].size
+            ):
+                checks.append(type)
+            elif (
+                isinstance(type, UIntType) and type.size != self.incoming_types[i].size
+            ):
+                checks.append(type)
+        return checks
+
+    def describe(self) -> str:
+        return f"{self.expression.tealish()} is {', '.join(map(str, self.types))}"
+
+    def prove(self) -> Tuple[bool, str]:
+        checks = self.get_checks()
+        if len(self.types) > 1 and checks:
+            return False, "values of multiple values are not tracked"
+        for type in checks:
+            if isinstance(type, BytesType):
+                return prove_size(self.expression, type.size)
+            return prove_bits(self.expression, type.size * 8)
+        return True, "the types are known"
+
     def write_teal(self, writer):
         writer.write(self, self.expression)
+        if not self.checked:
+            return
         for i, type in enumerate(self.types):
             if (
                 isinstance(type, BytesType)
@@ -255,15 +328,23 @@ class TypeAssertionWrapper(BaseNode):
                 writer.write(self, "assert // Error: Incorrect size for assignment")
 
 
-class BytesSizeAssertionWrapper(BaseNode):
+class BytesSizeAssertionWrapper(AssertionWrapper):
     def __init__(self, expression, size) -> None:
         self.expression = expression
         self.size = size
         self.type = BytesType(size)
         self.parent = expression
 
+    def describe(self) -> str:
+        return f"len({self.expression.tealish()}) == {self.size}"
+
+    def prove(self) -> Tuple[bool, str]:
+        return prove_size(self.expression, self.size)
+
     def write_teal(self, writer):
         writer.write(self, self.expression)
+        if not self.checked:
+            return
         # Assert that the expression is bytes of size N
         writer.write(
             self,
@@ -278,15 +359,23 @@ class BytesSizeAssertionWrapper(BaseNode):
         )
 
 
-class UIntSizeAssertionWrapper(BaseNode):
+class UIntSizeAssertionWrapper(AssertionWrapper):
     def __init__(self, expression, size) -> None:
         self.expression = expression
         self.size = size
         self.type = UIntType(size)
         self.parent = expression
 
+    def describe(self) -> str:
+        return f"bitlen({self.expression.tealish()}) <= {self.size * 8}"
+
+    def prove(self) -> Tuple[bool, str]:
+        return prove_bits(self.expression, self.size * 8)
+
     def write_teal(self, writer):
         writer.write(self, self.expression)
+        if not self.checked:
+            return
         # Assert that the expression is an int of N*8 bits
         writer.write(
             self,
@@ -307,14 +396,18 @@ class BytesToUIntWrapper(BaseNode):
         self.size = size
         self.type = UIntType(size)
         self.parent = expression
+        # btoi of n <= 8 bytes is an int of n bytes
+        expression_size = get_size(expression)
+        if expression_size and expression_size < 8:
+            value_type = UIntType(expression_size)
+        else:
+            value_type = IntType()
+        self.assertion = UIntSizeAssertionWrapper(
+            TealWrapper([self.expression, "btoi"], value_type), self.type.size
+        )
 
     def write_teal(self, writer):
-        writer.write(
-            self,
-            UIntSizeAssertionWrapper(
-                TealWrapper([self.expression, "btoi"]), self.type.size
-            ),
-        )
+        writer.write(self, self.assertion)
 
 
 class UIntToBytesWrapper(BaseNode):
@@ -323,13 +416,16 @@ class UIntToBytesWrapper(BaseNode):
         self.size = size
         self.type = BytesType(size)
         self.parent = expression
+        self.assertion = None
+        if self.size:
+            self.assertion = UIntSizeAssertionWrapper(self.expression, self.size * 8)
 
     def write_teal(self, writer):
         if self.size == 0:
             writer.write(self, self.expression)
             writer.write(self, "itob")
         else:
-            writer.write(self, UIntSizeAssertionWrapper(self.expression, self.size * 8))
+            writer.write(self, self.assertion)
             writer.write(self, "itob")
             if self.size and self.size < 8:
                 writer.write(self, f"extract {8 - self.size} {self.size}")
@@ -341,14 +437,22 @@ class UIntToBytesWrapper(BaseNode):
 
 
 class TealWrapper(BaseNode):
-    def __init__(self, ops) -> None:
+    def __init__(self, ops, type=None) -> None:
         self.ops = ops
+        self.type = type
         self.parent = None
 
     def write_teal(self, writer):
         for op in self.ops:
             writer.write(self, op)
 
+    def _tealish(self) -> str:
+        # ops after the first expression are written as calls, e.g. btoi(x)
+        output = ""
+        for op in self.ops:
+            output = f"{op}({output})" if isinstance(op, str) else op.tealish()
+        return output
+
 
 class EnsureType(FunctionCall):
     name = "EnsureType"
@@ -379,6 +483,7 @@ class UncheckedCast(FunctionCall):
 
 class Error(FunctionCall):
     name = "Error"
+    is_pure = False
 
     def write_teal(self, writer: "TealWriter") -> None:
         writer.write(self, "err")
@@ -493,6 +598,7 @@ class ARC28Event(FunctionCall):
     def process(self) -> None:
         self.signature = self.args[0].value
         self.prefix = SHA512.new(self.signature.encode(), truncate="256").hexdigest()[:8]  # 4 bytes, 8 chars of hex
+        self.get_compiler().event_signatures[self.signature] = None
         for arg in self.args[1:]:
             arg.process()
         self.type = BytesType()
@@ -505,6 +611,283 @@ class ARC28Event(FunctionCall):
             writer.write(self, "concat")
 
 
+class BoxFunction(FunctionCall):
+    """A function reading boxes (or changing them if writes_boxes)."""
+
+    is_pure = False
+    writes_boxes = False
+
+
+class BoxMapFunction(BoxFunction):
+    """A function of the box of a box map key, e.g. `Exists(positions[Txn.Sender])`."""
+
+    def process(self) -> None:
+        self.entry = self.args[0]
+        if not (
+            isinstance(self.entry, BoxArrayField)
+            and not self.entry.fields
+            and self.entry.end is None
+        ):
+            raise CompileError(
+                f"{self.name} expects a box map key, e.g. {self.name}(positions[key])",
+                node=self,
+            )
+        self.entry.process()
+        if not isinstance(self.entry.array, BoxMapType):
+            raise CompileError(f"{self.entry.name} is not a box map", node=self)
+
+
+class Exists(BoxMapFunction):
+    """Returns 1 if the box of a box map key exists, 0 otherwise."""
+
+    name = "Exists"
+
+    def process(self) -> None:
+        super().process()
+        self.type = IntType()
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        self.entry.write_box_name(writer)
+        writer.write(self, ["box_len", "bury 1", f"// {self.tealish()}"])
+
+
+class Delete(BoxMapFunction):
+    """Deletes the box of a box map key if it exists."""
+
+    name = "Delete"
+    writes_boxes = True
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        self.entry.write_box_name(writer)
+        writer.write(self, ["box_del", "pop", f"// {self.tealish()}"])
+
+
+class RingFunction(BoxFunction):
+    """A function of a ring buffer (`boxring<Struct[capacity]>`), e.g. `RingLen(trades)`."""
+
+    def process(self) -> None:
+        for arg in self.args:
+            arg.process()
+        ring = self.args[0]
+        if not (isinstance(ring, Variable) and isinstance(ring.type, BoxRingType)):
+            raise CompileError(
+                f"{self.name} expects a ring buffer, got {ring.tealish()}", node=self
+            )
+        self.ring = ring.type
+        self.slot = ring.var.scratch_slot
+        self.element_size = self.ring.struct.size
+        self.type = AVMType.none
+
+
+class RingLen(RingFunction):
+    """Returns the number of elements of a ring buffer."""
+
+    name = "RingLen"
+
+    def process(self) -> None:
+        super().process()
+        self.type = IntType()
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        teal = [f"load {self.slot}", "pushint 8", "pushint 8", "box_extract", "btoi"]
+        writer.write(self, teal + [f"// {self.tealish()}"])
+
+
+class RingPush(RingFunction):
+    """Appends an element to a ring buffer, replacing the oldest one if it is full."""
+
+    name = "RingPush"
+    writes_boxes = True
+
+    def process(self) -> None:
+        super().process()
+        value = self.args[1]
+        if not self.ring.struct.can_hold(value.type):
+            raise CompileError(
+                f"Incorrect type for {self.name}. Expected {self.ring.struct}, got {value.type}",
+                node=self,
+            )
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        capacity = self.ring.length
+        writer.write(self, f"// {self.tealish()}")
+        write_ring_header(writer, self, self.args[0].var)
+        # the element at (head + count) % capacity
+        writer.write(self, f"dup2; +; pushint {capacity}; %")
+        writer.write(
+            self, f"pushint {self.element_size}; *; pushint {self.ring.header_size}; +"
+        )
+        writer.write(self, f"load {self.slot}; swap")
+        writer.write(self, self.args[1])
+        writer.write(self, "box_replace")
+        # if full the head moves, otherwise the count grows
+        writer.write(self, f"dup; pushint {capacity}; ==")
+        writer.write(self, f"uncover 2; dig 1; +; pushint {capacity}; %; cover 2")
+        writer.write(self, "!; +; itob; swap; itob; swap; concat")
+        writer.write(self, f"load {self.slot}; pushint 0; uncover 2; box_replace")
+
+
+class RingPop(RingFunction):
+    """Removes & returns the oldest element of a ring buffer, failing if it is empty."""
+
+    name = "RingPop"
+    writes_boxes = True
+
+    def process(self) -> None:
+        super().process()
+        self.type = self.ring.struct
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        capacity = self.ring.length
+        writer.write(self, f"// {self.tealish()}")
+        write_ring_header(writer, self, self.args[0].var)
+        writer.write(self, "dup; assert // not empty")
+        writer.write(self, "pushint 1; -")
+        writer.write(
+            self,
+            f"dig 1; pushint {self.element_size}; *; pushint {self.ring.header_size}; +",
+        )
+        writer.write(
+            self, f"load {self.slot}; swap; pushint {self.element_size}; box_extract"
+        )
+        # head = (head + 1) % capacity, count - 1
+        writer.write(self, f"cover 2; swap; pushint 1; +; pushint {capacity}; %; itob")
+        writer.write(self, "swap; itob; concat")
+        writer.write(self, f"load {self.slot}; pushint 0; uncover 2; box_replace")
+
+
+class BoxStreamFunction(BoxFunction):
+    """
+    A function of the contents of typed boxes in chunks of at most 4096 bytes (the
+    largest value on the stack), e.g. `BoxHash(blob, 1024)`.
+
+    The size of the box is known at compile time, so the chunks are read in a loop
+    of constant ops per chunk (or straight if there are only one or two) followed by
+    the remaining bytes.
+    """
+
+    # the number of box args
+    boxes = 1
+    max_chunk_size = MAX_BYTES
+
+    def process(self) -> None:
+        for arg in self.args:
+            arg.process()
+        self.slots = []
+        for arg in self.args[: self.boxes]:
+            if not (isinstance(arg, Variable) and isinstance(arg.type, BoxType)):
+                raise CompileError(
+                    f"{self.name} expects a box, got {arg.tealish()}", node=self
+                )
+            self.slots.append(arg.var.scratch_slot)
+        self.size = self.args[0].type.size
+        self.chunk_size = self.max_chunk_size
+        if len(self.args) > self.boxes:
+            self.chunk_size = getattr(self.args[self.boxes], "value", None)
+            if not isinstance(self.chunk_size, int) or not (
+                0 < self.chunk_size <= self.max_chunk_size
+            ):
+                raise CompileError(
+                    f"The chunk size of {self.name} must be an int from 1 to {self.max_chunk_size}",
+                    node=self,
+                )
+        # full chunks & the remaining bytes
+        self.chunks, self.remainder = divmod(self.size, self.chunk_size)
+        # labels of the loops are unique per program
+        compiler = self.get_compiler()
+        self.label = f"l{compiler.conditional_count}_chunks"
+        compiler.conditional_count += 1
+        self.type = AVMType.none
+
+
+class BoxHash(BoxStreamFunction):
+    """
+    Returns the sha256 of the contents of a box, chained across chunks:
+    `h = sha256(chunk_0)` then `h = sha256(h + chunk_i)`. The hash of a box of at
+    most one chunk is the sha256 of its contents.
+    """
+
+    name = "BoxHash"
+    # the chunk is hashed with the previous hash
+    max_chunk_size = MAX_BYTES - 32
+
+    def process(self) -> None:
+        super().process()
+        self.type = BytesType(32)
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        box, size = self.slots[0], self.chunk_size
+        writer.write(self, f"// {self.tealish()}")
+        first = size if self.chunks else self.remainder
+        writer.write(
+            self, f"load {box}; pushint 0; pushint {first}; box_extract; sha256"
+        )
+        if self.chunks > 2:
+            writer.write(self, f"pushint {size}")
+            writer.write(self, f"{self.label}:")
+            writer.write(self, f"load {box}; dig 1; pushint {size}; box_extract")
+            writer.write(self, "uncover 2; swap; concat; sha256; swap")
+            writer.write(
+                self, f"pushint {size}; +; dup; pushint {self.chunks * size}; <"
+            )
+            writer.write(self, f"bnz {self.label}; pop")
+        elif self.chunks == 2:
+            writer.write(
+                self, f"load {box}; pushint {size}; pushint {size}; box_extract"
+            )
+            writer.write(self, "concat; sha256")
+        if self.chunks and self.remainder:
+            writer.write(
+                self,
+                f"load {box}; pushint {self.chunks * size}; pushint {self.remainder}; box_extract",
+            )
+            writer.write(self, "concat; sha256")
+
+
+class BoxCopy(BoxStreamFunction):
+    """Copies the contents of a box to the start of another box at least as large."""
+
+    name = "BoxCopy"
+    boxes = 2
+    writes_boxes = True
+
+    def process(self) -> None:
+        super().process()
+        if self.args[1].type.size < self.size:
+            raise CompileError(
+                f"Box {self.args[1].tealish()} is smaller than {self.args[0].tealish()}",
+                node=self,
+            )
+
+    def write_teal(self, writer: "TealWriter") -> None:
+        src, dst = self.slots
+        size = self.chunk_size
+        writer.write(self, f"// {self.tealish()}")
+        if self.chunks > 2:
+            writer.write(self, "pushint 0")
+            writer.write(self, f"{self.label}:")
+            writer.write(
+                self,
+                f"load {dst}; dig 1; load {src}; dig 1; pushint {size}; box_extract",
+            )
+            writer.write(self, "box_replace")
+            writer.write(
+                self, f"pushint {size}; +; dup; pushint {self.chunks * size}; <"
+            )
+            writer.write(self, f"bnz {self.label}; pop")
+        else:
+            for i in range(self.chunks):
+                self.write_chunk(writer, i * size, size)
+        if self.remainder:
+            self.write_chunk(writer, self.chunks * size, self.remainder)
+
+    def write_chunk(self, writer: "TealWriter", offset: int, size: int) -> None:
+        src, dst = self.slots
+        writer.write(self, f"load {dst}; pushint {offset}")
+        writer.write(self, f"load {src}; pushint {offset}; pushint {size}; box_extract")
+        writer.write(self, "box_replace")
+
+
 functions = {
     f.name: f
     for f in [
@@ -521,6 +904,13 @@ functions = {
         Concat,
         Address,
         ARC28Event,
+        Exists,
+        Delete,
+        RingLen,
+        RingPush,
+        RingPop,
+        BoxHash,
+        BoxCopy,
     ]
 }
 
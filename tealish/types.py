@@ -1,6 +1,7 @@
 from enum import Enum
+import hashlib
 import re
-from typing import Dict
+from typing import Dict, Optional, Union
 
 
 # Set of custom defined types
@@ -89,6 +90,38 @@ class UInt8Type(UIntType):
     size = 1
 
 
+class BitsType(UIntType):
+    """
+    An int of fewer than 8 bits (`bool` or `uint1` - `uint7`), a type of struct fields.
+
+    Consecutive bit fields of a struct share bytes, packed from the most significant
+    bit. The field is at bit `bit_offset` of its byte (set by `StructType.add_field`).
+    """
+
+    size = 1
+
+    def __init__(self, bits: int, bit_offset: int = 0, name: Optional[str] = None):
+        self.bits = bits
+        self.bit_offset = bit_offset
+        self.name = name or f"uint{bits}"
+
+    @property
+    def max_value(self) -> int:
+        return 2**self.bits - 1
+
+    @property
+    def shift(self) -> int:
+        """The number of bits after the field in its byte."""
+        return 8 - self.bit_offset - self.bits
+
+    def can_hold(self, other):
+        # sets are asserted to fit at runtime unless they provably do
+        return isinstance(other, IntType)
+
+    def __str__(self) -> str:
+        return self.name
+
+
 class BytesType(TealishType):
     name = "bytes"
     avm_type = AVMType.bytes
@@ -131,6 +164,7 @@ class AddrType(BytesType):
 
 class StructField:
     tealish_type: "TealishType"
+    # the offset of the byte of bit fields
     offset: int
     size: int
 
@@ -152,8 +186,21 @@ class StructType(BytesType):
         self.name = name
         self.fields = {}
         self.size = 0
+        # the bits left in the last byte for consecutive bit fields
+        self.free_bits = 0
 
     def add_field(self, field_name: str, tealish_type: TealishType):
+        if isinstance(tealish_type, BitsType):
+            if tealish_type.bits > self.free_bits:
+                self.size += 1
+                self.free_bits = 8
+            tealish_type = BitsType(
+                tealish_type.bits, 8 - self.free_bits, tealish_type.name
+            )
+            self.free_bits -= tealish_type.bits
+            self.fields[field_name] = StructField(tealish_type, self.size - 1)
+            return
+        self.free_bits = 0
         field = StructField(
             tealish_type=tealish_type,
             offset=self.size,
@@ -180,6 +227,147 @@ class BoxType(BytesType):
         self.size = self.struct.size
 
 
+class BoxArrayType(BoxType):
+    """A box holding `length` structs, accessed by index (e.g. `orders[i].price`)."""
+
+    def __init__(self, struct_name: str, length: int):
+        super().__init__(struct_name)
+        self.length = length
+        self.size = self.struct.size * length
+        # fields belong to the elements
+        self.fields = {}
+
+    def __str__(self) -> str:
+        return f"box<{self.struct_name}[{self.length}]>"
+
+
+class BoxRingType(BoxArrayType):
+    """
+    A box used as a ring buffer of up to `length` structs, e.g. the latest trades.
+
+    The box starts with a header of the index of the oldest element (head) & the
+    number of elements (count), both uint64. `ring[i]` is the i-th oldest element.
+    """
+
+    header_size = 16
+
+    def __init__(self, struct_name: str, length: int):
+        super().__init__(struct_name, length)
+        self.size += self.header_size
+
+    def __str__(self) -> str:
+        return f"boxring<{self.struct_name}[{self.length}]>"
+
+
+# The longest box name
+MAX_BOX_NAME_SIZE = 64
+
+
+class BoxMapType(BytesType):
+    """
+    Boxes of `struct_name` structs named by a prefix & a key, e.g. `positions[Txn.Sender].amount`.
+
+    The name of a box is the prefix followed by the key (`itob` of int keys). Keys are
+    hashed with sha256 if they are unsized or too long for a box name, so names only
+    depend on the declaration & can be computed off chain with `get_box_name`.
+    """
+
+    name = "boxmap"
+
+    def __init__(self, key_type_name: str, struct_name: str, prefix: bytes = b""):
+        self.key_type_name = key_type_name
+        self.key_type = get_type_instance(key_type_name)
+        self.struct_name = struct_name
+        self.struct = get_struct(struct_name)
+        # the value of a box map is the prefix (set by its declaration)
+        self.prefix = prefix
+        self.size = 0
+
+    @property
+    def key_size(self) -> Optional[int]:
+        if isinstance(self.key_type, IntType):
+            return 8
+        elif isinstance(self.key_type, AddrType):
+            return 32
+        return self.key_type.size or None
+
+    @property
+    def hashed(self) -> bool:
+        key_size = self.key_size
+        return key_size is None or len(self.prefix) + key_size > MAX_BOX_NAME_SIZE
+
+    def can_hold_key(self, other: TealishType) -> bool:
+        if isinstance(self.key_type, IntType):
+            return self.key_type.can_hold(other)
+        elif self.hashed and not self.key_type.size:
+            return BytesType().can_hold(other)
+        # the name of a box is only deterministic if the key has the expected size
+        return BytesType(self.key_size).can_hold(other) or (
+            self.key_size == 32 and isinstance(other, AddrType)
+        )
+
+    def get_box_name(self, key: Union[int, bytes]) -> bytes:
+        """Returns the name of the box of key, e.g. to pass box references to app calls."""
+        if isinstance(key, int):
+            key = key.to_bytes(8, "big")
+        if self.hashed:
+            key = hashlib.sha256(key).digest()
+        return self.prefix + key
+
+    def __str__(self) -> str:
+        return f"boxmap<{self.key_type_name}, {self.struct_name}>"
+
+
+# The longest key & key + value of a global or local state entry
+MAX_STATE_KEY_SIZE = 64
+MAX_STATE_ENTRY_SIZE = 128
+
+
+class StateField:
+    tealish_type: "TealishType"
+    # the key as written in Tealish (e.g. "fee_rate")
+    key: str
+
+    def __init__(self, tealish_type: TealishType, key: str) -> None:
+        self.tealish_type = tealish_type
+        self.key = key
+        self.size = tealish_type.size
+
+    @property
+    def key_bytes(self) -> bytes:
+        return self.key.encode().decode("unicode_escape").encode("latin-1")
+
+
+class StateSchema:
+    """
+    The keys of the global or local state of an app & the types of their values.
+
+    Ints are stored as uints and other types as byte slices, giving the schema
+    (e.g. `GlobalNumUint` & `GlobalNumByteSlice`) to create the app with.
+    """
+
+    fields: Dict[str, StateField]
+
+    def __init__(self, scope: str) -> None:
+        # global or local
+        self.scope = scope
+        self.fields = {}
+        # the number of accesses of each key, to pool keys in a bytecblock
+        self.uses: Dict[str, int] = {}
+
+    def add_field(self, field_name: str, tealish_type: TealishType, key: str) -> None:
+        self.fields[field_name] = StateField(tealish_type, key)
+        self.uses[key] = 0
+
+    @property
+    def num_uints(self) -> int:
+        return sum(isinstance(f.tealish_type, IntType) for f in self.fields.values())
+
+    @property
+    def num_byte_slices(self) -> int:
+        return len(self.fields) - self.num_uints
+
+
 class ArrayType(BytesType):
     name = "array"
 
@@ -208,11 +396,26 @@ def get_type_instance(type_name):
         return AddrType()
     elif type_name == "uint8":
         return UInt8Type()
+    elif type_name == "bool":
+        return BitsType(1, name="bool")
+    elif m := re.fullmatch(r"uint([1-7])", type_name):
+        return BitsType(int(m.groups()[0]))
     elif type_name == "uint64":
         return IntType()
     elif m := re.match(r"bytes\[([0-9]+)\]", type_name):
         size = int(m.groups()[0])
         return BytesType(size)
+    elif m := re.match(
+        r"boxmap<(int|addr|bytes(?:\[[0-9]+\])?), ?([A-Z][a-zA-Z0-9_]+)>", type_name
+    ):
+        key_type_name, struct_name = m.groups()
+        return BoxMapType(key_type_name=key_type_name, struct_name=struct_name)
+    elif m := re.match(r"boxring<([A-Z][a-zA-Z0-9_]+)\[([0-9]+)\]>", type_name):
+        struct_name, length = m.groups()
+        return BoxRingType(struct_name=struct_name, length=int(length))
+    elif m := re.match(r"box<([A-Z][a-zA-Z0-9_]+)\[([0-9]+)\]>", type_name):
+        struct_name, length = m.groups()
+        return BoxArrayType(struct_name=struct_name, length=int(length))
     elif m := re.match(r"box<([A-Z][a-zA-Z0-9_]+)>", type_name):
         struct_name = m.groups()[0]
         return BoxType(struct_name=struct_name)
@@ -1,6 +1,11 @@
-from typing import Dict, List, Tuple, Optional, Union, Any
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple, Optional, Union, Any
 from algosdk.source_map import SourceMap
 
+# tealish line of pcs without one in a PcLineMap
+NO_LINE = -1
+
 
 def minify_teal(teal_lines: List[str]) -> Tuple[List[str], Dict[int, int]]:
     source_map: Dict[int, int] = {}
@@ -44,21 +49,127 @@ def strip_comments(teal_lines: List[str]) -> List[str]:
     return output
 
 
+class PcLineMap:
+    """
+    Array-backed pc -> (tealish line, error) of a TealishMap, to resolve many pcs (e.g.
+    of failed transactions) at once: the sorted pcs & parallel arrays of the tealish line
+    and the index of the error of each pc (0 if none, `error_messages[0]` is None).
+    """
+
+    def __init__(self, tealish_map: "TealishMap") -> None:
+        self.pcs = array("q", sorted(tealish_map.pc_teal))
+        self.lines = array("q")
+        self.error_indexes = array("q")
+        self.error_messages: List[Optional[str]] = [None]
+        self.table: Optional[List[Tuple[Optional[int], Optional[str]]]] = None
+        error_indexes: Dict[str, int] = {}
+        for pc in self.pcs:
+            line = tealish_map.teal_tealish.get(tealish_map.pc_teal[pc], NO_LINE)
+            self.lines.append(line)
+            error = tealish_map.errors.get(line)
+            if error is not None and error not in error_indexes:
+                error_indexes[error] = len(self.error_messages)
+                self.error_messages.append(error)
+            self.error_indexes.append(0 if error is None else error_indexes[error])
+
+    def resolve(self, pc: int) -> Tuple[Optional[int], Optional[str]]:
+        """Returns the tealish line & the error of a pc."""
+        i = bisect_left(self.pcs, pc)
+        if i == len(self.pcs) or self.pcs[i] != pc or self.lines[i] == NO_LINE:
+            return None, None
+        return self.lines[i], self.error_messages[self.error_indexes[i]]
+
+    def get_table(self) -> List[Tuple[Optional[int], Optional[str]]]:
+        """
+        Returns the results by pc, from 0 to the last pc (pcs are bounded by the size of
+        the program), for lookups without bisecting.
+        """
+        if self.table is None:
+            none: Tuple[Optional[int], Optional[str]] = (None, None)
+            table = [none] * (self.pcs[-1] + 1 if self.pcs else 0)
+            results: Dict[Tuple[int, int], Tuple[Optional[int], Optional[str]]] = {}
+            for pc, line, e in zip(self.pcs, self.lines, self.error_indexes):
+                if line != NO_LINE and pc >= 0:
+                    # pcs of the same line share the tuple
+                    key = (line, e)
+                    if key not in results:
+                        results[key] = (line, self.error_messages[e])
+                    table[pc] = results[key]
+            self.table = table
+        return self.table
+
+    def resolve_many(
+        self, pcs: Iterable[int]
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        """Returns the tealish line & the error of each pc."""
+        table = self.get_table()
+        size = len(table)
+        none = (None, None)
+        return [table[pc] if 0 <= pc < size else none for pc in pcs]
+
+
 class TealishMap:
     def __init__(self, map: Optional[Dict[str, Any]] = None) -> None:
         map = map or {}
+        # built on first use & reset when a map is set
+        self._tealish_teal: Optional[Dict[int, List[int]]] = None
+        self._pc_lines: Optional[PcLineMap] = None
         self.pc_teal = {int(k): int(v) for k, v in map.get("pc_teal", {}).items()}
         self.teal_tealish = {
             int(k): int(v) for k, v in map.get("teal_tealish", {}).items()
         }
-        self.errors: Dict[int, str] = {
-            int(k): v for k, v in map.get("errors", {}).items()
-        }
-        self.tealish_teal: Dict[int, List[int]] = {}
-        for teal, tealish in self.teal_tealish.items():
-            if tealish not in self.tealish_teal:
-                self.tealish_teal[tealish] = []
-            self.tealish_teal[tealish].append(teal)
+        self.errors = {int(k): v for k, v in map.get("errors", {}).items()}
+
+    def reset(self) -> None:
+        self._tealish_teal = None
+        self._pc_lines = None
+
+    @property
+    def pc_teal(self) -> Dict[int, int]:
+        return self._pc_teal
+
+    @pc_teal.setter
+    def pc_teal(self, pc_teal: Dict[int, int]) -> None:
+        self._pc_teal = pc_teal
+        self.reset()
+
+    @property
+    def teal_tealish(self) -> Dict[int, int]:
+        return self._teal_tealish
+
+    @teal_tealish.setter
+    def teal_tealish(self, teal_tealish: Dict[int, int]) -> None:
+        self._teal_tealish = teal_tealish
+        self.reset()
+
+    @property
+    def errors(self) -> Dict[int, str]:
+        return self._errors
+
+    @errors.setter
+    def errors(self, errors: Dict[int, str]) -> None:
+        self._errors = errors
+        self.reset()
+
+    @property
+    def tealish_teal(self) -> Dict[int, List[int]]:
+        if self._tealish_teal is None:
+            self._tealish_teal = {}
+            for teal, tealish in self.teal_tealish.items():
+                self._tealish_teal.setdefault(tealish, []).append(teal)
+        return self._tealish_teal
+
+    @property
+    def pc_lines(self) -> PcLineMap:
+        if self._pc_lines is None:
+            self._pc_lines = PcLineMap(self)
+        return self._pc_lines
+
+    def resolve_many(
+        self, pcs: Iterable[int]
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        """Returns the tealish line & the error of each pc."""
+        return self.pc_lines.resolve_many(pcs)
 
     def get_tealish_line_for_pc(self, pc: int) -> Optional[int]:
         teal_line = self.get_teal_line_for_pc(pc)
@@ -1,9 +1,15 @@
+from base64 import b64encode
+import io
+import json
 from pathlib import Path
 import unittest
 from unittest import expectedFailure
 from typing import List
 
 from tealish import (
+    compile_program,
+    emit_python_codecs,
+    inspect_program,
     reformat_program,
     TealishCompiler,
     TealWriter,
@@ -12,11 +18,37 @@ from tealish.errors import (
     CompileError,
     ParseError,
 )
+from tealish.events import EventDecoder, get_selector
+from tealish.dtypes import decode_records, get_bits, get_dtype_spec
+from tealish.cfg import (
+    ALL_SLOTS,
+    CFG,
+    ConstantPropagation,
+    Liveness,
+    ReachingDefinitions,
+    get_branch_targets,
+    get_ops,
+    solve,
+)
+from tealish.instrument import CostHistogram, decode_log, read_transactions_file
 from tealish.nodes import Node
+from tealish.optimizer import AST_PASSES, PASSES
+from tealish.profile import (
+    Profile,
+    get_line_functions,
+    line_fingerprints,
+    load_line_hits,
+)
 from tealish.tx_expressions import parse_expression
-from tealish.utils import strip_comments
+from tealish.utils import TealishMap, strip_comments
+from tealish.routes import RouteDecoder
 from tealish.scope import Scope
-from tealish.types import IntType
+from tealish.types import BoxMapType, IntType
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def compile_lines(source_lines: List[str]) -> List[str]:
@@ -1087,6 +1119,217 @@ class TestStructs(unittest.TestCase):
             ],
         )
 
+    def test_pass_nested_field_access(self):
+        teal = compile_min(
+            [
+                "struct Point:",
+                "   x: int",
+                "   y: int",
+                "end",
+                "struct Line:",
+                "   tag: bytes[4]",
+                "   a: Point",
+                "   b: Point",
+                "end",
+                "Line l = bzero(SizeOf(Line))",
+                "log(itob(l.b.y))",
+            ]
+        )
+        self.assertListEqual(teal[-3:], ["load 0; extract 28 8; btoi", "itob", "log"])
+
+    def test_fail_nested_field_of_non_struct(self):
+        with self.assertRaises(CompileError):
+            compile_min(
+                [
+                    "struct Item:",
+                    "   a: int",
+                    "end",
+                    "Item item1 = bzero(SizeOf(Item))",
+                    "log(itob(item1.a.b))",
+                ]
+            )
+
+
+class TestBitFields(unittest.TestCase):
+    struct = [
+        "struct Flags:",
+        "   id: int",
+        "   active: bool",
+        "   level: uint3",
+        "   kind: uint5",
+        "end",
+        "Flags f = bzero(SizeOf(Flags))",
+    ]
+
+    def test_pass_packed_layout(self):
+        output = inspect_program("\n".join(self.struct))
+        fields = output["structs"]["Flags"]["fields"]
+        self.assertEqual(output["structs"]["Flags"]["size"], 10)
+        self.assertEqual(
+            fields["level"],
+            {"type": "uint3", "size": 1, "offset": 8, "bit_offset": 1, "bits": 3},
+        )
+        # doesn't fit in the 4 bits left
+        self.assertEqual(
+            (fields["kind"]["offset"], fields["kind"]["bit_offset"]), (9, 0)
+        )
+
+    def test_pass_bit_field_access(self):
+        teal = compile_min(self.struct + ["log(itob(f.active))", "log(itob(f.level))"])
+        self.assertListEqual(
+            teal[3:],
+            [
+                "load 0; pushint 64; getbit",
+                "itob",
+                "log",
+                "load 0; pushint 8; getbyte; pushint 4; shr; pushint 7; &",
+                "itob",
+                "log",
+            ],
+        )
+
+    def test_pass_bit_field_assignment(self):
+        teal = compile_min(self.struct + ["f.active = 1", "f.level = Txn.NumAppArgs"])
+        self.assertListEqual(
+            teal[3:],
+            [
+                "load 0",
+                "pushint 64",
+                "pushint 1",
+                "setbit",
+                "store 0",
+                "load 0",
+                "pushint 8; dup2; getbyte; pushint 143; &",
+                "txn NumAppArgs",
+                "dup; pushint 7; <=; assert",
+                "pushint 4; shl; |; setbyte",
+                "store 0",
+            ],
+        )
+
+    def test_pass_box_bit_field_assignment(self):
+        teal = compile_min(self.struct[:-1] + ['box<Flags> b = Box("f")', "b.kind = 3"])
+        self.assertListEqual(
+            teal[2:],
+            [
+                "load 0; pushint 9; dup2; pushint 1; box_extract",
+                "pushint 0; dup2; getbyte; pushint 7; &",
+                "pushint 3",
+                "pushint 3; shl; |; setbyte",
+                "box_replace",
+            ],
+        )
+
+    def test_fail_bit_field_variable(self):
+        with self.assertRaises(CompileError):
+            compile_min(["bool b = 1"])
+
+
+class TestPythonCodecs(unittest.TestCase):
+    source = [
+        "struct Item:",
+        "   id: int",
+        "   name: bytes[4]",
+        "end",
+        "struct Order:",
+        "   item: Item",
+        "   kind: uint8",
+        "   active: bool",
+        "   level: uint3",
+        "   pass: bool",
+        "end",
+        "exit(1)",
+    ]
+
+    def get_module(self):
+        module = {}
+        exec(emit_python_codecs("\n".join(self.source)), module)
+        return module
+
+    def test_pass_format(self):
+        module = self.get_module()
+        self.assertEqual(module["Item"].STRUCT.format, ">Q4s")
+        # the nested struct is flattened & the bit fields share a byte
+        self.assertEqual(module["Order"].STRUCT.format, ">Q4sBB")
+        self.assertEqual(module["Order"].SIZE, module["Order"].STRUCT.size)
+        self.assertEqual(
+            module["Order"].__slots__, ("item", "kind", "active", "level", "pass_")
+        )
+
+    def test_pass_round_trip(self):
+        Item, Order = self.get_module()["Item"], self.get_module()["Order"]
+        order = Order(Item(5, b"abcd"), 200, True, 5, False)
+        data = order.encode()
+        # active is the most significant bit, level the next 3 bits
+        self.assertEqual(
+            data, (5).to_bytes(8, "big") + b"abcd" + bytes([200, 0b11010000])
+        )
+        self.assertEqual(Order.decode(data), order)
+        self.assertEqual(Order.decode(b"\x00" + data, offset=1).item.name, b"abcd")
+
+    def test_pass_iter_unpack(self):
+        Item = self.get_module()["Item"]
+        items = [Item(i, b"abcd") for i in range(3)]
+        buffer = b"".join(item.encode() for item in items)
+        self.assertListEqual(list(Item.iter_unpack(buffer)), items)
+
+    def test_fail_bit_field_out_of_range(self):
+        Item, Order = self.get_module()["Item"], self.get_module()["Order"]
+        for level in (8, 16, -1):
+            with self.assertRaises(ValueError):
+                Order(Item(5, b"abcd"), 200, False, level, True).encode()
+        with self.assertRaises(ValueError):
+            Order(Item(5, b"abcd"), 200, 2, 0, True).encode()
+
+
+class TestStructDtypes(unittest.TestCase):
+    source = TestPythonCodecs.source
+
+    def get_structs(self):
+        compiler = TealishCompiler(self.source)
+        compiler.compile()
+        return compiler.get_structs()
+
+    def test_pass_dtype_spec(self):
+        spec = get_dtype_spec(self.get_structs()["Order"])
+        self.assertListEqual(spec["names"], ["item", "kind", "active", "level", "pass"])
+        self.assertListEqual(spec["offsets"], [0, 12, 13, 13, 13])
+        self.assertEqual(spec["itemsize"], 14)
+        self.assertDictEqual(
+            spec["formats"][0],
+            {
+                "names": ["id", "name"],
+                "formats": [">u8", "V4"],
+                "offsets": [0, 8],
+                "itemsize": 12,
+            },
+        )
+        # bit fields are the byte they share
+        self.assertListEqual(spec["formats"][1:], ["u1", "u1", "u1", "u1"])
+
+    @unittest.skipUnless(numpy, "NumPy is not installed")
+    def test_pass_decode_records(self):
+        structs = self.get_structs()
+        module = {}
+        exec(emit_python_codecs("\n".join(self.source)), module)
+        Item, Order = module["Item"], module["Order"]
+        orders = [Order(Item(i, b"abcd"), i, i % 2, i % 8, False) for i in range(5)]
+        buffer = b"".join(order.encode() for order in orders)
+        records = decode_records(buffer, structs["Order"])
+        self.assertEqual(len(records), 5)
+        self.assertListEqual(records.item.id.tolist(), list(range(5)))
+        self.assertEqual(records.item.name[3].tobytes(), b"abcd")
+        self.assertListEqual(
+            get_bits(records, structs["Order"], "level").tolist(),
+            [i % 8 for i in range(5)],
+        )
+        self.assertListEqual(
+            get_bits(records, structs["Order"], "active").tolist(),
+            [bool(i % 2) for i in range(5)],
+        )
+        # a view of the buffer
+        self.assertFalse(records.flags.owndata)
+
 
 class TestBoxes(unittest.TestCase):
     def test_pass_create_box(self):
@@ -1237,6 +1480,450 @@ class TestBoxes(unittest.TestCase):
         )
 
 
+class TestBoxArrays(unittest.TestCase):
+    struct = [
+        "struct Order:",
+        "   price: int",
+        "   owner: bytes[4]",
+        "end",
+        'box<Order[100]> orders = CreateBox("orders")',
+    ]
+
+    def test_pass_create_box_array(self):
+        teal = compile_min(self.struct)
+        self.assertListEqual(
+            teal,
+            ['pushbytes "orders"', "dup; pushint 1200; box_create; assert", "store 0"],
+        )
+
+    def test_pass_field_access(self):
+        teal = compile_min(self.struct + ["int i = 1", "log(orders[i].owner)"])
+        self.assertListEqual(
+            teal[5:],
+            [
+                "load 0",
+                "load 1",
+                "dup; pushint 100; <; assert",
+                "pushint 12; *; pushint 8; +",
+                "pushint 4",
+                "box_extract",
+                "log",
+            ],
+        )
+
+    def test_pass_constant_index(self):
+        teal = compile_min(self.struct + ["log(itob(orders[2].price))"])
+        self.assertListEqual(
+            teal[3:],
+            ["load 0", "pushint 24", "pushint 8", "box_extract; btoi", "itob", "log"],
+        )
+
+    def test_pass_element_assignment(self):
+        teal = compile_min(
+            self.struct
+            + [
+                "Order o = orders[1]",
+                "orders[2] = o",
+                "int i = 1",
+                "orders[i].price = 5",
+            ]
+        )
+        self.assertListEqual(
+            teal[3:],
+            [
+                "load 0",
+                "pushint 12",
+                "pushint 12",
+                "box_extract",
+                "store 1",
+                "load 1",
+                "load 0",
+                "pushint 24",
+                "uncover 2; box_replace",
+                "pushint 1",
+                "store 2",
+                "pushint 5",
+                "itob",
+                "load 0",
+                "load 2",
+                "dup; pushint 100; <; assert",
+                "pushint 12; *",
+                "uncover 2; box_replace",
+            ],
+        )
+
+    def test_pass_slice(self):
+        teal = compile_min(self.struct + ["log(orders[0:10])"])
+        self.assertListEqual(
+            teal[3:], ["load 0", "pushint 0", "pushint 120", "box_extract", "log"]
+        )
+
+    def test_fail_index_out_of_bounds(self):
+        with self.assertRaises(CompileError):
+            compile_min(self.struct + ["log(orders[100].owner)"])
+
+    def test_fail_box_too_large(self):
+        with self.assertRaises(CompileError):
+            compile_min(
+                self.struct[:-1] + ['box<Order[3000]> orders = CreateBox("orders")']
+            )
+
+
+class TestBoxMaps(unittest.TestCase):
+    struct = [
+        "struct Position:",
+        "   amount: int",
+        "   owner: bytes[4]",
+        "end",
+        'boxmap<addr, Position> positions = BoxMap("p")',
+    ]
+
+    def test_pass_declaration(self):
+        teal = compile_min(self.struct)
+        self.assertListEqual(teal, ['pushbytes "p"', "store 0"])
+
+    def test_pass_field_access(self):
+        teal = compile_min(self.struct + ["log(positions[Txn.Sender].owner)"])
+        self.assertListEqual(
+            teal[2:],
+            [
+                "load 0",
+                "txn Sender",
+                "concat",
+                "pushint 8",
+                "pushint 4",
+                "box_extract",
+                "log",
+            ],
+        )
+
+    def test_pass_assignment(self):
+        teal = compile_min(
+            self.struct
+            + [
+                "Position p = positions[Txn.Sender]",
+                "positions[Txn.Sender] = p",
+                "positions[Txn.Sender].amount = 5",
+            ]
+        )
+        self.assertListEqual(
+            teal[2:],
+            [
+                "load 0",
+                "txn Sender",
+                "concat",
+                "box_get; assert",
+                "store 1",
+                "load 0",
+                "txn Sender",
+                "concat",
+                "load 1",
+                "box_put",
+                "pushint 5",
+                "itob",
+                "load 0",
+                "txn Sender",
+                "concat",
+                "pushint 0",
+                "uncover 2; box_replace",
+            ],
+        )
+
+    def test_pass_int_and_hashed_keys(self):
+        teal = compile_min(
+            self.struct[:-1]
+            + [
+                'boxmap<int, Position> by_id = BoxMap("i")',
+                'boxmap<bytes, Position> by_name = BoxMap("n")',
+                "log(by_id[1].owner)",
+                'log(by_name["abc"].owner)',
+            ]
+        )
+        self.assertListEqual(teal[4:7], ["load 0", "pushint 1", "itob; concat"])
+        self.assertListEqual(
+            teal[11:14], ["load 1", 'pushbytes "abc"', "sha256; concat"]
+        )
+
+    def test_pass_exists_and_delete(self):
+        teal = compile_min(
+            self.struct
+            + [
+                "if Exists(positions[Txn.Sender]):",
+                "   Delete(positions[Txn.Sender])",
+                "end",
+            ]
+        )
+        self.assertListEqual(
+            teal[2:],
+            [
+                "load 0",
+                "txn Sender",
+                "concat",
+                "box_len; bury 1",
+                "bz l0_end",
+                "load 0",
+                "txn Sender",
+                "concat",
+                "box_del; pop",
+                "l0_end:",
+            ],
+        )
+
+    def test_pass_box_names(self):
+        compile_min(self.struct)
+        positions = BoxMapType("addr", "Position", prefix=b"p")
+        self.assertEqual(positions.get_box_name(b"a" * 32), b"p" + b"a" * 32)
+        by_id = BoxMapType("int", "Position", prefix=b"i")
+        self.assertEqual(by_id.get_box_name(1), b"i" + (1).to_bytes(8, "big"))
+        by_name = BoxMapType("bytes", "Position", prefix=b"n")
+        self.assertEqual(len(by_name.get_box_name(b"abc")), 33)
+
+    def test_fail_wrong_key_type(self):
+        with self.assertRaises(CompileError):
+            compile_min(self.struct + ["log(positions[1].owner)"])
+        with self.assertRaises(CompileError):
+            compile_min(self.struct + ["log(positions[Txn.ApplicationArgs[0]].owner)"])
+
+    def test_fail_prefix(self):
+        with self.assertRaises(CompileError):
+            compile_min(
+                self.struct[:-1] + ["boxmap<addr, Position> p = BoxMap(Txn.Sender)"]
+            )
+        with self.assertRaises(CompileError):
+            compile_min(
+                self.struct[:-1]
+                + ['boxmap<bytes, Position> p = BoxMap("%s")' % ("x" * 33)]
+            )
+
+
+class TestBoxRings(unittest.TestCase):
+    struct = [
+        "struct Trade:",
+        "   price: int",
+        "   amount: uint8",
+        "end",
+        'boxring<Trade[100]> trades = CreateBox("trades")',
+    ]
+
+    def test_pass_create_ring(self):
+        teal = compile_min(self.struct)
+        self.assertListEqual(
+            teal,
+            ['pushbytes "trades"', "dup; pushint 916; box_create; assert", "store 0"],
+        )
+
+    def test_pass_element_access(self):
+        teal = compile_min(self.struct + ["log(itob(trades[1].amount))"])
+        self.assertListEqual(
+            teal[3:-2],
+            [
+                "load 0",
+                "pushint 1",
+                "load 0; pushint 0; pushint 16; box_extract",
+                "dup; pushint 0; extract_uint64; swap; pushint 8; extract_uint64",
+                "dig 2; >; assert",
+                "+; pushint 100; %",
+                "pushint 9; *; pushint 24; +",
+                "pushint 1",
+                "box_extract; btoi",
+            ],
+        )
+
+    def test_pass_push_pop_len(self):
+        teal = compile_min(
+            self.struct
+            + [
+                "Trade t = RingPop(trades)",
+                "RingPush(trades, t)",
+                "log(itob(RingLen(trades)))",
+            ]
+        )
+        self.assertIn("load 0; swap; pushint 9; box_extract", teal)
+        self.assertIn("dup2; +; pushint 100; %", teal)
+        self.assertListEqual(
+            teal[-4:],
+            [
+                "load 0; pushint 0; uncover 2; box_replace",
+                "load 0; pushint 8; pushint 8; box_extract; btoi",
+                "itob",
+                "log",
+            ],
+        )
+
+    def test_fail_slice(self):
+        with self.assertRaises(CompileError):
+            compile_min(self.struct + ["log(trades[0:2])"])
+
+    def test_fail_no_capacity(self):
+        with self.assertRaises(CompileError):
+            compile_min(self.struct[:-1] + ['boxring<Trade> trades = CreateBox("t")'])
+
+    def test_fail_push_wrong_type(self):
+        with self.assertRaises(CompileError):
+            compile_min(self.struct + ['RingPush(trades, "abc")'])
+
+
+class TestBoxStreaming(unittest.TestCase):
+    struct = [
+        "struct Blob:",
+        "   data: bytes[10000]",
+        "end",
+        'box<Blob> blob = Box("b")',
+        'box<Blob> copy = Box("c")',
+    ]
+
+    def test_pass_box_chunks(self):
+        teal = compile_min(
+            self.struct
+            + ["for offset, chunk in BoxChunks(blob, 4000):", "   log(chunk)", "end"]
+        )
+        self.assertListEqual(
+            teal[4:],
+            [
+                "pushint 0; store 2",
+                "l0_chunks:",
+                "load 0; load 2",
+                "pushint 10000; load 2; -; pushint 4000",
+                "dup2; >; select",
+                "box_extract; store 3",
+                "load 3",
+                "log",
+                "load 2; pushint 4000; +; dup",
+                "store 2; pushint 10000; <",
+                "bnz l0_chunks",
+                "l0_end:",
+            ],
+        )
+
+    def test_pass_box_hash(self):
+        teal = compile_min(self.struct + ["log(BoxHash(blob, 1000))"])
+        self.assertListEqual(
+            teal[4:],
+            [
+                "load 0; pushint 0; pushint 1000; box_extract; sha256",
+                "pushint 1000",
+                "l0_chunks:",
+                "load 0; dig 1; pushint 1000; box_extract",
+                "uncover 2; swap; concat; sha256; swap",
+                "pushint 1000; +; dup; pushint 10000; <",
+                "bnz l0_chunks; pop",
+                "log",
+            ],
+        )
+
+    def test_pass_box_copy(self):
+        teal = compile_min(self.struct + ["BoxCopy(blob, copy)"])
+        self.assertListEqual(
+            teal[4:7],
+            [
+                "load 1; pushint 0",
+                "load 0; pushint 0; pushint 4096; box_extract",
+                "box_replace",
+            ],
+        )
+        self.assertEqual(teal[-2], "load 0; pushint 8192; pushint 1808; box_extract")
+
+    def test_fail_chunk_size(self):
+        with self.assertRaises(CompileError):
+            compile_min(self.struct + ["log(BoxHash(blob, 4096))"])
+        with self.assertRaises(CompileError):
+            compile_min(
+                self.struct
+                + [
+                    "for offset, chunk in BoxChunks(blob, 5000):",
+                    "   log(chunk)",
+                    "end",
+                ]
+            )
+
+
+class TestState(unittest.TestCase):
+    state = [
+        "struct Pool:",
+        "   reserve: int",
+        "   fee: int",
+        "end",
+        "state global:",
+        '   manager: bytes[32] = "MANAGER"',
+        "   fee_rate: int",
+        "   pool: Pool",
+        "end",
+        "state local:",
+        "   balance: int",
+        "end",
+    ]
+
+    def test_pass_global_state(self):
+        teal = compile_min(
+            self.state
+            + [
+                "GlobalState.manager = Txn.Sender",
+                "log(itob(GlobalState.fee_rate))",
+                "log(itob(GlobalState.pool.fee))",
+            ]
+        )
+        self.assertListEqual(
+            teal,
+            [
+                'pushbytes "MANAGER"',
+                "txn Sender",
+                "app_global_put",
+                'pushbytes "fee_rate"; app_global_get',
+                "itob",
+                "log",
+                'pushbytes "pool"; app_global_get',
+                "extract 8 8; btoi",
+                "itob",
+                "log",
+            ],
+        )
+
+    def test_pass_local_state(self):
+        teal = compile_min(self.state + ["LocalState[Txn.Sender].balance = 5"])
+        self.assertListEqual(
+            teal, ["txn Sender", 'pushbytes "balance"', "pushint 5", "app_local_put"]
+        )
+
+    def test_pass_keys_pooled(self):
+        teal = compile_min(
+            ["#pragma version 8"]
+            + self.state
+            + [
+                "GlobalState.fee_rate = GlobalState.fee_rate + 1",
+                "LocalState[Txn.Sender].balance = LocalState[Txn.Sender].balance + 1",
+                "log(itob(LocalState[Txn.Sender].balance))",
+            ]
+        )
+        self.assertEqual(teal[1], 'bytecblock "balance" "fee_rate"')
+        self.assertEqual(teal[2:4], ["bytec_1", "bytec_1; app_global_get"])
+        self.assertNotIn('pushbytes "balance"', teal)
+
+    def test_pass_inspect_schema(self):
+        output = inspect_program("\n".join(self.state))
+        self.assertDictEqual(
+            output["state"]["global"]["keys"]["manager"],
+            {"key": "MANAGER", "type": "bytes[32]"},
+        )
+        self.assertEqual(output["state"]["global"]["num_uints"], 1)
+        self.assertEqual(output["state"]["global"]["num_byte_slices"], 2)
+        self.assertEqual(output["state"]["local"]["num_uints"], 1)
+        self.assertEqual(output["state"]["local"]["num_byte_slices"], 0)
+
+    def test_fail_wrong_type(self):
+        with self.assertRaises(CompileError):
+            compile_min(self.state + ['GlobalState.fee_rate = "a"'])
+
+    def test_fail_unknown_key(self):
+        with self.assertRaises(CompileError):
+            compile_min(self.state + ["log(itob(GlobalState.fee))"])
+        with self.assertRaises(CompileError):
+            compile_min(self.state + ["LocalState[Txn.Sender].fee_rate = 1"])
+
+    def test_fail_duplicate_key(self):
+        with self.assertRaises(CompileError):
+            compile_min(["state global:", "   a: int", '   b: int = "a"', "end"])
+
+
 class TestPseudoOp(unittest.TestCase):
     def test_pass_method_void(self):
         teal = compile_expression_min('method("name(uint64,uint64)")')
@@ -1475,3 +2162,1590 @@ class TestRouter(unittest.TestCase):
                 "retsub",
             ],
         )
+
+
+class TestRouteTable(unittest.TestCase):
+    source = [
+        "router:",
+        "   swap",
+        "   close",
+        "end",
+        "@public()",
+        "func swap(account: bytes[32], amount: int, fee: uint8) int, bytes:",
+        '   return amount, "ok"',
+        "end",
+        "@public(OnCompletion=CloseOut)",
+        "func close():",
+        "   return",
+        "end",
+    ]
+
+    def get_decoder(self, **kwargs):
+        compiler = TealishCompiler(self.source)
+        compiler.compile()
+        return RouteDecoder(compiler.get_routes(), **kwargs)
+
+    def get_txn(self, app_args, on_completion=0, app_id=5, logs=()):
+        return {
+            "txn": {
+                "txn": {
+                    "type": "appl",
+                    "apid": app_id,
+                    "apan": on_completion,
+                    "apaa": [b64encode(a).decode() for a in app_args],
+                }
+            },
+            "logs": [b64encode(log).decode() for log in logs],
+        }
+
+    def test_pass_table(self):
+        routes = inspect_program("\n".join(self.source))["routes"]
+        self.assertDictEqual(
+            routes[0],
+            {
+                "name": "swap",
+                "selector": b"swap".hex(),
+                "on_completion": "NoOp",
+                "args": [
+                    {
+                        "name": "account",
+                        "type": "bytes[32]",
+                        "encoding": "bytes",
+                        "size": 32,
+                    },
+                    {
+                        "name": "amount",
+                        "type": "int",
+                        "encoding": "uint",
+                        "size": None,
+                        "max_value": 2**64 - 1,
+                    },
+                    {
+                        "name": "fee",
+                        "type": "uint8",
+                        "encoding": "uint",
+                        "size": None,
+                        "max_value": 255,
+                    },
+                ],
+                "returns": [
+                    {
+                        "type": "int",
+                        "encoding": "uint",
+                        "size": 8,
+                        "max_value": 2**64 - 1,
+                    },
+                    {"type": "bytes", "encoding": "bytes", "size": None},
+                ],
+            },
+        )
+        self.assertEqual(routes[1]["on_completion"], "CloseOut")
+
+    def test_pass_decode(self):
+        decoder = self.get_decoder()
+        return_log = bytes.fromhex("151f7c75") + (7).to_bytes(8, "big") + b"ok"
+        txn = self.get_txn([b"swap", b"a" * 32, b"\x07", b"\x01"], logs=[return_log])
+        call = decoder.decode(txn)
+        self.assertEqual(call.route, "swap")
+        self.assertEqual(call.args, (b"a" * 32, 7, 1))
+        self.assertEqual(call.returns, (7, b"ok"))
+
+    def test_pass_indexer_transaction(self):
+        decoder = self.get_decoder()
+        txn = {
+            "application-transaction": {
+                "application-id": 5,
+                "on-completion": "closeout",
+                "application-args": [b64encode(b"close").decode()],
+            }
+        }
+        self.assertEqual(decoder.decode(txn).route, "close")
+
+    def test_pass_rejected_calls(self):
+        decoder = self.get_decoder(application_id=5)
+        calls = [
+            # wrong OnCompletion
+            self.get_txn([b"close"]),
+            # wrong arg size
+            self.get_txn([b"swap", b"a", b"\x07", b"\x01"]),
+            # missing arg
+            self.get_txn([b"swap", b"a" * 32, b"\x07"]),
+            # uint8 arg out of range
+            self.get_txn([b"swap", b"a" * 32, b"\x07", b"\x01\x2c"]),
+            # unknown selector
+            self.get_txn([b"mint"]),
+            # other application
+            self.get_txn([b"close"], on_completion=2, app_id=6),
+            {"txn": {"txn": {"type": "pay"}}},
+        ]
+        self.assertListEqual(list(decoder.iter_calls(calls)), [])
+
+    def test_pass_extra_app_args(self):
+        decoder = self.get_decoder()
+        # the router ignores the application args after the args of the route
+        txn = self.get_txn([b"swap", b"a" * 32, b"\x07", b"\xff", b"extra"])
+        self.assertEqual(decoder.decode(txn).args, (b"a" * 32, 7, 255))
+
+
+class TestTealishMap(unittest.TestCase):
+    def setUp(self):
+        self.map = TealishMap(
+            {
+                "pc_teal": {"0": "1", "1": "2", "3": "3", "6": "4"},
+                "teal_tealish": {"1": "1", "2": "2", "3": "2"},
+                "errors": {"2": "Insufficient balance"},
+            }
+        )
+
+    def test_pass_resolve_many(self):
+        pcs = [3, 0, 2, 6, 100, 1]
+        self.assertListEqual(
+            self.map.resolve_many(pcs),
+            [
+                (2, "Insufficient balance"),
+                (1, None),
+                (None, None),
+                (None, None),
+                (None, None),
+                (2, "Insufficient balance"),
+            ],
+        )
+        # the same as the lookups of each pc
+        self.assertListEqual(
+            self.map.resolve_many(pcs),
+            [
+                (self.map.get_tealish_line_for_pc(pc), self.map.get_error_for_pc(pc))
+                for pc in pcs
+            ],
+        )
+
+    def test_pass_lazy_reverse_index(self):
+        # the compiler sets the teal lines of the map after creating it
+        teal, tealish_map = compile_program("int x = 1\nexit(x)")
+        self.assertTrue(tealish_map.get_teal_lines_for_tealish(2))
+        self.assertEqual(self.map.get_teal_lines_for_tealish(2), [2, 3])
+
+    def test_pass_maps_set_after_use(self):
+        self.assertEqual(self.map.get_teal_lines_for_tealish(2), [2, 3])
+        self.assertListEqual(self.map.resolve_many([1]), [(2, "Insufficient balance")])
+        self.map.teal_tealish = {2: 5}
+        self.map.errors = {5: "Not allowed"}
+        self.assertEqual(self.map.get_teal_lines_for_tealish(2), [])
+        self.assertEqual(self.map.get_teal_lines_for_tealish(5), [2])
+        self.assertListEqual(
+            self.map.resolve_many([1, 3]), [(5, "Not allowed"), (None, None)]
+        )
+        self.map.pc_teal = {3: 2}
+        self.assertListEqual(
+            self.map.resolve_many([1, 3]), [(None, None), (5, "Not allowed")]
+        )
+
+    def test_pass_updated_sourcemap(self):
+        self.map.resolve_many([0])
+        self.map.update_from_teal_sourcemap(
+            {"version": 3, "sources": [], "names": [], "mappings": "AAAA;AACA"}
+        )
+        # pc 1 is teal line 1 now
+        self.assertListEqual(self.map.resolve_many([1]), [(1, None)])
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self) -> None:
+        self.source = "\n".join(
+            [
+                "int x = 1",
+                "x = add(x)",
+                "exit(x)",
+                "func add(a: int) int:",
+                "    return a + 1",
+                "end",
+            ]
+        )
+        teal, self.map = compile_program(self.source)
+        # one op per teal line so pc == teal line - 1
+        self.map.pc_teal = {i: i + 1 for i in range(len(teal))}
+        self.teal = teal
+
+    def pcs_for_line(self, line):
+        return [
+            pc
+            for pc, teal_line in self.map.pc_teal.items()
+            if self.map.teal_tealish.get(teal_line) == line
+        ]
+
+    def test_pass_line_totals(self):
+        profile = Profile(self.map, get_line_functions(self.source))
+        pcs = self.pcs_for_line(1)
+        profile.add_trace(pcs * 3)
+        profile.add_trace([{"pc": pcs[0], "cost": 10}])
+        hits, cost = profile.line_totals()[1]
+        self.assertEqual(hits, 4)
+        self.assertEqual(cost, len(pcs) * 3 + 10)
+        self.assertEqual(profile.steps, len(pcs) * 3 + 1)
+
+    def test_pass_function_totals(self):
+        profile = Profile(self.map, get_line_functions(self.source))
+        profile.add_trace(self.pcs_for_line(1) + self.pcs_for_line(4))
+        totals = profile.function_totals()
+        self.assertEqual(totals["main"], len(self.pcs_for_line(1)))
+        self.assertEqual(totals["add"], len(self.pcs_for_line(4)))
+
+    def test_pass_ndjson_trace_file(self):
+        profile = Profile(self.map)
+        pcs = self.pcs_for_line(1)
+        f = io.StringIO("\n".join(json.dumps([pc]) for pc in pcs * 2))
+        profile.add_trace_file(f)
+        self.assertEqual(profile.line_totals()[1], (2, len(pcs) * 2))
+
+    def test_pass_json_trace_file(self):
+        profile = Profile(self.map)
+        pcs = self.pcs_for_line(1)
+        f = io.StringIO(json.dumps({"trace": pcs}, indent=2))
+        profile.add_trace_file(f)
+        self.assertEqual(profile.line_totals()[1], (1, len(pcs)))
+
+
+class TestProfileGuidedLayout(unittest.TestCase):
+    def compile_with_profile(self, source_lines, profile):
+        compiler = TealishCompiler(source_lines, profile=profile)
+        compiler.compile()
+        return strip_comments(compiler.output), compiler
+
+    def test_pass_hot_then_laid_out_last(self):
+        teal, compiler = self.compile_with_profile(
+            [
+                "if Txn.NumAppArgs == 1:",
+                '    log("a")',
+                "else:",
+                '    log("b")',
+                "end",
+            ],
+            {1: 100, 2: 90, 4: 10},
+        )
+        self.assertListEqual(
+            teal,
+            [
+                "txn NumAppArgs",
+                "pushint 1",
+                "==",
+                "bnz l0_then",
+                'pushbytes "b"',
+                "log",
+                "b l0_end",
+                "l0_then:",
+                'pushbytes "a"',
+                "log",
+                "l0_end:",
+            ],
+        )
+        self.assertIn("estimated saving 80 ops", compiler.reports["pgo"][0])
+
+    def test_pass_cold_then_keeps_source_order(self):
+        source = ["if Txn.NumAppArgs == 1:", '    log("a")', "end"]
+        teal, compiler = self.compile_with_profile(source, {1: 100, 2: 1})
+        self.assertListEqual(teal, compile_min(source))
+        self.assertNotIn("pgo", compiler.reports)
+
+    def test_pass_switch_options_reordered(self):
+        teal, _ = self.compile_with_profile(
+            [
+                "switch Txn.NumAppArgs:",
+                "    1: a",
+                "    2: b",
+                "end",
+                "block a:",
+                "    exit(1)",
+                "end",
+                "block b:",
+                "    exit(2)",
+                "end",
+            ],
+            {1: 100, 6: 10, 9: 90},
+        )
+        self.assertListEqual(
+            teal[:8],
+            [
+                "txn NumAppArgs",
+                "pushint 2",
+                "==",
+                "bnz b",
+                "txn NumAppArgs",
+                "pushint 1",
+                "==",
+                "bnz a",
+            ],
+        )
+
+    def test_pass_switch_equal_options_kept(self):
+        cases = [
+            ("Txn.ApplicationArgs[0]", '"a"', '"\\x61"'),
+            ("Txn.NumAppArgs", "2", "TWO"),
+        ]
+        for expression, a, b in cases:
+            source = [
+                "const int TWO = 2",
+                f"switch {expression}:",
+                f"    {a}: a",
+                f"    {b}: b",
+                "end",
+                "block a:",
+                "    exit(1)",
+                "end",
+                "block b:",
+                "    exit(2)",
+                "end",
+            ]
+            # the same value, the first option must be checked first
+            teal, compiler = self.compile_with_profile(source, {2: 100, 7: 10, 10: 90})
+            self.assertListEqual(teal, compile_min(source))
+            self.assertNotIn("pgo", compiler.reports)
+
+    def test_pass_fingerprints_survive_edits(self):
+        source = 'int x = 1\nif x:\n    log("a")\nend'
+        fingerprints = line_fingerprints(source)
+        pgo = {"version": 1, "lines": {fingerprints[3]: 7}}
+        edited = "# new comment\nint y = 2\n" + source
+        self.assertEqual(load_line_hits(pgo, edited), {5: 7})
+
+
+class TestInstrument(unittest.TestCase):
+    def test_pass_func_instrumented(self):
+        compiler = TealishCompiler(
+            ["exit(1)", "func f():", "    return", "end"], instrument=True
+        )
+        teal = strip_comments(compiler.compile())
+        self.assertListEqual(
+            teal[2:],
+            [
+                "__func__f:",
+                "global OpcodeBudget; store 1",
+                "global OpcodeBudget; itob; load 1; itob; swap; concat; pushbytes 0x746c0000; swap; concat; log",
+                "retsub",
+            ],
+        )
+        self.assertEqual(
+            compiler.get_instrumentation(), {"prefix": "746c", "names": {0: "func f"}}
+        )
+
+    def test_pass_not_instrumented_by_default(self):
+        teal = compile_min(["exit(1)", "func f():", "    return", "end"])
+        self.assertNotIn("global OpcodeBudget", teal)
+
+    def test_pass_route_record_before_return_log(self):
+        compiler = TealishCompiler(
+            [
+                "router:",
+                "    f",
+                "end",
+                "@public()",
+                "func f() int:",
+                "    return 1",
+                "end",
+            ],
+            instrument=True,
+        )
+        teal = strip_comments(compiler.compile())
+        callsub = teal.index("callsub __func__f")
+        self.assertIn("pushbytes 0x746c0001", teal[callsub + 1])
+        self.assertEqual(teal[callsub + 3], "pushbytes 0x151f7c75; swap; concat; log")
+
+    def test_pass_histogram(self):
+        record = bytes.fromhex("746c0001") + (700).to_bytes(8, "big")
+        logs = [
+            b"other",
+            record + (600).to_bytes(8, "big"),
+            record + (690).to_bytes(8, "big"),
+        ]
+        self.assertEqual(decode_log(logs[1]), (1, 98))
+        self.assertIsNone(decode_log(logs[0]))
+        txns = json.dumps(
+            {"transactions": [{"logs": [b64encode(log).decode() for log in logs]}]}
+        )
+        histogram = CostHistogram({1: "func f"})
+        histogram.add_transactions(read_transactions_file(io.StringIO(txns)))
+        result = histogram.as_dict()["func f"]
+        self.assertEqual(result["calls"], 2)
+        self.assertEqual(result["total"], 106)
+        self.assertEqual(result["histogram"], {8: 1, 64: 1})
+
+
+def compile_optimized(source_lines, *passes, **kwargs):
+    compiler = TealishCompiler(source_lines, optimize=list(passes), **kwargs)
+    compiler.compile()
+    return strip_comments(compiler.output), compiler
+
+
+class TestEvents(unittest.TestCase):
+    signature = "swap(uint64,uint128,bool,bool,string,byte[4])"
+
+    def test_pass_registry(self):
+        source = [
+            'log(ARC28Event("set_manager(address)", Txn.Sender))',
+            'log(ARC28Event("set_manager(address)", Txn.Sender))',
+            "exit(1)",
+        ]
+        events = inspect_program("\n".join(source))["events"]
+        self.assertDictEqual(
+            events,
+            {
+                "ba87e7f4": {
+                    "signature": "set_manager(address)",
+                    "name": "set_manager",
+                    "args": [{"type": "address", "offset": 0, "size": 32}],
+                }
+            },
+        )
+
+    def test_pass_decode(self):
+        decoder = EventDecoder([self.signature, "set_manager(address)"])
+        head = (
+            (7).to_bytes(8, "big")
+            + (2**100).to_bytes(16, "big")
+            + bytes([0b01000000])
+            + (31).to_bytes(2, "big")
+            + b"abcd"
+        )
+        event, args = decoder.decode(
+            get_selector(self.signature) + head + b"\x00\x02hi"
+        )
+        self.assertEqual(event.name, "swap")
+        # bools share a byte & the string is after the head
+        self.assertEqual(args, (7, 2**100, False, True, "hi", b"abcd"))
+        self.assertIsNone(decoder.decode(b"\x00\x01\x02\x03"))
+
+    def test_pass_unsupported_args(self):
+        # tuples are not decoded, the args are the data after the selector
+        decoder = EventDecoder(["f((uint64,bool))"])
+        event, args = decoder.decode(get_selector("f((uint64,bool))") + b"data")
+        self.assertIsNone(event.args)
+        self.assertEqual(args, b"data")
+
+    def test_pass_iter_events(self):
+        decoder = EventDecoder(["t(uint64,uint8)"])
+        log = get_selector("t(uint64,uint8)") + (5).to_bytes(8, "big") + b"\x09"
+        txn = {"logs": [b64encode(log).decode(), b64encode(b"other").decode()]}
+        f = io.StringIO("\n".join([json.dumps(txn)] * 3))
+        events = list(decoder.iter_events(read_transactions_file(f)))
+        self.assertListEqual([args for _, args in events], [(5, 9)] * 3)
+
+    def test_pass_short_log(self):
+        decoder = EventDecoder(["t(uint64,uint8)"])
+        selector = get_selector("t(uint64,uint8)")
+        logs = [selector + b"\x05", selector + (5).to_bytes(8, "big") + b"\x09"]
+        txn = {"logs": [b64encode(log).decode() for log in logs]}
+        # a malformed log does not abort the stream, its args are the data after the selector
+        events = list(decoder.iter_events([txn]))
+        self.assertListEqual([args for _, args in events], [b"\x05", (5, 9)])
+
+
+class TestInline(unittest.TestCase):
+    def test_pass_small_func_inlined(self):
+        teal, compiler = compile_optimized(
+            [
+                "int x = add(1, 2)",
+                "exit(x)",
+                "func add(a: int, b: int) int:",
+                "    return a + b",
+                "end",
+            ],
+            "inline",
+        )
+        self.assertListEqual(
+            teal,
+            [
+                "pushint 1",
+                "pushint 2",
+                "store 1",
+                "store 2",
+                "load 2",
+                "load 1",
+                "+",
+                "store 0",
+                "load 0",
+                "return",
+            ],
+        )
+        self.assertEqual(
+            compiler.reports["inline"],
+            ["func add: inlined, out of line copy removed"],
+        )
+
+    def test_pass_multiple_returns(self):
+        teal, _ = compile_optimized(
+            [
+                "exit(f(1) + f(2))",
+                "@inline()",
+                "func f(a: int) int:",
+                "    if a:",
+                "        return 1",
+                "    end",
+                "    return 2",
+                "end",
+            ],
+            "inline",
+        )
+        self.assertListEqual(
+            teal[:11],
+            [
+                "pushint 1",
+                "store 1",
+                "load 1",
+                "bz l0_end_i1",
+                "pushint 1",
+                "b __func__f__return_i1",
+                "l0_end_i1:",
+                "pushint 2",
+                "__func__f__return_i1:",
+                "pushint 2",
+                "store 1",
+            ],
+        )
+        self.assertIn("l0_end_i2:", teal)
+        self.assertNotIn("retsub", teal)
+
+    def test_pass_recursive_func_not_inlined(self):
+        source = [
+            "exit(f(3))",
+            "func f(n: int) int:",
+            "    if n:",
+            "        return f(n - 1)",
+            "    end",
+            "    return 1",
+            "end",
+        ]
+        teal, compiler = compile_optimized(source, "inline")
+        self.assertListEqual(teal, compile_min(source))
+        self.assertNotIn("inline", compiler.reports)
+
+    def test_pass_threshold(self):
+        source = [
+            "exit(f(1) + f(2))",
+            "func f(a: int) int:",
+            "    return a + 1",
+            "end",
+        ]
+        teal, _ = compile_optimized(source, "inline", inline_threshold=4)
+        self.assertNotIn("callsub __func__f", teal)
+        teal, _ = compile_optimized(source, "inline", inline_threshold=3)
+        self.assertListEqual(teal, compile_min(source))
+
+    def test_pass_profiled_calls(self):
+        source = [
+            "int x = hot(1)",
+            "x = x + hot(2)",
+            "x = x + cold(1)",
+            "x = x + cold(2)",
+            "exit(x)",
+            "func hot(a: int) int:",
+            "    return ((a * 3) + (a / 2)) + (a % 5)",
+            "end",
+            "func cold(a: int) int:",
+            "    return a + 1",
+            "end",
+        ]
+        teal, _ = compile_optimized(source, "inline")
+        self.assertIn("callsub __func__hot", teal)
+        self.assertNotIn("callsub __func__cold", teal)
+        # hot funcs are inlined up to a higher threshold, funcs never called are not inlined
+        profile = {1: 10, 2: 10, 3: 10, 4: 10, 5: 10, 7: 20}
+        teal, compiler = compile_optimized(source, "inline", profile=profile)
+        self.assertNotIn("callsub __func__hot", teal)
+        self.assertIn("callsub __func__cold", teal)
+        self.assertEqual(
+            compiler.reports["inline"],
+            ["func hot: inlined (20 profiled calls), out of line copy removed"],
+        )
+
+    def test_pass_unused_func_not_inlined(self):
+        source = [
+            "exit(1)",
+            "func f():",
+            "    return",
+            "end",
+        ]
+        teal, compiler = compile_optimized(source, "inline")
+        self.assertListEqual(teal, compile_min(source))
+        self.assertNotIn("inline", compiler.reports)
+
+    def test_pass_string_literals(self):
+        # string literals with ops aren't calls or returns
+        teal, compiler = compile_optimized(
+            [
+                'log("a; callsub __func__f")',
+                "exit(f())",
+                "func f() int:",
+                '    log("b; retsub")',
+                "    return 7",
+                "end",
+            ],
+            "inline",
+        )
+        self.assertEqual(
+            compiler.reports["inline"],
+            ["func f: inlined, out of line copy removed"],
+        )
+        self.assertIn('pushbytes "b; retsub"', teal)
+        self.assertNotIn("retsub", teal)
+
+    def test_pass_source_map(self):
+        _, compiler = compile_optimized(
+            ["exit(f())", "func f() int:", "    return 7", "end"], "inline"
+        )
+        lines = [
+            compiler.source_map[i + 1]
+            for i, teal in enumerate(compiler.output)
+            if teal.strip() == "pushint 7"
+        ]
+        self.assertEqual(len(lines), 1)
+        self.assertIn(lines[0], [2, 3])
+
+
+class TestDeadCodeElimination(unittest.TestCase):
+    def test_pass_unreachable_code_removed(self):
+        teal, compiler = compile_optimized(
+            [
+                "if Txn.NumAppArgs == 0:",
+                "    exit(1)",
+                '    log("never")',
+                "end",
+                "jump main",
+                "block main:",
+                "    exit(used())",
+                "end",
+                "block unused:",
+                "    exit(0)",
+                "end",
+                "func used() int:",
+                "    return 1",
+                "end",
+                "func unused_func():",
+                "    return",
+                "end",
+            ],
+            "dce",
+        )
+        self.assertListEqual(
+            teal,
+            [
+                "txn NumAppArgs",
+                "pushint 0",
+                "==",
+                "bz l0_end",
+                "pushint 1",
+                "return",
+                "l0_end:",
+                "b main",
+                "main:",
+                "callsub __func__used",
+                "return",
+                "__func__used:",
+                "pushint 1",
+                "retsub",
+            ],
+        )
+        self.assertListEqual(
+            compiler.reports["dce"],
+            [
+                "line 3: unreachable code removed",
+                "block unused removed (unreachable)",
+                "func unused_func removed (unreachable)",
+                "5 ops removed",
+            ],
+        )
+
+    def test_pass_reachable_code_kept(self):
+        source = [
+            "switch Txn.NumAppArgs:",
+            "    0: a",
+            "end",
+            "block a:",
+            "    exit(1)",
+            "end",
+        ]
+        teal, compiler = compile_optimized(source, "dce")
+        self.assertListEqual(teal, compile_min(source))
+        self.assertNotIn("dce", compiler.reports)
+
+
+def get_lines(source_lines):
+    compiler = TealishCompiler(source_lines)
+    teal = compiler.compile()
+    return [(line, compiler.source_map[i + 1]) for i, line in enumerate(teal)]
+
+
+class TestCFG(unittest.TestCase):
+    source = [
+        "int x = 1",
+        "int y = 2",
+        "if Txn.NumAppArgs:",
+        "    y = 3",
+        "end",
+        "log(itob(x + y))",
+        "exit(f())",
+        "func f() int:",
+        "    return 1",
+        "end",
+    ]
+
+    def test_pass_blocks(self):
+        cfg = CFG(get_lines(self.source))
+        labels = [block.labels for block in cfg.blocks]
+        self.assertListEqual(labels, [[], [], ["l0_end"], ["__func__f"]])
+        entry, then, end, func = cfg.blocks
+        self.assertListEqual(entry.successors, [then, end])
+        self.assertListEqual(then.successors, [end])
+        self.assertListEqual(end.successors, [])
+        self.assertListEqual(end.calls, ["__func__f"])
+        self.assertListEqual(cfg.get_entries(), [entry, func])
+        self.assertEqual(cfg.reachable(), {0, 1, 2, 3})
+
+    def test_pass_constant_propagation(self):
+        cfg = CFG(get_lines(self.source))
+        values_in, _ = solve(cfg, ConstantPropagation())
+        # x is 1 on both paths, y is 2 or 3
+        self.assertEqual(values_in[2], {0: 1})
+        self.assertEqual(values_in[1], {0: 1, 1: 2})
+
+    def test_pass_reaching_definitions(self):
+        lines = get_lines(self.source)
+        cfg = CFG(lines)
+        values_in, _ = solve(cfg, ReachingDefinitions())
+        stores = {
+            lines[i][1]: (i, slot) for i, slot in values_in[2] if slot is not None
+        }
+        self.assertEqual(sorted(stores), [1, 2, 4])
+
+    def test_pass_liveness(self):
+        cfg = CFG(get_lines(self.source))
+        live_in, live_out = solve(cfg, Liveness())
+        # y is overwritten in the then block, x isn't
+        self.assertIn(0, live_in[1])
+        self.assertNotIn(1, live_in[1])
+        self.assertTrue({0, 1} <= live_out[0])
+        self.assertFalse({0, 1} & live_in[0])
+        # the call can read any slot
+        self.assertEqual(live_in[2], ALL_SLOTS)
+
+    def test_pass_string_literal_ops(self):
+        self.assertListEqual(
+            get_ops('pushbytes "a; b c"; log // "x; retsub"'),
+            ['pushbytes "a; b c"', "log"],
+        )
+        self.assertListEqual(get_branch_targets('pushbytes "a; b c"'), [])
+
+    def test_pass_string_literals_all_passes(self):
+        source = [
+            'log("hello; b world")',
+            'log("x; return")',
+            'log("y; retsub")',
+            "f()",
+            "exit(1)",
+            "func f():",
+            '    log("z; retsub")',
+            "    return",
+            "end",
+        ]
+        passes = list(AST_PASSES) + list(PASSES)
+        for optimize in [[p] for p in passes] + [passes]:
+            teal, _ = compile_optimized(source, *optimize)
+            for literal in ["hello; b world", "x; return", "y; retsub", "z; retsub"]:
+                self.assertIn(f'pushbytes "{literal}"', teal, optimize)
+            self.assertEqual(teal.count("log"), 4, optimize)
+            self.assertEqual(teal[teal.index("pushint 1") + 1], "return", optimize)
+
+
+class TestJumpThreading(unittest.TestCase):
+    def test_pass_threaded_to_loop_start(self):
+        teal, compiler = compile_optimized(
+            [
+                "int i = 0",
+                "while i < 10:",
+                "    i = i + 1",
+                "    if i == 1:",
+                '        log("one")',
+                "    end",
+                "end",
+                "exit(1)",
+            ],
+            "jumps",
+        )
+        self.assertListEqual(
+            teal[14:],
+            [
+                "bz l0_while",
+                'pushbytes "one"',
+                "log",
+                "b l0_while",
+                "l0_end:",
+                "pushint 1",
+                "return",
+            ],
+        )
+        self.assertEqual(
+            compiler.reports["jumps"],
+            [
+                "1 branches threaded to their final target",
+                "1 unused labels removed",
+            ],
+        )
+
+    def test_pass_unused_func_labels_kept(self):
+        # unused funcs & blocks are removed by dce, not left without their labels
+        source = [
+            "exit(1)",
+            "block unused:",
+            "    exit(0)",
+            "end",
+            "func f():",
+            '    log("f")',
+            "    return",
+            "end",
+        ]
+        teal, compiler = compile_optimized(source, "jumps")
+        self.assertListEqual(teal, compile_min(source))
+        self.assertIn("__func__f:", teal)
+        self.assertIn("unused:", teal)
+        self.assertNotIn("jumps", compiler.reports)
+
+    def test_pass_branch_inverted(self):
+        teal, compiler = compile_optimized(
+            [
+                "if Txn.NumAppArgs == 0:",
+                "    jump main",
+                "end",
+                "exit(0)",
+                "block main:",
+                "    exit(1)",
+                "end",
+            ],
+            "jumps",
+        )
+        self.assertListEqual(
+            teal,
+            [
+                "txn NumAppArgs",
+                "pushint 0",
+                "==",
+                "bnz main",
+                "pushint 0",
+                "return",
+                "main:",
+                "pushint 1",
+                "return",
+            ],
+        )
+
+    def test_pass_source_map_kept(self):
+        _, compiler = compile_optimized(
+            ["if Txn.NumAppArgs == 0:", "    jump main", "end", "exit(0)"]
+            + ["block main:", "    exit(1)", "end"],
+            "jumps",
+        )
+        source_map = {
+            teal.strip(): compiler.source_map[i + 1]
+            for i, teal in enumerate(compiler.output)
+        }
+        self.assertEqual(source_map["bnz main"], 1)
+        self.assertEqual(source_map["main:"], 5)
+
+
+class TestFieldCSE(unittest.TestCase):
+    def test_pass_group_field_cached(self):
+        teal, compiler = compile_optimized(
+            [
+                "assert(Gtxn[+1].Amount > 10)",
+                "int x = Gtxn[+1].Amount",
+                "if x > 20:",
+                "    x = Gtxn[+1].Amount + 1",
+                "end",
+                "exit(x)",
+            ],
+            "cse",
+        )
+        self.assertListEqual(
+            teal[:9],
+            [
+                "txn GroupIndex",
+                "pushint 1",
+                "+",
+                "gtxns Amount",
+                "dup; store 1",
+                "pushint 10",
+                ">",
+                "assert",
+                "load 1",
+            ],
+        )
+        self.assertEqual(teal.count("load 1"), 2)
+        self.assertEqual(
+            compiler.reports["cse"],
+            ["line 1: Gtxn[+1].Amount read 3 times cached in slot 1, saving 4 ops"],
+        )
+
+    def test_pass_single_op_read_not_cached(self):
+        teal, compiler = compile_optimized(
+            ["log(Txn.Sender)", "log(Txn.Sender)", "exit(1)"],
+            "cse",
+        )
+        self.assertEqual(teal.count("txn Sender"), 2)
+        self.assertEqual(
+            compiler.reports["cse"],
+            ["line 1: Txn.Sender read 2 times not cached (1 op read)"],
+        )
+
+    def test_pass_conditional_read_not_cached(self):
+        teal, compiler = compile_optimized(
+            [
+                "int x = 0",
+                "if Txn.NumAppArgs == 1:",
+                "    x = Gtxn[+1].Amount",
+                "end",
+                "exit(Gtxn[+1].Amount + x)",
+            ],
+            "cse",
+        )
+        self.assertEqual(teal.count("gtxns Amount"), 2)
+        self.assertNotIn("cse", compiler.reports)
+
+
+class TestLoops(unittest.TestCase):
+    def test_pass_while_rotated(self):
+        teal, compiler = compile_optimized(
+            [
+                "int i = 0",
+                "while i < 10:",
+                "    i = i + 1",
+                "end",
+                "exit(i)",
+            ],
+            "loops",
+        )
+        self.assertListEqual(
+            teal[2:],
+            [
+                "load 0",
+                "pushint 10",
+                "<",
+                "bz l0_end",
+                "l0_while:",
+                "load 0",
+                "pushint 1",
+                "+",
+                "store 0",
+                "load 0",
+                "pushint 10",
+                "<",
+                "bnz l0_while",
+                "l0_end:",
+                "load 0",
+                "return",
+            ],
+        )
+        self.assertEqual(compiler.reports["loops"], ["1 loops rotated"])
+
+    def test_pass_invariants_hoisted(self):
+        teal, compiler = compile_optimized(
+            [
+                "int i = 0",
+                "int total = 0",
+                "while i < (Txn.NumAppArgs - 1):",
+                "    total = total + (btoi(Txn.ApplicationArgs[1]) * i)",
+                "    i = i + 1",
+                "end",
+                "exit(total)",
+            ],
+            "loops",
+        )
+        self.assertListEqual(
+            teal[4:12],
+            [
+                "txn NumAppArgs",
+                "pushint 1",
+                "-",
+                "store 2",
+                "load 0",
+                "load 2",
+                "<",
+                "bz l0_end",
+            ],
+        )
+        self.assertListEqual(teal[12:15], ["txna ApplicationArgs 1", "btoi", "store 3"])
+        self.assertEqual(teal.count("txn NumAppArgs"), 1)
+        self.assertEqual(
+            compiler.reports["loops"],
+            [
+                "line 3: (Txn.NumAppArgs - 1) hoisted out of the loop into slot 2",
+                "line 3: btoi(Txn.ApplicationArgs[1]) hoisted out of the loop into slot 3",
+                "1 loops rotated",
+            ],
+        )
+
+    def test_pass_variant_not_hoisted(self):
+        teal, compiler = compile_optimized(
+            [
+                "int x = 1",
+                "for i in 0:10:",
+                "    log(itob(x + 1))",
+                "    x = x * 2",
+                "end",
+                "exit(1)",
+            ],
+            "loops",
+        )
+        self.assertEqual(compiler.reports["loops"], ["1 loops rotated"])
+
+    def test_pass_not_hoisted_after_break(self):
+        teal, compiler = compile_optimized(
+            [
+                "int i = 0",
+                "while i < 10:",
+                "    if i == Txn.NumAppArgs:",
+                "        break",
+                "    end",
+                "    log(itob(btoi(Txn.ApplicationArgs[0]) + 1))",
+                "    i = i + 1",
+                "end",
+                "exit(1)",
+            ],
+            "loops",
+        )
+        self.assertEqual(compiler.reports["loops"], ["1 loops rotated"])
+
+    def test_pass_box_read_not_hoisted_when_written(self):
+        teal, compiler = compile_optimized(
+            [
+                "struct Item:",
+                "    count: int",
+                "end",
+                'box<Item> item = OpenBox("a")',
+                "for _ in 0:3:",
+                "    item.count = item.count + 1",
+                "end",
+                "for _ in 0:3:",
+                "    log(itob(item.count))",
+                "end",
+                "exit(1)",
+            ],
+            "loops",
+        )
+        self.assertEqual(
+            compiler.reports["loops"],
+            [
+                "line 8: itob(item.count) hoisted out of the loop into slot 1",
+                "2 loops rotated",
+            ],
+        )
+
+
+class TestUnroll(unittest.TestCase):
+    def test_pass_fully_unrolled(self):
+        teal, compiler = compile_optimized(
+            [
+                "int total = 0",
+                "for i in 0:3:",
+                "    total = total + i",
+                "end",
+                "exit(total)",
+            ],
+            "unroll",
+        )
+        self.assertListEqual(
+            teal[2:],
+            [
+                "pushint 0; store 1",
+                "load 0",
+                "load 1",
+                "+",
+                "store 0",
+                "pushint 1; store 1",
+                "load 0",
+                "load 1",
+                "+",
+                "store 0",
+                "pushint 2; store 1",
+                "load 0",
+                "load 1",
+                "+",
+                "store 0",
+                "load 0",
+                "return",
+            ],
+        )
+        self.assertEqual(compiler.reports["unroll"], ["line 2: unrolled 3 iterations"])
+
+    def test_pass_unrolled_by_factor(self):
+        teal, compiler = compile_optimized(
+            [
+                "int total = 0",
+                "@unroll(factor=2)",
+                "for _ in 0:5:",
+                "    if total > 2:",
+                "        total = total + 1",
+                "    end",
+                "end",
+                "exit(total)",
+            ],
+            "unroll",
+        )
+        # 1 iteration peeled & 2 iterations of the loop of 2 copies
+        self.assertEqual(teal.count("pushint 2"), 3)
+        self.assertIn("l1_end_u0:", teal)
+        self.assertIn("l1_end_u2:", teal)
+        self.assertListEqual(
+            teal[-8:],
+            [
+                "l1_end_u2:",
+                "pushint 2; +; dup",
+                "pushint 5",
+                "!=",
+                "bnz l0_for",
+                "pop",
+                "load 0",
+                "return",
+            ],
+        )
+        self.assertEqual(compiler.reports["unroll"], ["line 3: unrolled by 2"])
+
+    def test_pass_size_limit(self):
+        source = [
+            "int total = 0",
+            "for _ in 0:20:",
+            "    total = total + 1",
+            "end",
+            "exit(total)",
+        ]
+        _, compiler = compile_optimized(source, "unroll", unroll_limit=80)
+        self.assertEqual(compiler.reports["unroll"], ["line 2: unrolled 20 iterations"])
+        _, compiler = compile_optimized(source, "unroll", unroll_limit=16)
+        self.assertEqual(compiler.reports["unroll"], ["line 2: unrolled by 4"])
+        _, compiler = compile_optimized(source, "unroll", unroll_limit=4)
+        self.assertEqual(
+            compiler.reports["unroll"],
+            ["line 2: not unrolled, 20 iterations of 4 ops exceed the limit"],
+        )
+
+    def test_pass_loop_variable_assigned(self):
+        _, compiler = compile_optimized(
+            [
+                "for i in 0:3:",
+                "    i = i + 1",
+                "end",
+                "exit(1)",
+            ],
+            "unroll",
+        )
+        self.assertEqual(
+            compiler.reports["unroll"],
+            ["line 1: not unrolled, i is assigned in the loop"],
+        )
+
+    def test_unroll_decorator_format(self):
+        source = "@unroll(factor=4)\nfor i in 0:8:\n    log(itob(i))\nend\n"
+        self.assertEqual(reformat_program(source), source)
+
+
+class TestStack(unittest.TestCase):
+    def test_pass_used_once(self):
+        teal, compiler = compile_optimized(
+            ["int x = Txn.Fee", "log(itob(x))", "exit(1)"], "stack"
+        )
+        self.assertListEqual(teal, ["txn Fee", "itob", "log", "pushint 1", "return"])
+        self.assertEqual(
+            compiler.reports["stack"],
+            ["line 1: slot 0 kept on the stack (1 loads), saving 2 ops"],
+        )
+
+    def test_pass_used_twice(self):
+        teal, _ = compile_optimized(
+            ["int x = Txn.Fee", "log(itob(x + x))", "exit(1)"], "stack"
+        )
+        self.assertListEqual(
+            teal, ["txn Fee", "dup", "+", "itob", "log", "pushint 1", "return"]
+        )
+
+    def test_pass_value_under_others(self):
+        teal, _ = compile_optimized(
+            [
+                "int x = Txn.Fee",
+                "int y = Txn.FirstValid",
+                "log(itob((x * y) + x))",
+                "exit(y)",
+            ],
+            "stack",
+        )
+        # y is still used after the log so it stays in its slot
+        self.assertListEqual(
+            teal[:9],
+            [
+                "txn Fee",
+                "txn FirstValid",
+                "store 1",
+                "dup",
+                "load 1",
+                "*",
+                "swap",
+                "+",
+                "itob",
+            ],
+        )
+
+    def test_pass_func_locals(self):
+        teal, _ = compile_optimized(
+            [
+                "exit(f(2))",
+                "func f(a: int) int:",
+                "    int b = a * a",
+                "    return b + a",
+                "end",
+            ],
+            "stack",
+        )
+        # the slots of f are dead when it returns
+        self.assertListEqual(
+            teal[3:], ["__func__f:", "dup", "dig 1", "*", "swap", "+", "retsub"]
+        )
+
+    def test_pass_call(self):
+        teal, compiler = compile_optimized(
+            [
+                "int x = Txn.Fee",
+                "log(itob(f() + x))",
+                "exit(1)",
+                "func f() int:",
+                "    return 1",
+                "end",
+            ],
+            "stack",
+        )
+        # the value would have to stay on the stack across the call
+        self.assertListEqual(
+            teal[:4], ["txn Fee", "store 0", "callsub __func__f", "load 0"]
+        )
+        self.assertNotIn("stack", compiler.reports)
+
+
+class TestAssertions(unittest.TestCase):
+    source = [
+        "bytes[32] a = Cast(Rpad(Txn.ApplicationArgs[0], 32), bytes[32])",
+        "bytes[32] b = Cast(Txn.ApplicationArgs[1], bytes[32])",
+        "uint8 c = Cast(Txn.NumAppArgs % 256, uint8)",
+        "uint8 d = Cast(Txn.NumAppArgs, uint8)",
+        "exit(1)",
+    ]
+
+    def test_pass_remove_proven(self):
+        teal, compiler = compile_optimized(self.source, "asserts")
+        self.assertEqual(len([line for line in teal if "assert" in line]), 2)
+        self.assertListEqual(
+            teal[6:10], ["txn NumAppArgs", "pushint 256", "%", "store 2"]
+        )
+        self.assertEqual(
+            compiler.reports["asserts"],
+            [
+                "line 1: len(Rpad(Txn.ApplicationArgs[0], 32)) == 32 removed, "
+                "Rpad(Txn.ApplicationArgs[0], 32) has 32 bytes",
+                "line 3: bitlen(Txn.NumAppArgs % 256) <= 8 removed, "
+                "Txn.NumAppArgs % 256 is at most 255",
+            ],
+        )
+
+    def test_report_assertions(self):
+        _, compiler = compile_optimized(self.source, "asserts", report_assertions=True)
+        self.assertEqual(
+            compiler.reports["assertions"],
+            [
+                "line 2: len(Txn.ApplicationArgs[1]) == 32 kept, "
+                "the size of Txn.ApplicationArgs[1] is unknown",
+                "line 4: bitlen(Txn.NumAppArgs) <= 8 kept, "
+                "Txn.NumAppArgs can be up to 18446744073709551615",
+            ],
+        )
+        # without the optimization provable assertions are reported too
+        compiler = TealishCompiler(self.source, report_assertions=True)
+        compiler.compile()
+        self.assertEqual(len(compiler.reports["assertions"]), 4)
+        self.assertTrue(
+            compiler.reports["assertions"][0].endswith(", -O asserts removes it")
+        )
+
+    def test_pass_struct_field(self):
+        teal, _ = compile_optimized(
+            [
+                "struct Item:",
+                "    owner: bytes[32]",
+                "    count: uint8",
+                "end",
+                "Item item = Cast(bzero(33), Item)",
+                "bytes[1] b = Convert(item.count, bytes[1])",
+                "uint8 c = Convert(b, uint8)",
+                "exit(1)",
+            ],
+            "asserts",
+        )
+        self.assertFalse([line for line in teal if "assert" in line])
+
+    def test_pass_bitlen_of_bytes(self):
+        teal, compiler = compile_optimized(
+            [
+                "uint8 x = Cast(bitlen(Txn.ApplicationArgs[0]), uint8)",
+                "uint8 y = Cast(bitlen(bzero(1)), uint8)",
+                "exit(1)",
+            ],
+            "asserts",
+        )
+        # bitlen of bytes can be up to 8 * 4096, of 1 byte up to 8
+        self.assertEqual(len([line for line in teal if "assert" in line]), 1)
+        self.assertEqual(
+            compiler.reports["asserts"],
+            [
+                "line 2: bitlen(bitlen(bzero(1))) <= 8 removed, "
+                "bitlen(bzero(1)) is at most 8",
+            ],
+        )
+
+
+class TestFieldExtracts(unittest.TestCase):
+    struct = [
+        "struct Item:",
+        "    id: int",
+        "    name: bytes[10]",
+        "    description: bytes[20]",
+        "end",
+    ]
+
+    def test_pass_extract_of_field(self):
+        teal, compiler = compile_optimized(
+            self.struct
+            + [
+                "Item item = bzero(SizeOf(Item))",
+                "log(extract(2, 3, item.name))",
+                "log(itob(extract_uint32(item.description, 4)))",
+            ],
+            "fields",
+        )
+        self.assertListEqual(
+            teal[3:],
+            [
+                "load 0; extract 10 3",
+                "log",
+                "load 0; extract 22 4; btoi",
+                "itob",
+                "log",
+            ],
+        )
+        self.assertEqual(
+            compiler.reports["fields"][0],
+            "line 7: extract(2, 3, item.name) read with one extract, saving 1 ops",
+        )
+
+    def test_pass_concat_adjacent_fields(self):
+        teal, _ = compile_optimized(
+            self.struct
+            + [
+                'box<Item> item = OpenBox("a")',
+                "log(concat(item.name, item.description))",
+            ],
+            "fields",
+        )
+        self.assertListEqual(
+            teal[-2:], ["load 0; pushint 8; pushint 30; box_extract", "log"]
+        )
+
+    def test_pass_keep_other_reads(self):
+        source = self.struct + [
+            "Item item = bzero(SizeOf(Item))",
+            "Item other = bzero(SizeOf(Item))",
+            # not adjacent
+            "log(concat(item.description, item.name))",
+            # different structs
+            "log(concat(item.name, other.description))",
+            # outside the field, fails at runtime
+            "log(extract(8, 4, item.name))",
+        ]
+        teal, compiler = compile_optimized(source, "fields")
+        self.assertListEqual(teal, compile_min(source))
+        self.assertNotIn("fields", compiler.reports)
+
+
+class TestBoxCoalescing(unittest.TestCase):
+    struct = [
+        "struct Item:",
+        "    id: int",
+        "    foo: int",
+        "end",
+    ]
+
+    def test_pass_load_once(self):
+        teal, compiler = compile_optimized(
+            self.struct
+            + [
+                'box<Item> item = OpenBox("a")',
+                "item.foo = item.foo + item.id",
+                "log(itob(item.foo * item.id))",
+                "exit(1)",
+            ],
+            "boxes",
+        )
+        self.assertListEqual(
+            teal[3:],
+            [
+                "load 0; box_get; assert; store 1",
+                "load 1; extract 8 8; btoi",
+                "load 1; extract 0 8; btoi",
+                "+",
+                "itob; load 1; swap; replace 8; store 1",
+                "load 1; extract 8 8; btoi",
+                "load 1; extract 0 8; btoi",
+                "*",
+                "itob",
+                "log",
+                "load 0; load 1; box_put",
+                "pushint 1",
+                "return",
+            ],
+        )
+        self.assertEqual(
+            compiler.reports["boxes"],
+            [
+                "line 6: box item read 4 times & set 1 times loaded into slot 1,"
+                " saving 1 ops"
+            ],
+        )
+
+    def test_pass_field_wise(self):
+        source = self.struct + [
+            'box<Item> item = OpenBox("a")',
+            "log(itob(item.id))",
+            "exit(1)",
+        ]
+        teal, compiler = compile_optimized(source, "boxes")
+        self.assertListEqual(teal, compile_min(source))
+        self.assertEqual(
+            compiler.reports["boxes"],
+            [
+                "line 6: box item read 1 times & set 0 times kept field-wise,"
+                " loading it costs 2 more ops"
+            ],
+        )
+
+    def test_pass_calls(self):
+        source = self.struct + [
+            'box<Item> item = OpenBox("a")',
+            "log(itob((item.id + item.foo) + (item.id * item.foo)))",
+            "f()",
+            "exit(1)",
+            "func f():",
+            '    box<Item> other = OpenBox("b")',
+            "    other.id = 1",
+            "    return",
+            "end",
+        ]
+        teal, compiler = compile_optimized(source, "boxes")
+        self.assertListEqual(teal, compile_min(source))
+        self.assertEqual(
+            compiler.reports["boxes"][0],
+            "line 6: box item kept field-wise, f() accesses boxes",
+        )
+
+    def test_pass_box_may_not_exist(self):
+        _, compiler = compile_optimized(
+            self.struct
+            + [
+                'box<Item> item = Box("a")',
+                "if Txn.NumAppArgs:",
+                "    log(itob((item.id + item.foo) + (item.id * item.foo)))",
+                "end",
+                "exit(1)",
+            ],
+            "boxes",
+        )
+        self.assertEqual(
+            compiler.reports["boxes"],
+            ["line 6: box item kept field-wise, it may not exist at line 6"],
+        )
+
+
+class TestStateCache(unittest.TestCase):
+    state = [
+        "state global:",
+        "    n: int",
+        "end",
+        "state local:",
+        "    balance: int",
+        "end",
+    ]
+
+    def test_pass_local_state_cached(self):
+        teal, compiler = compile_optimized(
+            self.state
+            + [
+                "int x = LocalState[Txn.Sender].balance",
+                "if x > 1:",
+                "    x = LocalState[Txn.Sender].balance * 2",
+                "end",
+                "exit(LocalState[Txn.Sender].balance + x)",
+            ],
+            "state",
+        )
+        self.assertEqual(
+            teal[:3],
+            ["txn Sender", 'pushbytes "balance"; app_local_get', "dup; store 1"],
+        )
+        self.assertEqual(teal.count("load 1"), 2)
+        self.assertEqual(
+            compiler.reports["state"],
+            [
+                "line 7: LocalState[Txn.Sender].balance read 3 times cached"
+                + " in slot 1, saving 2 ops"
+            ],
+        )
+        # the loads aren't counted as uses of the key
+        self.assertEqual(compiler.state_keys, [])
+
+    def test_pass_write_invalidates(self):
+        read = "log(itob(LocalState[Txn.Sender].balance))"
+        teal, compiler = compile_optimized(
+            self.state
+            + [read] * 3
+            + ["LocalState[Txn.Accounts[1]].balance = 0"]
+            + [read] * 3
+            + ["exit(1)"],
+            "state",
+        )
+        self.assertEqual(sum("app_local_get" in t for t in teal), 2)
+        self.assertEqual(len(compiler.reports["state"]), 2)
+
+    def test_pass_func_call_invalidates(self):
+        _, compiler = compile_optimized(
+            self.state
+            + [
+                "log(itob(LocalState[Txn.Sender].balance))",
+                "f()",
+                "log(itob(LocalState[Txn.Sender].balance))",
+                "log(itob(LocalState[Txn.Sender].balance))",
+                "exit(1)",
+                "func f():",
+                "    LocalState[Txn.Accounts[1]].balance = 1",
+                "    return",
+                "end",
+            ],
+            "state",
+        )
+        self.assertEqual(
+            compiler.reports["state"],
+            [
+                "line 9: LocalState[Txn.Sender].balance read 2 times not cached"
+                + " (3 op read)"
+            ],
+        )
+
+    def test_pass_loop_condition_not_cached(self):
+        source = self.state + [
+            "log(itob(GlobalState.n))",
+            "while GlobalState.n < 10:",
+            "    GlobalState.n = GlobalState.n + 1",
+            "end",
+            "exit(1)",
+        ]
+        teal, compiler = compile_optimized(source, "state")
+        self.assertListEqual(teal, compile_min(source))